@@ -1,4 +1,5 @@
 # coding: utf-8
+import multiprocessing
 import sys
 
 from src.sammie.py import settings
@@ -6,6 +7,8 @@ from src.sammie.py import eelutil
 from src.sammie.py.eelinterface import *
 
 if __name__ == '__main__':
+    #required for worker processes in the bundled executable
+    multiprocessing.freeze_support()
     if '--develop' in sys.argv:
         while True:
             print("(RE) STARTING SERVER IN DEV MODE on http://localhost:3000")
@@ -16,4 +16,8 @@ if(eel){
     function asyncError(callbackID,data) {
         window.__eel_js_asyncError(callbackID,data);
     }
+    eel.expose(partialResult,'partialResult');
+    function partialResult(callbackID,key,chunk) {
+        window.__eel_js_partialResult(callbackID,key,chunk);
+    }
 }
@@ -0,0 +1,62 @@
+# Benchmarks CellDetection.floodFillCells against the previous per-pixel flood fill on a synthetic thinned image.
+# Run from the root folder: python scripts/benchmark_floodfill.py [size] [referenceSize]
+import os
+import sys
+
+import cv2
+import numpy as np
+import skimage.morphology
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.py.modules.CellDetection import CellDetection
+from src.sammie.py.util import util
+
+
+def floodFillCellsReference(thinnedImg):
+    """Previous implementation, flood filling one area at a time"""
+    curFill = 2
+    filledImage = np.copy(thinnedImg).astype('int32')
+    for r in range(0, thinnedImg.shape[0]):
+        for c in range(0, thinnedImg.shape[1]):
+            if filledImage[r, c] != 0: continue
+            mask = skimage.morphology.flood(thinnedImg, (r, c), connectivity=1)
+            filledImage[mask] = curFill
+            curFill += 1
+
+    filledImage[filledImage == 1] = 0
+    return filledImage
+
+
+def makeThinnedImage(size:int, cellRadius:int = 25):
+    """Creates a 0/1 thinned image of a dense field of cell outlines, as produced by the Thinning step"""
+    rng = np.random.default_rng(0)
+    img = np.zeros((size, size), dtype='uint8')
+    numCells = int(size * size / (cellRadius * cellRadius * 2))
+    for i in range(numCells):
+        center = tuple(int(v) for v in rng.integers(0, size, 2))
+        axes = tuple(int(v) for v in rng.integers(cellRadius // 2, cellRadius, 2))
+        cv2.ellipse(img, center, axes, float(rng.integers(0, 180)), 0, 360, 255, 2)
+
+    return (cv2.ximgproc.thinning(img) > 0).astype('uint8')
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    referenceSize = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+
+    thinned = makeThinnedImage(size)
+    util.tic()
+    filled = CellDetection.floodFillCells(None, thinned)
+    util.toc('label based fill on %dx%d (%d areas)' % (size, size, filled.max() - 1))
+
+    #the reference is quadratic in the number of areas, so it is run on a crop only by default
+    crop = thinned[:referenceSize, :referenceSize]
+    util.tic()
+    filledCrop = CellDetection.floodFillCells(None, crop)
+    util.toc('label based fill on %dx%d' % (referenceSize, referenceSize))
+    util.tic()
+    reference = floodFillCellsReference(crop)
+    util.toc('per-pixel flood fill on %dx%d' % (referenceSize, referenceSize))
+
+    print('Identical result: %s' % np.array_equal(filledCrop, reference))
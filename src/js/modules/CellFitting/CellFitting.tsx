@@ -1,4 +1,4 @@
-import React from "react"
+import React, {useState} from "react"
 import {atomFamily, useRecoilState} from "recoil";
 import * as self from "./params";
 import {runCellFitting, selectCellFittingResults} from "./server";
@@ -54,7 +54,9 @@ const CellFitting:React.FC<ICellFittingProps> = () => {
     
     /**RUNNING ALGORITHM CALLBACK*/
     const runMainAlgorithm = async (params:self.Parameters,step:self.Step)=>{
-        const res = await runCellFitting(params,step);
+        setPartialOutlines(null)
+        const res = await runCellFitting(params,step,(outlines)=>setPartialOutlines(prev=>[...(prev || []), ...outlines]));
+        setPartialOutlines(null)
         if(res.error) {
             onInputChanged();
         }else {
@@ -69,7 +71,7 @@ const CellFitting:React.FC<ICellFittingProps> = () => {
     const {curInputs,curStep,curParams,isRunning} = useStepHook<self.Inputs, self.Parameters,self.Step>(asLastRunSettings,
         onInputChanged,
         runMainAlgorithm,
-        {msg: 'Running CellFitting', display: "overlay", progress:0});
+        {msg: 'Running CellFitting', display: "overlay", progress:0},true);
     
     /**UI SPECIFIC STATE*/
     const [heatmap,setHeatmap] = useRecoilState(asHeatmapAfterThreshhold(curStep.moduleID))
@@ -77,6 +79,7 @@ const CellFitting:React.FC<ICellFittingProps> = () => {
     const [manRej,setManRej] = useRecoilState(asManualRejection(curStep.moduleID))
     const [showOrig,setShowOrig] = useRecoilState(asShowOrig(curStep.moduleID))
     const [showSkel,setShowSkel] = useRecoilState(asShowSkel(curStep.moduleID))
+    const [partialOutlines,setPartialOutlines] = useState<PipelinePolygons>(null)
 
     const displayOptions:DisplayOptionSetting<boolean>[] = [
         {type:'binary', value:showOrig,label:'Show Src Image',setter:setShowOrig},
@@ -86,6 +89,13 @@ const CellFitting:React.FC<ICellFittingProps> = () => {
     var accEllipses = points?.points?.map((p,i)=>(points.accepted.indexOf(i) != -1 && manRej.indexOf(i) == -1) ? p : null)
     var rejEllipses = points?.points?.map((p,i)=>(manRej.indexOf(i) != -1) ? p : null)
     
+    //while fitting, the cells that are done so far are shown
+    const showPartial = isRunning && !!partialOutlines
+    if(showPartial){
+        accEllipses = partialOutlines
+        rejEllipses = null
+    }
+    
     const hideMask = useToggleKeys('1')
     
     const changeManRej = (i)=>{
@@ -105,7 +115,7 @@ const CellFitting:React.FC<ICellFittingProps> = () => {
         // showMask && { url:curInputs.cleanedImg.url, col:'white' },
         curInputs.skeleton && showSkel && { url:curInputs.skeleton.url, col:'white' },
     ];
-    const numAcceptedEllipses = points?.accepted?.filter((p)=>manRej.indexOf(p) == -1).length || 0;
+    const numAcceptedEllipses = showPartial ? partialOutlines.length : (points?.accepted?.filter((p)=>manRej.indexOf(p) == -1).length || 0);
 	return (<div className={'cell-fitting margin-100-neg-top' + cl(hideMask, 'hide-mask')}>
         <div className="margin-50-bottom pad-100-top">
             Hold the <ButtonIcon btnText={'1'}/> key to hide the cell fittings temporarily.
@@ -115,8 +125,8 @@ const CellFitting:React.FC<ICellFittingProps> = () => {
             {numAcceptedEllipses > 0 &&
                 <div className="count">{numAcceptedEllipses}</div>
             }
-            {heatmap &&
-                <MasksOverImage originalURL={showOrig ? curInputs.srcImg.url : heatmap.url} showOriginal={true} masks={shownMasks}/>
+            {(heatmap || showPartial) &&
+                <MasksOverImage originalURL={showOrig || !heatmap ? curInputs.srcImg.url : heatmap.url} showOriginal={true} masks={shownMasks}/>
             }
             <PolygonCloud onClick={changeManRej} PolyComp={AcceptedPolygon} polygons={accEllipses} canvasDim={curInputs.srcImg}/>
             <PolygonCloud onClick={changeManRej} PolyComp={RejectedPolygon} polygons={rejEllipses} canvasDim={curInputs.srcImg}/>
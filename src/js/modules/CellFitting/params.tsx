@@ -3,6 +3,7 @@ import {PipelineStep} from "../../../sammie/js/types/pipelinetypes";
 import {Parameter} from "../../../sammie/js/modules/paramtypes";
 import {getSliderParams} from "../../../sammie/js/modules/paramutil";
 import React from "react";
+import {workersDesc} from "../../util/descriptions";
 
 export const moduleName = 'CellFitting'
 
@@ -10,10 +11,11 @@ const mc = getSliderParams('minconfidence','Min Confidence','The heatmap gives a
 const md = getSliderParams('mindist','Min Cell Distance','Governs how close cells can be to one another. This depends solely on resolution. Within min cell distance there can only be one detected cells, that with the highest score.',20,100,1,45,true)
 const mz = getSliderParams('masksize','Min Peak Size','A size constraint for finding maxima. A maxima needs to be at least this size to be considered one. Making this large, will exclude small and less probable cell centers. However the cell distance constraint will in most cases eliminate most small maxima.',3,20,1,3,false)
 const snap = getSliderParams('snapping','BoundarySnapping','Originally cells are estimated as ellipses. In the last step the ellipses are snapped to the respective pixel outlines, to refine the cell shape. The snapping parameter governs how much snapping is happening. 0 means we retain ellipses, 1 represents a full snap to boundaries.',0,1,0.01,0,false)
+const workers = getSliderParams('workers','Worker Processes',workersDesc,1,32,1,4)
 
 /**Parameter UI Definition the user can set in CellFitting*/
 export const parameters:Array<Parameter<any>> = [
-    mc, md, mz,snap
+    mc, md, mz,snap,workers
 ]
 
 /**Typing for CellFitting Inputs*/
@@ -30,5 +32,6 @@ export type Parameters = {
     minconfidence:[number],
     mindist:[number],
     masksize:[number],
-    snapping:[number]
+    snapping:[number],
+    workers:[number]
 }
\ No newline at end of file
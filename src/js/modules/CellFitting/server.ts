@@ -16,10 +16,16 @@ export type CellFittingResponse = {
 export async function selectCellFittingResults(curStep:self.Step,acceptedEllipses:Array<number>):Promise<EelResponse<boolean>>{
     return await eel.runStep<boolean>(self.moduleName,'selectEllipses',{'accepted':acceptedEllipses},curStep)
 }
-export async function runCellFitting(curParams:self.Parameters, curStep:self.Step):Promise<EelResponse<CellFittingResponse>>{
+/**
+ * @param onPartialOutlines Receives the outlines of accepted cells as soon as they are fitted
+ */
+export async function runCellFitting(curParams:self.Parameters, curStep:self.Step, onPartialOutlines:(outlines:PipelinePolygons)=>void = null):Promise<EelResponse<CellFittingResponse>>{
     
+    const onPartial = onPartialOutlines && ((key:string, chunk:{cells:number[], outlines:PipelinePolygons})=>{
+        if(key == 'outlines') onPartialOutlines(chunk.outlines);
+    })
     //Run algorithm - this demo is for a simple image in and image out.
-    var res:EelResponse<CellFittingResponse> = await eel.runStep<CellFittingResponse>(self.moduleName,'apply',curParams,curStep)
+    var res:EelResponse<CellFittingResponse> = await eel.runStepAsync<CellFittingResponse>(self.moduleName,'apply',curParams,curStep,null,onPartial)
 
     updatePipelineData(curStep.outputKeys.ellipses,res.error ? null : res.data);
     return res
@@ -1,4 +1,4 @@
-import React from "react"
+import React, {useState} from "react"
 import {atomFamily, useRecoilState} from "recoil";
 import * as self from "./params";
 import {runCellFittingHeatmap} from "./server";
@@ -24,7 +24,9 @@ const CellFittingHeatmap:React.FC<ICellFittingHeatmapProps> = () => {
     
     /**RUNNING ALGORITHM CALLBACK*/
     const runMainAlgorithm = async (params:self.Parameters,step:self.Step)=>{
-        const res = await runCellFittingHeatmap(params,step);
+        setPartialHeatmap(null)
+        const res = await runCellFittingHeatmap(params,step,setPartialHeatmap);
+        setPartialHeatmap(null)
         if(res.error) {
             setHeatmap(null)
             setSkel(null)
@@ -45,6 +47,7 @@ const CellFittingHeatmap:React.FC<ICellFittingHeatmapProps> = () => {
     const [heatmap,setHeatmap] = useRecoilState(asHeatmap(curStep.moduleID))
     const [skel,setSkel] = useRecoilState(asSkel(curStep.moduleID))
     const [showMask,setShowMask] = useRecoilState(asShowMask(curStep.moduleID))
+    const [partialHeatmap,setPartialHeatmap] = useState<PipelineImage>(null)
     
     const displayOptions:DisplayOptionSetting<boolean>[] = [
         {type:'binary',value:showMask,label:'Show Skeleton',setter:setShowMask},
@@ -54,6 +57,12 @@ const CellFittingHeatmap:React.FC<ICellFittingHeatmapProps> = () => {
         // showMask && { url:curInputs.cleanedImg.url, col:'white' },
         skel && showMask && { url:skel.url, col:'white' },
     ];
+    //while generating, the heatmap is shown as it fills up
+    if(isRunning && partialHeatmap)
+        return (<div className={'cell-fitting-heatmap margin-100-neg-top'}>
+            <MasksOverImage originalURL={partialHeatmap.url} showOriginal={true} masks={[]}/>
+        </div>);
+    
 	return (<div className={'cell-fitting-heatmap margin-100-neg-top'}>
         { heatmap &&
             <>
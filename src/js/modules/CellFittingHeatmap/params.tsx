@@ -3,6 +3,7 @@ import {PipelineStep} from "../../../sammie/js/types/pipelinetypes";
 import {Parameter} from "../../../sammie/js/modules/paramtypes";
 import {getCheckboxParams, getSliderParams} from "../../../sammie/js/modules/paramutil";
 import React from "react";
+import {workersDesc} from "../../util/descriptions";
 
 
 const sp = getSliderParams('radiusbounds','Cell Size','The min and max dimension of a cell in pixels. Try to keep this parameter tight to increase performance',10,100,1,[30,60])
@@ -11,6 +12,7 @@ const fastmode = getCheckboxParams('fastmode','FastMode',
     'Fast mode works best for images that have clearer outlines. It first computes the distance of each pixel to the detected cell walls. This distance has for one to be between the minimum and maximum radius of cells, defined in parameter above. And second we need only to scan around the peaks of this distance map. The downside is, that in noisy images you might miss a few spots.','Enable Fast Mode',true)
 const stride = getSliderParams('stride','Stride',<div>To speed up algorithm we can skip pixels in heatmap generation and approximate the heatmap in the skipped positions. A stride of 1 means, no skipping. 2 means we skip every second pixel, that means the algorithm runs stride<sup>2</sup> times faster.<br/>It makes sense to first work with a big stride, find good parameters and then reduce it to a value of 2-3</div>,1,10,1,3,
     false,(allP) => allP['fastmode'] ? 'hide' : 'active')
+const workers = getSliderParams('workers','Worker Processes',workersDesc,1,32,1,4)
 
 
 /**Name of the module*/
@@ -18,7 +20,7 @@ export const moduleName = 'CellFittingHeatmap'
 
 /**Parameter UI Definition the user can set in CellFittingHeatmap*/
 export const parameters:Array<Parameter<any>> = [
-    sp,fastmode,mpc,stride
+    sp,fastmode,mpc,stride,workers
 ]
 
 /**Typing for CellFittingHeatmap Inputs*/
@@ -36,4 +38,5 @@ export type Parameters = {
     radiusbounds:[number,number],
     minpercboundary:[number],
     stride:[number],
+    workers:[number],
 }
\ No newline at end of file
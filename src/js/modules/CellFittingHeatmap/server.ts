@@ -8,10 +8,16 @@ export type CellFittingHeatmapResponse = {
     heatmap:PipelineImage,
     skel: PipelineImage
 }
-export async function runCellFittingHeatmap(curParams:self.Parameters, curStep:self.Step):Promise<EelResponse<CellFittingHeatmapResponse>>{
+/**
+ * @param onPartialHeatmap Receives previews of the heatmap while it is being generated
+ */
+export async function runCellFittingHeatmap(curParams:self.Parameters, curStep:self.Step, onPartialHeatmap:(heatmap:PipelineImage)=>void = null):Promise<EelResponse<CellFittingHeatmapResponse>>{
     
+    const onPartial = onPartialHeatmap && ((key:string, chunk:any)=>{
+        if(key == 'heatmap') onPartialHeatmap(chunk);
+    })
     //Run algorithm - this demo is for a simple image in and image out.
-    var res:EelResponse<CellFittingHeatmapResponse> = await eel.runStepAsync<CellFittingHeatmapResponse>(self.moduleName,'apply',curParams,curStep)
+    var res:EelResponse<CellFittingHeatmapResponse> = await eel.runStepAsync<CellFittingHeatmapResponse>(self.moduleName,'apply',curParams,curStep,null,onPartial)
 
     updatePipelineData(curStep.outputKeys.heatmap,res.error ? null : res.data.heatmap);
     updatePipelineData(curStep.outputKeys.skeleton,res.error ? null : res.data.skel);
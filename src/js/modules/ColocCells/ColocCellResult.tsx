@@ -64,7 +64,7 @@ const ColocCellResult:React.FC<IColocCellResultProps> = ({cellNum, fpcc,pcc,colo
 	return (
 		<div className={`coloc-cell-result ${className || ''} ${cl(excluded,'is-excluded')}`}>
 			<div className="rel lh-0 img-container">
-                <img src={res[imgIdx].url} />
+                {res[imgIdx].url && <img src={res[imgIdx].url} />}
                 <PolygonCloud className={'stick-to-all'} polygons={[cnt]} canvasDim={res[0]} PolyComp={OutlinePolygon}/>
                 {foci0.length > 0 &&
                     <PolygonCloud className={'foci-0 stick-to-all'} polygons={foci0} canvasDim={res[0]} PolyComp={ctop[colorSet.charAt(0)]}/>
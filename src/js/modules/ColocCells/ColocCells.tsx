@@ -4,7 +4,7 @@ import * as self from "./params";
 import * as server from "./server";
 import {ColocCellsResult} from "./server";
 import './scss/ColocCells.scss'
-import {useDisplaySettings, useStepHook, useToggleKeys} from "../../../sammie/js/modules/modulehooks";
+import {useDisplaySettings, useLazyPreviews, useStepHook, useToggleKeys} from "../../../sammie/js/modules/modulehooks";
 import ErrorHint from "../../../sammie/js/ui/elements/ErrorHint";
 import {EelResponse} from "../../../sammie/js/eel/eel";
 import ColocCellResult from "./ColocCellResult";
@@ -29,6 +29,9 @@ const asColCount = atomFamily<number,string>({key:'coloc-cells-colcount',default
 const asShowOutline = atomFamily<boolean, string>({key: 'coloc-cells_show_outline', default: true});
 const asUseGrayscale = atomFamily<boolean, string>({key: 'coloc-cells_grayscale', default: false});
 
+/**Number of rows of cells displayed per page, previews are only loaded for the current page*/
+const rowsPerPage = 10;
+
 interface IColocCellsProps {
 }
 
@@ -69,6 +72,7 @@ const ColocCells: React.FC<IColocCellsProps> = () => {
     const [sorting,setSorting] = useLocalStoreRecoilHook(asSorting(curStep.moduleID))
     const [grayscale,setGrayscale] = useLocalStoreRecoilHook(asUseGrayscale(curStep.moduleID))
     const [cellBorders,setCellBorders] = useLocalStoreRecoilHook(asShowOutline(curStep.moduleID))
+    const [page,setPage] = useState<number>(1)
     
     const mod = useToggleKeys(['1', '2', '3'])
     
@@ -94,6 +98,15 @@ const ColocCells: React.FC<IColocCellsProps> = () => {
     
     const sortingSeq = result?.imgs && getResultSorting(sorting, result)
     
+    //only the cells on the current page are displayed
+    const cellsPerPage = colCount * rowsPerPage
+    const numPages = Math.max(1, Math.ceil((sortingSeq?.length || 0) / cellsPerPage))
+    const curPage = Math.min(page, numPages)
+    const visibleCells = sortingSeq?.slice((curPage - 1) * cellsPerPage, curPage * cellsPerPage)
+    const previews = useLazyPreviews(visibleCells, (cells)=>server.loadPreviews(curStep,cells), result)
+    if(numPages > 1)
+        displayOptions.push({type:'slider',label:`Page (${numPages})`,sliderParams:[1,numPages,1], value:curPage,setter:setPage})
+    
     const pccs = getPCCs(selected,result);
     const fociStats = getFociStats(selected,result);
     
@@ -144,8 +157,8 @@ const ColocCells: React.FC<IColocCellsProps> = () => {
                 <DisplayOptions settings={displayOptions} modKeys={modKeysDesc} activeModKeys={['' + (selMod + 1)]}/>
             }
             <div className={`grid quarter-gap cols-${colCount}`}>
-                {sortingSeq.map((i) => {
-                    const r = result.imgs[i]
+                {visibleCells.map((i) => {
+                    const r = previews[i] || result.imgs[i]
                     return (
                         <ColocCellResult foci0={result.foci[0][i]}
                                          cellNum={i}
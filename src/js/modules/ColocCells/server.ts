@@ -6,6 +6,7 @@ import {PipelineImage, PipelinePolygons, PolygonData} from "../../../sammie/js/t
 
 export type ColocSingleCellImages = [PipelineImage,PipelineImage,PipelineImage,PipelineImage]
 export type ColocCellsResult = {
+    /**Images of the cells, only placeholders with size but without url, previews are loaded with loadPreviews*/
     imgs:ColocSingleCellImages[]
     cnts:PolygonData[],
     cellAreas:number[],
@@ -34,4 +35,9 @@ export async function runColocCells(curParams:self.Parameters, curStep:self.Step
     else updatePipelineData<ColocCellsResult>(curStep.outputKeys.colocResult,res.data);
 
     return res
-}
\ No newline at end of file
+}
+
+/**Renders the preview images of the given cells*/
+export async function loadPreviews(curStep:self.Step, cells:number[]):Promise<EelResponse<{cells:number[],imgs:ColocSingleCellImages[]}>>{
+    return await eel.runStepAsync<{cells:number[],imgs:ColocSingleCellImages[]}>(self.moduleName,'previews', {cells:cells},curStep,curStep.moduleID + '_previews')
+}
@@ -7,7 +7,7 @@ import ScatterChartChoice, {ScatterPlotPoint} from "./ScatterChartChoice";
 import titleImg from '../../../assets/images/graph-scatter.svg'
 import {CartesianGrid, ResponsiveContainer, Scatter, ScatterChart, Tooltip, XAxis, YAxis} from "recharts";
 import {printf} from "fast-printf";
-import {ColocCellsResult} from "../ColocCells/server";
+import {ColocCellsResult, loadPreviews} from "../ColocCells/server";
 import PolygonCloud from "../../../sammie/js/ui/elements/PolygonCloud";
 import {OutlinePolygon} from "../FociCandidates/FociCandidates";
 import styled from "@emotion/styled";
@@ -16,7 +16,10 @@ import {UIScreens} from '../../../sammie/js/state/uistates'
 import RegressionChoice, {RegressionResult} from "./RegressionChoice";
 import {Button, Dialog} from "@mui/material";
 import {Step} from "./params";
-import {useRecoilState} from "recoil";
+import {useRecoilState, useRecoilValue} from "recoil";
+import {PipelineStep} from "../../../sammie/js/types/pipelinetypes";
+import {PipelinePolygons, PolygonData} from "../../../sammie/js/types/datatypes";
+import {useLazyPreviews} from "../../../sammie/js/modules/modulehooks";
 
 interface IFociScatterChartProps {
     
@@ -52,6 +55,9 @@ const FociScatterChart: React.FC<IFociScatterChartProps> = ({curStep,cellImageDa
     const [regResult, setRegresult] = useState<RegressionResult>(null);
     const [exportDownloadLink, setExportDownloadLink] = useState<string>(null);
     const [screen,setScreen] = useRecoilState(ui.appScreen)
+    //step that generated the cell data, cell previews are requested from it
+    const allSteps = useRecoilValue(ui.allPipelineSteps)
+    const colocStep = allSteps?.find((ps)=>Object.values(ps.outputKeys || {}).indexOf(curStep.inputKeys.colocResult) != -1)
     const runExport = async () => {
         const res = await server.runExportScatter(curStep,graphData,regResult);
         if(res.error) alert('Something went wrong: ' + res.error)
@@ -109,7 +115,7 @@ const FociScatterChart: React.FC<IFociScatterChartProps> = ({curStep,cellImageDa
                             <CartesianGrid strokeDasharray="3 3"/>
                             <XAxis type="number" dataKey="x" name={graphData.xPropName} unit={graphData.xPropUnits}/>
                             <YAxis type="number" dataKey="y" name={graphData.yPropName} unit={graphData.yPropUnits}/>
-                            <Tooltip content={CustomTooltipWithData(cellImageData)} />
+                            <Tooltip content={CustomTooltipWithData(cellImageData,colocStep)} />
                             <Scatter name="Scatter" data={graphData.points} fill="#FF7F50"/>
                             {regResult &&
                                 <Scatter  dataKey={'y'} line shape={(x)=>null}
@@ -139,8 +145,8 @@ const NeighbourPolygon = styled.polygon({
     strokeWidth: 1,
     strokeDasharray: '3 3'
 })
-const CustomTooltipWithData = (cellImgData: ColocCellsResult) => {
-    return (props) => CustomTooltip({...props, cellImgData: cellImgData})
+const CustomTooltipWithData = (cellImgData: ColocCellsResult, colocStep:PipelineStep<any,any>) => {
+    return (props) => CustomTooltip({...props, cellImgData: cellImgData, colocStep:colocStep})
 }
 
 function fociEq(fcx: FociScatter, fcy: FociScatter | FociScatter[]) {
@@ -148,13 +154,33 @@ function fociEq(fcx: FociScatter, fcy: FociScatter | FociScatter[]) {
     return fcx.area == fcy.area && fcx.focusNum == fcy.focusNum && fcx.cellNum == fcy.cellNum;
 }
 
-const CustomTooltip = (props: { active?: any, payload?: any, label?: any, cellImgData: ColocCellsResult }) => {
+/**Joined channel image of a cell with foci and outline, the image is loaded from the ColocCells step when the cell is shown*/
+const CellPreview = (props: { cellIdx:number, cellImgData: ColocCellsResult, colocStep:PipelineStep<any,any>, primary:PipelinePolygons, sec:PipelinePolygons, outline:PolygonData }) => {
+    const previews = useLazyPreviews(props.colocStep ? [props.cellIdx] : null, (cells)=>loadPreviews(props.colocStep,cells), props.cellImgData)
+    const cellImg = previews[props.cellIdx] || props.cellImgData.imgs[props.cellIdx]
+    return (
+        <div className="rel cell-preview">
+            {cellImg[3].url && <img src={cellImg[3].url}/>}
+            {props.primary &&
+            <PolygonCloud className={'primary-cloud'} polygons={props.primary} canvasDim={cellImg[3]}
+                          PolyComp={MagentaPolygon}/>
+            }
+            {props.sec &&
+            <PolygonCloud className={'primary-cloud'} polygons={props.sec} canvasDim={cellImg[3]}
+                          PolyComp={NeighbourPolygon}/>
+            }
+            <PolygonCloud polygons={[props.outline]} canvasDim={cellImg[3]} PolyComp={OutlinePolygon}/>
+            <div className="cell-num">#{props.cellIdx}</div>
+        </div>
+    );
+}
+
+const CustomTooltip = (props: { active?: any, payload?: any, label?: any, cellImgData: ColocCellsResult, colocStep:PipelineStep<any,any> }) => {
     
     if (props.active && props.payload && props.payload.length) {
         const {x, y, fcx, fcy} = props.payload[0]?.payload
         if(!props.payload[1]?.name || !fcx ) return null;
         const cellIdx = props.cellImgData.selected[(fcx as FociScatter).cellNum];
-        const cellImg = props.cellImgData.imgs[cellIdx]
         const foci0 = props.cellImgData.foci[0][cellIdx]
         const foci1 = props.cellImgData.foci[1][cellIdx]
         const cellOutline = props.cellImgData.cnts[cellIdx]
@@ -177,20 +203,8 @@ const CustomTooltip = (props: { active?: any, payload?: any, label?: any, cellIm
                         <strong>{printf('%.2f', y)}</strong> {props.payload[1].unit}
                     </div>
                 </div>
-                <div className="rel cell-preview">
-                    <img src={cellImg[3].url}/>
-                    {showFoci.primary &&
-                    <PolygonCloud className={'primary-cloud'} polygons={showFoci.primary} canvasDim={cellImg[3]}
-                                  PolyComp={MagentaPolygon}/>
-                    }
-                    {showFoci.sec &&
-                    <PolygonCloud className={'primary-cloud'} polygons={showFoci.sec} canvasDim={cellImg[3]}
-                                  PolyComp={NeighbourPolygon}/>
-                    }
-                    <PolygonCloud polygons={[cellOutline]} canvasDim={cellImg[3]} PolyComp={OutlinePolygon}/>
-                    <div className="cell-num">#{cellIdx}</div>
-                    {/*<PolygonCloud polygons={foci1} canvasDim={cellImg[3]}/>*/}
-                </div>
+                <CellPreview cellIdx={cellIdx} cellImgData={props.cellImgData} colocStep={props.colocStep}
+                             primary={showFoci.primary} sec={showFoci.sec} outline={cellOutline}/>
                 {/*<div>{`Mean: ${printf('%.2f',mean)} `}</div>*/}
                 {/*<div>{`Std: ${printf('%.2f',std)} `}</div>*/}
             </div>
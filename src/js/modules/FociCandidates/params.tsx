@@ -2,7 +2,7 @@ import {PipelineImage, PipelinePolygons} from "../../../sammie/js/types/datatype
 import {PipelineStep} from "../../../sammie/js/types/pipelinetypes";
 import {Parameter} from "../../../sammie/js/modules/paramtypes";
 import React from "react";
-import {getSliderParams} from "../../../sammie/js/modules/paramutil";
+import {getDropdownParams, getSliderParams} from "../../../sammie/js/modules/paramutil";
 
 /**Name of the module*/
 export const moduleName = 'FociCandidates'
@@ -17,10 +17,14 @@ const granDesc = `It is recommended not to change this parameter, since it has o
 Contour Loops are analyzed by first finding all contours at this many levels of intensity and then picking out closed loops.
 It governs how close the shortest and longest contours will be to the desired circumference. The higher the granularity is, the more the contours found will match the desired circumference, but also the contour extraction will be (~linearly) slower.
 Consider lowering this parameter if your dataset is very large and contour detection takes a long time, identify the best parameters and before exporting set it back to a higher value.`;
+const engineDesc = `How nested contour loops are found.\n\n
+Level by level: Finds all contours at every level of intensity and compares them with each other. This is how datasets were analyzed in previous versions.\n\n
+Component tree: Reads the nesting of contours from a tree of the bright regions of the cell and only extracts the contours it needs. Several times faster on large datasets, but approximate: on noisy images the bounds of some loops can end up a few levels off.`;
 /**Parameter UI Definition the user can set in FociCandidates*/
 export const parameters:Array<Parameter<any>> = [
     getSliderParams('fociSize','Foci Circumference in px',sizeDesc,5,150,1,[10,40]),
     getSliderParams('granularity','Granularity',granDesc,20,200,1,150),
+    getDropdownParams('engine','Contour Search',engineDesc,'levels',{levels:'Level by level',maxtree:'Component tree'}),
 ]
 
 /**Typing for FociCandidates Inputs*/
@@ -39,5 +43,6 @@ export type Step = PipelineStep<Inputs, Outputs>;
 /**Parameter Object of FociCandidates*/
 export type Parameters = {
     fociSize:[number,number],
-    granularity:[number]
+    granularity:[number],
+    engine:string
 }
\ No newline at end of file
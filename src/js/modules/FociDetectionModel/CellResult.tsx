@@ -65,7 +65,7 @@ const CellResult:React.FC<ICellResultProps> = ({fociEnter,fociLeave, idx, cellOu
 		<div className={`cell-result ${className || ''} ` + cl(excluded,'is-excluded')}>
             <div className="cell-result__idx">#{idx}</div>
 			<div className="rel lh-0">
-                <img src={img.url} />
+                {img.url && <img src={img.url} />}
                 <PolygonCloud className={'outline'} polygons={[cellOutline]} canvasDim={img} PolyComp={OutlinePolygon}/>
                 {selFoci.length > 0 && !excluded &&
                     <PolygonCloud onMouseEnter={fociEnter} onMouseLeave={fociLeave} className={'selected-foci'} onClick={onToggleFoci} polygons={selFoci} canvasDim={img} PolyComp={SelectedPolygon}/>
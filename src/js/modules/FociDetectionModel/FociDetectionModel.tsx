@@ -1,9 +1,9 @@
 import React, {useState} from "react"
 import {atomFamily, useRecoilState} from "recoil";
 import * as self from "./params";
-import {changeCellSelection, changeFociSelection, FociDetectionModelResult, runFociDetectionModel} from "./server";
+import {changeCellSelection, changeFociSelection, FociDetectionModelResult, loadPreviews, runFociDetectionModel} from "./server";
 import './scss/FociDetectionModel.scss'
-import {useStepHook, useToggleKeys} from "../../../sammie/js/modules/modulehooks";
+import {useLazyPreviews, useStepHook, useToggleKeys} from "../../../sammie/js/modules/modulehooks";
 import {EelResponse} from "../../../sammie/js/eel/eel";
 import ErrorHint from "../../../sammie/js/ui/elements/ErrorHint";
 import CellResult from "./CellResult";
@@ -27,6 +27,9 @@ const asSorting = atomFamily<string,string>({key:'foci-detection-model-sorting',
 const asColCount = atomFamily<number,string>({key:'foci-detection-model-colcount',default:3});
 const asLastRunSettings = atomFamily< {batchTimeStamp:number, inputs: self.Inputs, params: self.Parameters},string>({key:'foci-detection-model_initial',default:null});
 
+/**Number of rows of cells displayed per page, previews are only loaded for the current page*/
+const rowsPerPage = 10;
+
 interface IFociDetectionModelProps{}
 const FociDetectionModel:React.FC<IFociDetectionModelProps> = () => {
     
@@ -64,10 +67,11 @@ const FociDetectionModel:React.FC<IFociDetectionModelProps> = () => {
     const [modelFoci,setModelFoci] = useRecoilState(asModelFoci(curStep.moduleID))
     const [colCount,setColCount] = useLocalStoreRecoilHook(asColCount(curStep.moduleID))
     const [sorting,setSorting] = useLocalStoreRecoilHook(asSorting(curStep.moduleID))
+    const [page,setPage] = useState<number>(1)
     const [error,setError] = useState<EelResponse<any>>(null)
     const modKeys = useToggleKeys(['1','2'])
     
-    const displayOptions:DisplayOptionSetting<string>[] = [
+    const displayOptions:DisplayOptionSetting<any>[] = [
         {type:'dropdown',label:'Sort by',options:{none:'No Sorting', numfoci:'Selected Foci', avfoci:'Available Foci', mods:'Modified first'},
             value:sorting,setter:setSorting},
         {type:'slider',label:'Columns',sliderParams:[3,7,1], value:colCount,setter:setColCount},
@@ -96,6 +100,15 @@ const FociDetectionModel:React.FC<IFociDetectionModelProps> = () => {
     //Figure out sorting order
     const order = getResultSorting(sorting,result,selectedFoci);
     
+    //only the cells on the current page are displayed
+    const cellsPerPage = colCount * rowsPerPage
+    const numPages = Math.max(1, Math.ceil(order.length / cellsPerPage))
+    const curPage = Math.min(page, numPages)
+    const visibleCells = order.slice((curPage - 1) * cellsPerPage, curPage * cellsPerPage)
+    const previews = useLazyPreviews(result ? visibleCells : null, (cells)=>loadPreviews(curStep,cells), result)
+    if(numPages > 1)
+        displayOptions.push({type:'slider',label:`Page (${numPages})`,sliderParams:[1,numPages,1], value:curPage,setter:setPage})
+    
 	return (<div className={'foci-detection-model margin-100-neg pad-100 ' + cl(modKeys['1'],'mod-1') + cl(modKeys['2'],'mod-2') + cl(curParams.showoutlines, 'show-outlines')}>
 	    {error && <ErrorHint error={error}/> }
         {!error && result &&
@@ -125,8 +138,8 @@ const FociDetectionModel:React.FC<IFociDetectionModelProps> = () => {
                 }
                 <DisplayOptions settings={displayOptions} modKeys={modKeysDesc} activeModKeys={Object.keys(modKeys).filter(k=>modKeys[k])}/>
                 <div className={`grid cols-${colCount} half-gap`}>
-                    {order.map((i,k)=>{
-                        const img = result.imgs[i]
+                    {visibleCells.map((i,k)=>{
+                        const img = previews[i] || result.imgs[i]
                         return <CellResult key={i} img={img} foci={result.foci[i]}
                                            idx={i}
                                            cellOutline={result.contours[i]}
@@ -2,6 +2,7 @@ import {PipelineStep} from "../../../sammie/js/types/pipelinetypes";
 import {Parameter} from "../../../sammie/js/modules/paramtypes";
 import React from "react";
 import {getCheckboxParams, getDropdownParams, getSliderParams} from "../../../sammie/js/modules/paramutil";
+import {workersDesc} from "../../util/descriptions";
 
 /**Name of the module*/
 export const moduleName = 'FociDetectionModel'
@@ -9,7 +10,8 @@ export const moduleName = 'FociDetectionModel'
 /**Parameter UI Definition the user can set in FociDetectionModel*/
 export const parameters:Array<Parameter<any>> = [
     getSliderParams('sizeadjustment','Adjust Foci Size','If you feel the determined foci sizes are too big or too small, you can adjust all of them by this factor.',0,2,0.01,1),
-    getCheckboxParams('showoutlines','Cell Outlines','When cells do not have much background signal, it is nice to see the outline as detected initally to see the location of foci.','Show Outlines',true,null,true)
+    getCheckboxParams('showoutlines','Cell Outlines','When cells do not have much background signal, it is nice to see the outline as detected initally to see the location of foci.','Show Outlines',true,null,true),
+    getSliderParams('workers','Worker Processes',workersDesc,1,32,1,4)
 ]
 
 /**Typing for FociDetectionModel Inputs*/
@@ -25,4 +27,5 @@ export type Step = PipelineStep<Inputs, Outputs>;
 export type Parameters = {
     sizeadjustment:[number],
     showoutlines:boolean,
+    workers:[number],
 }
\ No newline at end of file
@@ -5,7 +5,7 @@ import * as self from "./params";
 import {PipelineImage, PipelinePolygons} from "../../../sammie/js/types/datatypes";
 
 export type FociDetectionModelResult = {
-    /**Images of the cells*/
+    /**Images of the cells, only placeholders with size but without url, previews are loaded with loadPreviews*/
     imgs:PipelineImage[],
     /**Contours for Cells*/
     contours:PipelinePolygons,
@@ -35,6 +35,11 @@ export async function runFociDetectionModel(curParams:self.Parameters, curStep:s
     return res
 }
 
+/**Renders the preview images of the given cells*/
+export async function loadPreviews(curStep:self.Step, cells:number[]):Promise<EelResponse<{cells:number[],imgs:PipelineImage[]}>>{
+    return await eel.runStepAsync<{cells:number[],imgs:PipelineImage[]}>(self.moduleName,'previews', {cells:cells},curStep,curStep.moduleID + '_previews')
+}
+
 export async function changeFociSelection(curParams:self.Parameters, curStep:self.Step, foci:number[][]):Promise<EelResponse<boolean>>{
     var res:EelResponse<boolean> = await eel.runStepAsync<boolean>(self.moduleName,'changefociselection', {curParams, foci:foci},curStep)
     return res
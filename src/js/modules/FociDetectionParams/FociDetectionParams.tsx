@@ -43,7 +43,9 @@ const FociDetectionParams:React.FC<IFociDetectionParamsProps> = () => {
     
     /**RUNNING ALGORITHM CALLBACK*/
     const runMainAlgorithm = async (params:self.Parameters,step:self.Step)=>{
-        const res = await server.runFociDetectionParams(params,step,curBatch.batchParameters['cellstoprocess']);
+        setPartial(null)
+        const res = await server.runFociDetectionParams(params,step,curBatch.batchParameters['cellstoprocess'],result,setPartial);
+        setPartial(null)
         setError(res.error ? res : null)
         setResult(res.error ? null: res.data);
         if(includedCells == null && !res.error){
@@ -83,6 +85,7 @@ const FociDetectionParams:React.FC<IFociDetectionParamsProps> = () => {
     /**UI SPECIFIC STATE*/
     const [result,setResult] = useRecoilState(asResult(curStep.moduleID))
     const [error,setError] = useState<EelResponse<any>>(null)
+    const [partial,setPartial] = useState<FociDetectionParamsResult>(null)
     const modKeys = useToggleKeys(['1','2'])
     
     const onFociToggle = async (i,v) => {
@@ -131,9 +134,25 @@ const FociDetectionParams:React.FC<IFociDetectionParamsProps> = () => {
     const numCellsWithFoci = fcc?.filter(k=>k.length > 0).length
     const meanFociPerCell = fcc && mean(fcc?.map((k)=>k.length))
     
+    //while the dataset is loading, the first cells that are done are shown
+    const showPartial = isRunning && !!partial
+    const numPartialCells = colCount * 10
+    
 	return (<div className={'foci-detection-params ' + cl(modKeys['1'],'mod-1') + cl(modKeys['2'],'mod-2')}>
 	    {error && <ErrorHint error={error}/> }
-        {!error && result && fociInfo &&
+        {showPartial &&
+            <div className={`grid cols-${colCount} half-gap`}>
+                {partial.cells.slice(0,numPartialCells).map((cell,k)=>
+                    <CellResult key={cell} idx={cell} img={curInputs.cellImages[cell]} foci={partial.foci[k]}
+                                cellOutline={curInputs.cellContours[cell]}
+                                curSelection={_.range(0,partial.foci[k].length)}
+                                excluded={false}
+                                onToggleCellInclusion={()=>{}}
+                                onChangeSelection={()=>{}}/>
+                )}
+            </div>
+        }
+        {!error && result && fociInfo && !showPartial &&
             <>
                 
                 <div className="foci-detection-model__box pad-100-excepttop pad-50-top margin-100-bottom">
@@ -3,6 +3,7 @@ import {PipelineStep} from "../../../sammie/js/types/pipelinetypes";
 import React from "react";
 import {getSliderParams} from "../../../sammie/js/modules/paramutil";
 import {PipelineImage, PipelinePolygons} from "../../../sammie/js/types/datatypes";
+import {workersDesc} from "../../util/descriptions";
 
 /**Name of the module*/
 export const moduleName = 'FociDetectionParams'
@@ -13,6 +14,7 @@ export const parameters:Array<Parameter<any>> = [
     getSliderParams('normbrightnessrange','Normalized Brightness (NB)','For all foci the average normalized brightness inside its area needs to lie inside these bounds.',0,1,0.01,[0,1],false,null,true),
     getSliderParams('rawbrightnessrange','Raw Brightness (RB)','For all foci the average absolute (i.e. unscaled, coming from microscope) brightness inside its area needs to lie inside these bounds.\n\nUse this setting to exclude cells with low absolute signal.',0,1,0.01,[0,1],false,null,true),
     getSliderParams('brightnessdrop','Min Brightness Drop','The brightness ratio between the brightest point of the focus and its outline. A value of for example 4 signifies that only foci are considered where the peak brightness is at least 4 times brighter than the outline of the focus.',1,20,0.25,1,false,null,true),
+    getSliderParams('workers','Worker Processes',workersDesc,1,32,1,4),
 ];
 
 /**Typing for FociDetectionParams Inputs - Define Input Types/Names of this Pipeline step here.*/
@@ -30,4 +32,5 @@ export type Parameters = {
     normbrightnessrange:[number,number],
     rawbrightnessrange:[number,number],
     brightnessdrop:[number],
+    workers:[number],
 }
\ No newline at end of file
@@ -13,6 +13,10 @@ export type SingleFocusData = {
 export type FociDetectionParamsResult = {
     foci:PipelinePolygons[],
     fociData:SingleFocusData[][],
+    /**If set, foci and fociData only contain these cells, that changed since the last result*/
+    cells?:number[],
+    /**Revision of the python state this result belongs to, sent back to get incremental results*/
+    revision?:number,
 }
 export async function runSelection(curParams:self.Parameters, curStep:self.Step,cells:number[], foci:number[][]):Promise<EelResponse<boolean>>{
     var res:EelResponse<boolean> = await eel.runStep<boolean>(self.moduleName,'applyselect',{...curParams, ...{cells,foci}},curStep)
@@ -23,9 +27,31 @@ export async function runSelection(curParams:self.Parameters, curStep:self.Step,
     
     return res;
 }
-export async function runFociDetectionParams(curParams:self.Parameters, curStep:self.Step,portion:number):Promise<EelResponse<FociDetectionParamsResult>>{
+/**
+ * Runs the size adjustment. If a previous result is passed and python still holds its revision, python only sends the cells that changed and they are merged into it.
+ * While the dataset is loaded, onPartialResult receives the foci of all cells that are done so far.
+ * */
+export async function runFociDetectionParams(curParams:self.Parameters, curStep:self.Step,portion:number, lastResult:FociDetectionParamsResult = null,
+                                             onPartialResult:(partial:FociDetectionParamsResult)=>void = null):Promise<EelResponse<FociDetectionParamsResult>>{
+    var partial:FociDetectionParamsResult = {foci:[], fociData:[], cells:[]};
+    const onPartial = onPartialResult && ((key:string, chunk:FociDetectionParamsResult)=>{
+        if(key != 'foci') return;
+        partial = {foci:[...partial.foci, ...chunk.foci], fociData:[...partial.fociData, ...chunk.fociData], cells:[...partial.cells, ...chunk.cells]};
+        onPartialResult(partial);
+    })
+    
     //Run the algorithm associated with this module in python
-    var res:EelResponse<FociDetectionParamsResult> = await eel.runStepAsync<FociDetectionParamsResult>(self.moduleName,'apply',{...curParams, portion:portion},curStep)
+    var res:EelResponse<FociDetectionParamsResult> = await eel.runStepAsync<FociDetectionParamsResult>(self.moduleName,'apply',{...curParams, portion:portion, revision:lastResult?.revision ?? null},curStep,null,onPartial)
+    
+    if(!res.error && res.data.cells && lastResult){
+        const foci = [...lastResult.foci];
+        const fociData = [...lastResult.fociData];
+        res.data.cells.forEach((cell,i)=>{
+            foci[cell] = res.data.foci[i];
+            fociData[cell] = res.data.fociData[i];
+        })
+        res.data = {foci:foci, fociData:fociData, cells:null, revision:res.data.revision};
+    }
 
     return res
 }
\ No newline at end of file
@@ -13,9 +13,12 @@ the models performance will be poor, generally as the set size increases so does
 and adding more data does not lead to a significant increase in performance. You can stop adding data if you see the curve leveling off.
 Generating this curve might take some time and is therefore optional.
  `
+const hyperDesc = `Searches for the best hyperparameters (C and gamma) of the SVM instead of using the defaults. 
+This usually improves the model a little, but takes longer to train.`
 /**Parameter UI Definition the user can set in Training*/
 export const parameters:Array<Parameter<any>> = [
-    getCheckboxParams('trainingCurve','Show Training Curve',cvcurveDesc,'Show',false)
+    getCheckboxParams('trainingCurve','Show Training Curve',cvcurveDesc,'Show',false),
+    getCheckboxParams('hyperTrain','Optimize Hyperparameters',hyperDesc,'Optimize',false)
 ]
 
 /**Typing for Training Inputs*/
@@ -30,6 +33,7 @@ export type Step = PipelineStep<Inputs, Outputs>;
 /**Parameter Object of Training*/
 export type Parameters = {
     trainingCurve:boolean
+    hyperTrain:boolean
     /*ttype:'whiteorblack'|'band'
     innerband:[number,number]
     outerband:[number,number],
@@ -15,8 +15,9 @@ export type TrainingResult = {
 }
 export async function runTraining(curParams:self.Parameters, curStep:self.Step):Promise<EelResponse<TrainingResult>>{
     
-    //Run algorithm - this demo is for a simple image in and image out.
-    var res:EelResponse<TrainingResult> = await eel.runStepAsync<TrainingResult>(self.moduleName,'train',curParams,curStep)
+    //Run algorithm, with or without a hyperparameter search
+    const action = curParams.hyperTrain ? 'hypertrain' : 'train'
+    var res:EelResponse<TrainingResult> = await eel.runStepAsync<TrainingResult>(self.moduleName,action,curParams,curStep)
     
     //update pipeline, on error, delete the output again.
     if(res.error) deletePipelineData(curStep.outputKeys.model);
@@ -0,0 +1,2 @@
+/**Description of the Worker Processes parameter of steps that process their data in parallel*/
+export const workersDesc = 'Number of processes used to run this step. The data is split between them and analyzed in parallel. Set this to the number of CPU cores of your machine for best performance, a value of 1 disables parallel processing.';
@@ -28,28 +28,30 @@ class BlobRemoval(ModuleBase):
         minBboxDim:int = params['sb_size'][0]
 
         res = skimage.measure.label(binMask, 0, connectivity=2)
-        rprops = skimage.measure.regionprops(res)
 
-        for r, region in enumerate(rprops):
-            r += 1
-            # print('#', r, '--', region.filled_image.shape)
-            reject = False
+        #cheap properties are computed in bulk for all regions
+        props = skimage.measure.regionprops_table(res, properties=('label', 'area', 'bbox'))
+        eccentricities = imgutil.getLabelEccentricities(res)[props['label'] - 1]
+        minRegionDim = np.minimum(props['bbox-2'] - props['bbox-0'], props['bbox-3'] - props['bbox-1'])
 
-            # reject by bbox dim
-            minRegionDim = min(region.filled_image.shape)
-            if minRegionDim <  minBboxDim: reject = True
+        # reject by bbox dim
+        reject = minRegionDim < minBboxDim
 
-            # reject by size
-            if region.area <= minArea: reject = True
+        # reject by size
+        reject |= props['area'] <= minArea
 
-            # reject by eccentricty
-            if region.eccentricity <= eccentricity[0] or region.eccentricity >= eccentricity[1]: reject = True
+        # reject by eccentricty
+        reject |= np.logical_or(eccentricities <= eccentricity[0], eccentricities >= eccentricity[1])
 
-            # reject by convexAreaRatio
-            if region.solidity < solidity[0] or region.solidity > solidity[1]: reject = True
+        # reject by convexAreaRatio, solidity needs the convex hull and is therefore only computed for the remaining regions
+        rprops = skimage.measure.regionprops(res)
+        for r in np.nonzero(reject == False)[0]:
+            if rprops[r].solidity < solidity[0] or rprops[r].solidity > solidity[1]: reject[r] = True
 
-            if reject:
-                binMask[res == r] = False
+        #remove all rejected regions at once via a lookup table indexed by the label image
+        rejectLUT = np.zeros(res.max() + 1, dtype='bool')
+        rejectLUT[props['label'][reject]] = True
+        binMask[rejectLUT[res]] = False
 
         return binMask
 
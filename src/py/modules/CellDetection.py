@@ -2,6 +2,7 @@ from typing import Tuple
 
 import numpy as np
 import skimage.measure
+from scipy import ndimage
 
 from src.sammie.py.modules.ModuleBase import ModuleBase
 from src.sammie.py.util import imgutil
@@ -22,17 +23,16 @@ class CellDetection(ModuleBase):
         self.runNumber = 0
 
     def floodFillCells(self,thinnedImg):
-        curFill = 2
-        filledImage = np.copy(thinnedImg)
-        for r in range(0, thinnedImg.shape[0]):
-            for c in range(0, thinnedImg.shape[1]):
-                if filledImage[r, c] != 0: continue
-                mask = skimage.morphology.flood(thinnedImg, (r, c), connectivity=1)
-                filledImage[mask] = curFill
-                curFill += 1
+        """
+        Fills each 4-connected area enclosed by the thinned boundaries with its own number, starting at 2 and
+        numbered in order of the area's first pixel. Boundaries are set to 0.
+        """
+        #labelling the inverted skeleton in a single pass numbers the areas in the same raster order as flood filling them one by one
+        lbls, _ = ndimage.label(thinnedImg == 0, structure=ndimage.generate_binary_structure(2, 1))
+        filledImage = lbls + 1
 
         # remove boundaries
-        filledImage[filledImage == 1] = 0
+        filledImage[lbls == 0] = 0
 
         return filledImage
 
@@ -47,33 +47,32 @@ class CellDetection(ModuleBase):
         allBlobs = np.copy(filledBlobs)
         rprops = skimage.measure.regionprops(filledBlobs)
 
-        allCells = [] #List of RegionProperties
+        #bounding boxes are computed in bulk for all regions
+        props = skimage.measure.regionprops_table(filledBlobs, properties=('label', 'bbox'))
+        regionH = props['bbox-2'] - props['bbox-0']
+        regionW = props['bbox-3'] - props['bbox-1']
+        minRegionDim = np.minimum(regionH, regionW)
+        maxRegionDim = np.maximum(regionH, regionW)
 
-        for r, region in enumerate(rprops):
-            r += 1
-            print('#', r, 'size: ', region.filled_image.shape, 'solid:',region.solidity)
-            reject = False
-            # reject by size
-            minRegionDim = min(region.filled_image.shape)
-            maxRegionDim = max(region.filled_image.shape)
-            if minRegionDim < size[0] or maxRegionDim > size[1]: reject = True
+        # reject by size
+        reject = np.logical_or(minRegionDim < size[0], maxRegionDim > size[1])
 
-            if region.solidity < solidity[0] or region.solidity > solidity[1]: reject = True
+        # reject by area difference, the convex hull is only computed for regions that passed the size check
+        for r in np.flatnonzero(~reject):
+            regionSolidity = rprops[r].solidity
+            if regionSolidity < solidity[0] or regionSolidity > solidity[1]: reject[r] = True
 
-            # reject by area difference
-            if region.solidity < solidity[0] or region.solidity > solidity[1]: reject = True
+        #the label image is not modified, the masks of the regions are computed lazily from it and rejected cells still need theirs
 
-            print('Rejected', reject)
-            if reject:
-                filledBlobs[filledBlobs == r] = 0
+        bbox = np.stack([props['bbox-%d' % i] for i in range(4)], axis=1)
+        isBorder = np.isin(bbox, [0, thinnedInputImg.shape[0], thinnedInputImg.shape[1]]).any(axis=1)
 
-            isBorder = False
-            if 0 in region.bbox or thinnedInputImg.shape[1] in region.bbox or thinnedInputImg.shape[0] in region.bbox:
-                isBorder = True
+        allCells = [] #List of RegionProperties
 
+        for r, region in enumerate(rprops):
             #We identify background by a blob that is simply bigger than a 1/2 of the image h or w
-            if maxRegionDim < (thinnedInputImg.shape[1] * 0.5) and maxRegionDim < (thinnedInputImg.shape[0] * 0.5):
-                allCells.append({'region':region,'accepted':(not reject) and (not isBorder), 'border':isBorder})
+            if maxRegionDim[r] < (thinnedInputImg.shape[1] * 0.5) and maxRegionDim[r] < (thinnedInputImg.shape[0] * 0.5):
+                allCells.append({'region':region,'accepted':bool(not reject[r] and not isBorder[r]), 'border':bool(isBorder[r])})
 
         return allCells
 
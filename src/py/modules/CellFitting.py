@@ -1,3 +1,4 @@
+from collections import OrderedDict
 from typing import List
 
 import cv2
@@ -33,7 +34,13 @@ class CellFitting(ModuleBase):
 
     acceptedPoints = None  # Mx1 array of accepted point indices
     acceptedEllipses = None  # Mx1 array of accepted Ellipse indices
-    detectedCells:DetectedCells
+    detectedCells:DetectedCells = None
+
+    # DetectedCells of previous runs on the current heatmap, keyed by the parameters that influence the detected centers
+    cellCache:OrderedDict
+    cachedHeatmap = None
+    maxCachedCellSets = 5
+    pendingOutlines:dict = None # outlines of fitted cells that have not yet been sent as partial result
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -41,6 +48,7 @@ class CellFitting(ModuleBase):
         self.trace('initialized')
         self.runNumber = 0
         self.lastParams = {}
+        self.cellCache = OrderedDict()
 
     def showDebugPlots(self, params):
         raw_image = self.session.getData(self.keys.inSrcImg)
@@ -78,6 +86,40 @@ class CellFitting(ModuleBase):
 
 
 
+    def getDetectedCells(self, heatmap, heatmapParams, params, skelImg, allPoints, maxRad)->DetectedCells:
+        """
+        Retrieves the DetectedCells for the given peaks. Results of finished runs are cached per heatmap and the parameters that determine
+        the peaks (see cacheDetectedCells), new sets of peaks reuse ellipse fits and trajectories of centers that have been analyzed before.
+        """
+        cache = self.cellCache if self.cachedHeatmap is heatmap else OrderedDict()
+        cacheKey = self.__getCellCacheKey(heatmapParams, params)
+        if cacheKey in cache:
+            self.trace('Reusing detected cells for unchanged peaks')
+            return cache[cacheKey]
+
+        #most recently used cells are the most likely to share centers with the new peaks
+        previousCells = next(reversed(cache.values())) if len(cache) > 0 else None
+        return DetectedCells(skelImg, self.session.getData(self.keys.inSrcImg),
+                             allPoints + maxRad, tuple(heatmapParams['radiusbounds']),
+                             heatmapParams['minpercboundary'][0], self.abortSignal, eeljs_sendProgress,
+                             numWorkers=int(params.get('workers', [1])[0]), previousCells=previousCells)
+
+    def cacheDetectedCells(self, heatmap, heatmapParams, params, detectedCells:DetectedCells):
+        """Adds the DetectedCells of a finished run to the cache, see getDetectedCells"""
+        #the heatmap is kept alive by the cache, so its identity can not be reused by a new heatmap
+        if self.cachedHeatmap is not heatmap:
+            self.cellCache = OrderedDict()
+            self.cachedHeatmap = heatmap
+
+        cacheKey = self.__getCellCacheKey(heatmapParams, params)
+        self.cellCache[cacheKey] = detectedCells
+        self.cellCache.move_to_end(cacheKey)
+        if len(self.cellCache) > self.maxCachedCellSets:
+            self.cellCache.popitem(last=False)
+
+    def __getCellCacheKey(self, heatmapParams, params):
+        return (params['minconfidence'][0], params['masksize'][0], params['mindist'][0], tuple(heatmapParams['radiusbounds']))
+
     def exportData(self, key: str, path: str, type:str, **args):
 
         if type == 'png':
@@ -101,6 +143,18 @@ class CellFitting(ModuleBase):
             return True
 
 
+    def onPartialOutlines(self, acceptedPoints, cells, polygons):
+        #accepted cells are shown as soon as they are fitted, collected until the next partial result is due
+        accepted = set(np.asarray(acceptedPoints).tolist())
+        for c, p in zip(cells, polygons):
+            if c in accepted:
+                self.pendingOutlines['cells'] += [int(c)]
+                self.pendingOutlines['outlines'] += [p]
+
+        if len(self.pendingOutlines['cells']) > 0 and self.partialDue('outlines'):
+            self.emitPartial('outlines', self.pendingOutlines)
+            self.pendingOutlines = {'cells': [], 'outlines': []}
+
     def run(self, action, params, inputkeys, outputkeys):
 
         self.keys = CellFittingKeys(inputkeys, outputkeys)
@@ -121,25 +175,34 @@ class CellFitting(ModuleBase):
                                          cv2.BORDER_CONSTANT)
 
             # Threshhold Heatmap
-            self.threshholdedHeatmap = np.copy(heatmap)
-            self.threshholdedHeatmap[heatmap < params['minconfidence'][0]] = 0
-
-            # Detect the Maxima
-            maxMap, allPoints, peakQuality, self.acceptedPoints = cf.findMaximaInHeatmap(heatmap,
-                                                                                              params['minconfidence'][
-                                                                                                  0],
-                                                                                              params['masksize'][0],
-                                                                                              params['mindist'][0])
-
-
-            self.detectedCells = DetectedCells(skelImg, self.session.getData(self.keys.inSrcImg),
-                                               allPoints + maxRad, tuple(heatmapParams['radiusbounds']),
-                                               heatmapParams['minpercboundary'][0], self.abortSignal, eeljs_sendProgress)
-
-            self.detectedPolygonOutlines = self.detectedCells.getCellPolygons(params['snapping'][0])
+            threshholdedHeatmap = np.copy(heatmap)
+            threshholdedHeatmap[heatmap < params['minconfidence'][0]] = 0
+
+            #if only the snapping (or number of workers) changed on the same heatmap, the peaks are the same and only the polygons need to be updated
+            changedParams = self.getChangedParametersFromLastRun(self.keys.outEllipses, params)
+            onlySnappingChanged = heatmap is self.cachedHeatmap and self.detectedCells is not None and set(changedParams) <= {'snapping', 'workers'}
+
+            self.pendingOutlines = {'cells': [], 'outlines': []}
+            if onlySnappingChanged:
+                acceptedPoints, detectedCells = self.acceptedPoints, self.detectedCells
+            else:
+                # Detect the Maxima
+                maxMap, allPoints, peakQuality, acceptedPoints = cf.findMaximaInHeatmap(heatmap,
+                                                                                        params['minconfidence'][0],
+                                                                                        params['masksize'][0],
+                                                                                        params['mindist'][0])
+
+                detectedCells = self.getDetectedCells(heatmap, heatmapParams, params, skelImg, allPoints, maxRad)
+
+            onPartialOutlines = lambda cells, polygons: self.onPartialOutlines(acceptedPoints, cells, polygons)
+            detectedPolygonOutlines = detectedCells.getCellPolygons(params['snapping'][0], onPartialOutlines)
             if self.abortSignal():
                 return None
 
+            #only a finished run changes the state, an aborted one may have been superseded by a newer run
+            self.cacheDetectedCells(heatmap, heatmapParams, params, detectedCells)
+            self.threshholdedHeatmap, self.acceptedPoints = threshholdedHeatmap, acceptedPoints
+            self.detectedCells, self.detectedPolygonOutlines = detectedCells, detectedPolygonOutlines
             self.acceptedEllipses = np.copy(self.acceptedPoints)
             self.onGeneratedData(self.keys.outEllipses,self.detectedCells, params)
 
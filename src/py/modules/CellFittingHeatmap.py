@@ -27,6 +27,11 @@ class CellFittingHeatmap(ModuleBase):
         self.runNumber = 0
 
 
+    def onPartialHeatmap(self, getHeatmap):
+        #show the heatmap as it fills up, the image is only built when it is going to be sent
+        if self.partialDue('heatmap'):
+            self.emitPartial('heatmap', getPreviewHeatMap(getHeatmap(), self.outKeys.heatmapKey + '_partial', True))
+
     def run(self, action, params, inputkeys,outputkeys):
         self.outKeys = CellFittingOutKeys(outputkeys)
 
@@ -44,7 +49,8 @@ class CellFittingHeatmap(ModuleBase):
                 stride = 10
             else:
                 stride = params['stride'][0]
-            heatmap = cf.generateHeatMap(self.abortSignal, skeleton, tuple(params['radiusbounds']), params['minpercboundary'][0],stride,fastMode=fastmode)
+            heatmap = cf.generateHeatMap(self.abortSignal, skeleton, tuple(params['radiusbounds']), params['minpercboundary'][0],stride,fastMode=fastmode,
+                                         numWorkers=int(params['workers'][0]), partialFun=self.onPartialHeatmap)
 
             if self.abortSignal():
                 raise RuntimeError('Aborted execution.')
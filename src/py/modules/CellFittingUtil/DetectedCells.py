@@ -1,4 +1,6 @@
-from typing import Tuple, List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Tuple, List, Dict, Callable
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -17,6 +19,8 @@ class DetectedCells:
     numTrajSteps = 10 #number of trajectory steps
     pointInfluenceRange = 20
     trajStepSize = 4
+    minCellsPerWorker = 100 #cells are only deformed in a process pool if each worker gets at least this many cells
+    cellsPerPartial = 250 #cells deformed at once in this process, if partial results are requested
 
     #Image Data
     skelImgWithBorder: ndarray #uint8 array that is 0 or 255, no borders
@@ -34,9 +38,17 @@ class DetectedCells:
     ellipseDeformTrajectories:ndarray # M x K x N x 2 storing trajectories for each point on a cell boundary as it gets deformed
     ellipseTrajectoryDistortion:ndarray # M x T Distortion for each cell after step t
     elRange:range #Range 0..numPoints for quick access in loops
+    numWorkers:int #Number of processes used for deformation of large numbers of cells, 1 deforms all cells in this process
+    reusedFrom:ndarray # M array of the index of the same center in previousCells, -1 for centers that are new
+    previousCells:'DetectedCells' #Cells detected on the same skeleton, whose results are reused for identical centers
 
 
-    def __init__(self, skelImgWithBorder:np.ndarray, lightfieldImg:np.ndarray, ellipseCentersInBorderedImage:np.ndarray, radBounds:Tuple[int, int], minPercBoundary:float, abortSignal = None, progress = None):
+    def __init__(self, skelImgWithBorder:np.ndarray, lightfieldImg:np.ndarray, ellipseCentersInBorderedImage:np.ndarray, radBounds:Tuple[int, int], minPercBoundary:float, abortSignal = None, progress = None,
+                 numWorkers:int = 1, previousCells:'DetectedCells' = None):
+        """
+        previousCells: Cells detected before on the same skeleton image with the same radBounds and minPercBoundary.
+        Ellipse fits and trajectories of centers that are in both sets are copied instead of recomputed.
+        """
 
         #These are for execution inside a thread to abort and indicate progress
         self.progressFun = progress
@@ -53,6 +65,7 @@ class DetectedCells:
             self.skelImg[self.skelImg > 50] = 255
 
         self.srcImg = lightfieldImg
+        self.numWorkers = numWorkers
         self.ellipseCenters = ellipseCentersInBorderedImage
 
         self.radBounds = radBounds
@@ -64,8 +77,21 @@ class DetectedCells:
         self.ellipseDeformTrajectories = np.zeros((len(self.ellipseCenters),3))
         self.patches = None
 
+        #find centers that have been analyzed before
+        self.previousCells = previousCells
+        self.reusedFrom = np.ones(len(self.ellipseCenters), dtype='int') * -1
+        if previousCells is not None:
+            prevIdx = {(int(p[0]),int(p[1])):j for j,p in enumerate(previousCells.ellipseCenters)}
+            for i, p in enumerate(self.ellipseCenters):
+                self.reusedFrom[i] = prevIdx.get((int(p[0]),int(p[1])), -1)
+
         #calculate the ellipse polygon and parametric representation for eachpoint
         for i, p in enumerate(self.ellipseCenters):
+            if self.reusedFrom[i] >= 0:
+                self.ellipseCoords[i] = previousCells.ellipseCoords[self.reusedFrom[i]]
+                self.ellipseParams[i] = previousCells.ellipseParams[self.reusedFrom[i]]
+                continue
+
             x,y,a,b,r = cf.analyzePatch(skelImgWithBorder, p, self.radBounds, 0,
                                               self.minPercBoundary, returnEllipse=True, numEllipseBoundaryPoints = self.numEllipseBoundaryPoints)
 
@@ -77,10 +103,7 @@ class DetectedCells:
     def __blankProgress(self,f): pass
 
     def forceFun(self,dist):
-        ret = self.pointInfluenceRange - dist
-        ret[ret < 0] = 0
-        ret[ret > 0] = 1
-        return ret
+        return cf.forceFunStep(dist,self.pointInfluenceRange)
         #linear
         ret = (self.pointInfluenceRange - dist) / self.pointInfluenceRange
         ret[ret < 0] = 0
@@ -125,10 +148,12 @@ class DetectedCells:
         wp = np.stack(np.nonzero(patch), axis=1)
         elP = np.stack((r, c), axis=1)
 
-        cf.defineBoundaryPointTrajectories2(self.forceFun, patch, elP, wp,True, numSteps=self.numTrajSteps,maxStepSize=self.trajStepSize)
+        cf.defineBoundaryPointTrajectories2(self.forceFun, patch, elP, wp,True, numSteps=self.numTrajSteps,maxStepSize=self.trajStepSize,
+                                            influenceRange=self.pointInfluenceRange)
         plt.show()
 
-    def __generatePatches(self):
+    def __generatePatches(self, partialFun:Callable[[ndarray],None] = None):
+        """partialFun is called with the indices of cells, as soon as their trajectories are available"""
         self.progressFun(0)
         numP = len(self.ellipseCenters)
         self.ellipseTrajectoryDistortion = np.zeros((numP,self.numTrajSteps+1))
@@ -138,43 +163,92 @@ class DetectedCells:
                                                    2))
         self.patches = []
 
+        elP = np.zeros((numP, self.numEllipseBoundaryPoints, 2))
         for i,p in enumerate(self.ellipseCenters):
             patch, r, c,fr,fc = cf.setupPatchForEllipse(self.skelImg, self.ellipseCoords[i, :, 0], self.ellipseCoords[i, :, 1], 0, 0.1)
-            elP = np.stack((r,c),axis=1)
+            elP[i,:,:] = np.stack((r,c),axis=1)
             nwp = np.stack(np.nonzero(patch),axis=1)
             self.patches += [(patch,fr,fc,nwp)]
 
-            #generate trajectories for each patch
-            elPTraj, totalDistortion = cf.defineBoundaryPointTrajectories2(self.forceFun, patch, elP,nwp,
-                                                                          False,numSteps=self.numTrajSteps,maxStepSize=self.trajStepSize)
-            self.ellipseDeformTrajectories[i,:,:,:] = elPTraj
-            self.ellipseTrajectoryDistortion[i,:] = totalDistortion
-
-            self.progressFun(i/numP)
-            if self.abortSignal():
-                return None
-
-
-    def getCellPolygons(self,snappingFactor:float)->List[Dict]:
+        #trajectories of cells that have been deformed before can simply be copied
+        toCompute = np.arange(numP)
+        prev = self.previousCells
+        if prev is not None and prev.patches is not None:
+            reused = self.reusedFrom >= 0
+            self.ellipseDeformTrajectories[reused] = prev.ellipseDeformTrajectories[self.reusedFrom[reused]]
+            self.ellipseTrajectoryDistortion[reused] = prev.ellipseTrajectoryDistortion[self.reusedFrom[reused]]
+            toCompute = np.nonzero(reused == False)[0]
+            if partialFun is not None and reused.any():
+                partialFun(np.nonzero(reused)[0])
+
+        if len(toCompute) > 0 and not self.__deformCells(elP, toCompute, partialFun):
+            #do not leave half finished trajectories behind, they will be regenerated on next access
+            self.patches = None
+            return None
+
+        self.previousCells = None
+
+    def __deformCells(self, elP:ndarray, cells:ndarray, partialFun:Callable[[ndarray],None] = None)->bool:
+        """
+        Generates the trajectories for the given cell indices. Returns false if execution has been aborted.
+        """
+        #the force function needs to be picklable for the process pool
+        forceFun = partial(cf.forceFunStep, maxDist=self.pointInfluenceRange)
+        whitePixels = [self.patches[i][3] for i in cells]
+        numChunks = min(self.numWorkers, len(cells) // self.minCellsPerWorker)
+        if numChunks > 1:
+            chunks = np.array_split(np.arange(len(cells)), numChunks)
+            with ProcessPoolExecutor(max_workers=numChunks) as executor:
+                futures = [executor.submit(cf.defineBoundaryPointTrajectoriesBatched, forceFun, elP[cells[ch]], [whitePixels[i] for i in ch],
+                                           self.pointInfluenceRange, self.numTrajSteps, self.trajStepSize) for ch in chunks]
+                for i,f in enumerate(futures):
+                    if self.abortSignal():
+                        for pending in futures: pending.cancel()
+                        return False
+                    self.ellipseDeformTrajectories[cells[chunks[i]]], self.ellipseTrajectoryDistortion[cells[chunks[i]]] = f.result()
+                    self.progressFun((i + 1) / numChunks)
+                    if partialFun is not None: partialFun(cells[chunks[i]])
+        else:
+            #all cells are deformed at once, unless partial results are wanted
+            numChunks = 1 if partialFun is None else max(1, len(cells) // self.cellsPerPartial)
+            chunks = np.array_split(np.arange(len(cells)), numChunks)
+            for i, ch in enumerate(chunks):
+                progress = lambda p, i=i: self.progressFun((i + p) / numChunks)
+                res = cf.defineBoundaryPointTrajectoriesBatched(forceFun, elP[cells[ch]], [whitePixels[j] for j in ch], self.pointInfluenceRange,
+                                                                self.numTrajSteps, self.trajStepSize, self.abortSignal, progress)
+                if res is None:
+                    return False
+                self.ellipseDeformTrajectories[cells[ch]], self.ellipseTrajectoryDistortion[cells[ch]] = res
+                if partialFun is not None: partialFun(cells[ch])
+
+        return True
+
+
+    def getCellPolygons(self,snappingFactor:float, partialFun:Callable[[ndarray,List[Dict]],None] = None)->List[Dict]:
         """
         Returns polygons for the detected cells in image coordinates, snapped to their respective outlines by the snappingfactor [0;1]
         Snapping 1 will snapp fully to boundary, while 0 will keep it an ellipse
         Returns a list of dicts [{x:number[],y:number[]},{...},...]
+        If the cells still need to be deformed, partialFun is called with cell indices and their polygons as soon as they are done.
         """
-        if self.patches is None: self.__generatePatches()
+        if self.patches is None:
+            onCellsDone = None
+            if partialFun is not None:
+                onCellsDone = lambda cells: partialFun(cells, [self.getCellPolygon(i, snappingFactor) for i in cells])
+            self.__generatePatches(onCellsDone)
         if self.abortSignal(): return None
 
-        res = []
-        for i in self.elRange:
-            pos = cf.getBoundaryForDeformFactor(self.ellipseDeformTrajectories[i, :, :, :],
-                                                self.ellipseTrajectoryDistortion[i, :],
-                                                np.array([snappingFactor]))
-            pos += np.array([self.patches[i][1],self.patches[i][2]]) #move to image coordinate system
-            pos -= self.radBounds[1] #remove border influence
+        return [self.getCellPolygon(i, snappingFactor) for i in self.elRange]
 
-            res += [{'x':list(pos[:,1]),'y':list(pos[:,0])}]
+    def getCellPolygon(self, i:int, snappingFactor:float)->Dict:
+        """Polygon of a single cell, see getCellPolygons"""
+        pos = cf.getBoundaryForDeformFactor(self.ellipseDeformTrajectories[i, :, :, :],
+                                            self.ellipseTrajectoryDistortion[i, :],
+                                            np.array([snappingFactor]))
+        pos += np.array([self.patches[i][1],self.patches[i][2]]) #move to image coordinate system
+        pos -= self.radBounds[1] #remove border influence
 
-        return res
+        return {'x':list(pos[:,1]),'y':list(pos[:,0])}
 
 
 
@@ -1,2 +1,2 @@
-from src.py.modules.CellFittingUtil.radApprox import analyzePatch, generateHeatMap,findMaximaInHeatmap,generateHeatMapFast
-from src.py.modules.CellFittingUtil.vfDeform import setupPatchForEllipse,deformEllipsePixels,getBoundaryVectorfield,visVectorField,defineBoundaryPointTrajectories,visBoundaryTrajectory,getBoundaryForDeformFactor,getBoundaryVectorfieldInPoints,defineBoundaryPointTrajectories2
+from src.py.modules.CellFittingUtil.radApprox import analyzePatch, analyzePatches, generateHeatMap,findMaximaInHeatmap,generateHeatMapFast
+from src.py.modules.CellFittingUtil.vfDeform import setupPatchForEllipse,WhitePixelIndex,deformEllipsePixels,getBoundaryVectorfield,visVectorField,defineBoundaryPointTrajectories,visBoundaryTrajectory,getBoundaryForDeformFactor,getBoundaryVectorfieldInPoints,defineBoundaryPointTrajectories2,defineBoundaryPointTrajectoriesBatched,deformEllipsesPixels,forceFunStep
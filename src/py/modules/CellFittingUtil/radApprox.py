@@ -1,13 +1,14 @@
 import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import Tuple, Callable
 
 import cv2
 import numpy as np
 import scipy.ndimage
-import skimage.measure
 from scipy import ndimage
 from scipy.interpolate import interpolate
 from scipy.optimize import curve_fit
+from scipy.spatial import cKDTree
 from skimage.feature import peak_local_max
 
 from src.sammie.py.eeljsinterface import eeljs_sendProgress
@@ -42,44 +43,41 @@ def pickMean(poi,angmax,angmin):
     return [poi_r,poi_t]  # point with smallest radius in slice
 
 def findMaximaInHeatmap(heatmap:np.ndarray, threhshold = 0.1, maskSize = 3, minDist = 45):
-    singlePixels = []
-    maxMap = np.zeros_like(heatmap,dtype='bool')
-
-    #finding local maxima as pixels that are talles inside a maskSize window
-    for r in range(0,heatmap.shape[0]):
-        for c in range(0,heatmap.shape[1]):
-            if heatmap[r,c] <= threhshold: continue
-            # if(heatmap[r - maskSize:r + maskSize + 1, c - maskSize:c + maskSize + 1].min() == 0):
-            #     continue
-            mv = heatmap[r-maskSize:r+maskSize+1, c-maskSize:c+maskSize+1].max()
-            if(heatmap[r,c] == mv):
-                maxMap[r,c] = True
-
-    #extract single points and errors
-    lbls = skimage.measure.label(maxMap,False)
-    pos = np.zeros((lbls.max(),2))
-    peakQuality = np.zeros((lbls.max(),1))
-    for i in range(1,lbls.max()+1):
-        nz = np.nonzero(lbls == i)
-        pos[i-1,:] = np.mean(nz, axis=1)
-        peakQuality[i-1] = heatmap[nz[0][0],nz[1][0]]
-
-    minDist = minDist ** 2
-    acceptedPoints = []
+
+    #finding local maxima as pixels that are talles inside a maskSize window, window is clipped at the image border
+    windowMax = cv2.dilate(heatmap, np.ones((2 * maskSize + 1, 2 * maskSize + 1), 'uint8'))
+    maxMap = np.logical_and(heatmap > threhshold, heatmap == windowMax)
+
+    #extract single points and errors, connected maxima have the same height and are merged into one point
+    maxIdx = np.flatnonzero(maxMap)
+    _, lbls = cv2.connectedComponents(maxMap.astype('uint8'), connectivity=8)
+    #number the maxima in order of their first pixel in the image
+    _, firstIdx, lbls = np.unique(lbls.ravel()[maxIdx], return_index=True, return_inverse=True)
+    lbls = np.argsort(np.argsort(firstIdx))[lbls.ravel()]
+    numLbls = len(firstIdx)
+
+    pos = np.zeros((numLbls,2))
+    peakQuality = np.zeros((numLbls,1))
+    if numLbls > 0:
+        counts = np.bincount(lbls, minlength=numLbls)
+        rows, cols = np.unravel_index(maxIdx, heatmap.shape)
+        pos[:, 0] = np.bincount(lbls, rows, minlength=numLbls) / counts
+        pos[:, 1] = np.bincount(lbls, cols, minlength=numLbls) / counts
+        #quality is the height of the first pixel of each maximum
+        peakQuality[:, 0] = heatmap.ravel()[np.sort(maxIdx[firstIdx])]
+
     #from these single points analyze nearest neighbours and kick out the ones with bigger error
-    for i,p in enumerate(pos):
-        q = peakQuality[i]
-        dxy = (pos - p) ** 2
-        sqdist = dxy[:, 1] + dxy[:, 0]
-        neighbourIndices = np.nonzero(sqdist < minDist)
-        tallest = True
-        for n in neighbourIndices[0]:
-            if n == i: continue
-            if q < peakQuality[n]:
-                tallest = False
-                break
-        if tallest:
-            acceptedPoints.append(i)
+    tallest = np.ones(numLbls, dtype='bool')
+    if numLbls > 1:
+        pairs = cKDTree(pos).query_pairs(minDist, output_type='ndarray')
+        dxy = (pos[pairs[:, 0]] - pos[pairs[:, 1]]) ** 2
+        pairs = pairs[dxy[:, 1] + dxy[:, 0] < minDist ** 2]
+        qi = peakQuality[pairs[:, 0], 0]
+        qj = peakQuality[pairs[:, 1], 0]
+        tallest[pairs[qi < qj, 0]] = False
+        tallest[pairs[qj < qi, 1]] = False
+
+    acceptedPoints = np.nonzero(tallest)[0].tolist()
 
     return [maxMap,pos.astype('int'),peakQuality,acceptedPoints]
 
@@ -159,46 +157,55 @@ def generateHeatMapFast(abortSig:Callable[[],bool], skelImg:np.ndarray, radRange
     return heatmap
 
 
-def generateHeatMap(abortSig:Callable[[],bool], skelImg:np.ndarray, radRange:Tuple[int,int], minPercentageBoundary,stride, interpolation = 'linear', fastMode = False):
+def generateHeatMap(abortSig:Callable[[],bool], skelImg:np.ndarray, radRange:Tuple[int,int], minPercentageBoundary,stride, interpolation = 'linear', fastMode = False,
+                    numWorkers:int = 1, tileSize:int = 256, partialFun:Callable[[Callable[[],np.ndarray]],None] = None):
+    """
+    Generates a 0-1 score heatmap for how likely each pixel of the skeleton image is the center of a cell.
+    If numWorkers > 1 the image is split into tiles of tileSize x tileSize pixels that are scored in parallel processes.
+    partialFun is called whenever more points have been scored, with a function returning a preview of the heatmap so far.
+    Building it is not free, so the caller decides if it needs it.
+    """
 
     suppressionMask = makeProximityMask(skelImg,radRange[1],radRange[0],fastMode)
     skelImg = cv2.copyMakeBorder(skelImg, radRange[1], radRange[1], radRange[1], radRange[1], cv2.BORDER_CONSTANT)
 
     maxR = skelImg.shape[0]-radRange[1]
     maxC = skelImg.shape[1]-radRange[1]
-    progress = 0
 
     #Generate points where to evaluate the
     analyzedRs = range(0,skelImg.shape[0],stride)
     analyzedCs = range(0,skelImg.shape[1],stride)
-    rr, cc = np.meshgrid(analyzedRs,analyzedCs)
-    downscaledHeatmap = np.ones((len(analyzedRs), len(analyzedCs))) * -1
-    numPoints = rr.shape[0] * rr.shape[1]
-    donePoints = 0
-    for p in range(0,len(rr)):
-        rs = rr[p]
-        cs = cc[p]
-        for pp in range(0,len(rs)):
-            donePoints += 1
-            r = rs[pp]
-            c = cs[pp]
-            if r <= radRange[1] or c <= radRange[1] or r >= maxR or c >= maxC:
-                continue
-            elif suppressionMask[r-radRange[1],c-radRange[1]]:
-                err, mb = analyzePatch(skelImg,(r,c),radRange,0,minPercentageBoundary)
-                downscaledHeatmap[pp,p] = err
-            else:
-                continue
-
-            #Listen to abort signal and cancel execution
-            if abortSig is not None and abortSig():
-                return None
+    rr, cc = np.meshgrid(analyzedRs,analyzedCs,indexing='ij')
 
-        progress = donePoints / numPoints
-        if abortSig is not None:
-            eeljs_sendProgress(progress)
-        else:
-            print('Progress: %.2f%%'%(progress*100))
+    #only analyze points away from the border and close enough to the skeleton
+    toAnalyze = np.logical_and(np.logical_and(rr > radRange[1], cc > radRange[1]), np.logical_and(rr < maxR, cc < maxC))
+    toAnalyze[toAnalyze] = suppressionMask[rr[toAnalyze]-radRange[1], cc[toAnalyze]-radRange[1]]
+
+    if abortSig is not None:
+        progressFun = eeljs_sendProgress
+    else:
+        progressFun = lambda progress: print('Progress: %.2f%%'%(progress*100))
+
+    #all candidate points are analyzed at once in batches, listening to the abort signal in between
+    candidates = np.stack((rr[toAnalyze],cc[toAnalyze]),axis=1)
+    onScored = None
+    if partialFun is not None:
+        scoredErrs = np.ones(len(candidates)) * -1
+        def onScored(idx:np.ndarray, values:np.ndarray):
+            scoredErrs[idx] = values[:,0]
+            partialFun(lambda: getPartialHeatmap(scoredErrs, toAnalyze, stride, skelImg.shape, radRange[1]))
+
+    if numWorkers > 1:
+        res = analyzePatchesTiled(skelImg, candidates, radRange, minPercentageBoundary, numWorkers, tileSize,
+                                  abortSig=abortSig, progressFun=progressFun, partialFun=onScored)
+    else:
+        res = analyzePatches(skelImg, candidates, radRange, minPercentageBoundary,
+                             abortSig=abortSig, progressFun=progressFun, partialFun=onScored)
+    if res is None:
+        return None
+
+    downscaledHeatmap = np.ones((len(analyzedRs), len(analyzedCs))) * -1
+    downscaledHeatmap[toAnalyze] = res[:,0]
 
     # transform errors to 0-1 score
     downscaledHeatmap = transformErrorsToScore(downscaledHeatmap)
@@ -226,6 +233,22 @@ def generateHeatMap(abortSig:Callable[[],bool], skelImg:np.ndarray, radRange:Tup
 
 
 
+def getPartialHeatmap(errs:np.ndarray, analyzed:np.ndarray, stride:int, shape:Tuple[int,int], border:int)->np.ndarray:
+    """
+    Preview of a heatmap from the errors of the points scored so far (-1 for the others), without interpolation.
+    analyzed is the mask of evaluated points in the strided grid, shape the size of the bordered image.
+    """
+    downscaledHeatmap = np.ones(analyzed.shape) * -1
+    downscaledHeatmap[analyzed] = errs
+    if (downscaledHeatmap >= 0).any():
+        downscaledHeatmap = transformErrorsToScore(downscaledHeatmap)
+    else:
+        downscaledHeatmap[:] = 0
+
+    heatmap = np.repeat(np.repeat(downscaledHeatmap, stride, axis=0), stride, axis=1)[:shape[0], :shape[1]]
+    return heatmap[border:-border, border:-border]
+
+
 def analyzePatch(skelImg:np.ndarray, pos:Tuple[int,int], radRange:Tuple[int,int], repPointMode=0, minPercOfBoundary:float = 0.8, numPolarBins = None, wtitle:str = 'Patch Analysis', debug:bool = False, returnEllipse:bool = False,
                  numEllipseBoundaryPoints:int=90):
 
@@ -325,3 +348,225 @@ def analyzePatch(skelImg:np.ndarray, pos:Tuple[int,int], radRange:Tuple[int,int]
         ax[1].legend(fits + ['all','sel'])
 
     return [-1,1-(missingBins / numPolarBins)]
+
+
+def getPolarBinStencil(radRange:Tuple[int,int]):
+    """
+    Precomputes the polar binning used by analyzePatch for all pixel offsets of a patch, independent of the patch center.
+    Returns dy,dx,r,t arrays of offsets that lie inside the radius range, sorted such that inside each polar bin
+    the point analyzePatch would pick (smallest radius, first in row-major order) comes first, as well as the
+    start index of each bin in these arrays and the total number of polar bins.
+    Points lying exactly on a bin edge belong to both adjacent bins (as in analyzePatch) and are therefore duplicated.
+    """
+    numPolarBins = int(2 * math.pi * radRange[1] / 10)
+
+    #offsets inside a patch of size 2R x 2R around its center, in row-major order like np.nonzero
+    dy, dx = np.mgrid[-radRange[1]:radRange[1], -radRange[1]:radRange[1]]
+    dy = dy.ravel()
+    dx = dx.ravel()
+    r = np.sqrt(dx ** 2 + dy ** 2)
+    inRadius = np.logical_and(r >= radRange[0], r <= radRange[1])
+    dy, dx, r = dy[inRadius], dx[inRadius], r[inRadius]
+    t = np.arctan2(dy, dx)
+
+    #bins are closed intervals [edge_k,edge_k+1], k = 0..numPolarBins-2
+    edges = np.linspace(-math.pi, math.pi, numPolarBins)
+    numBins = numPolarBins - 1
+    binRight = np.searchsorted(edges, t, side='right') - 1
+    binLeft = np.searchsorted(edges, t, side='left') - 1
+    onEdge = np.logical_and(binLeft != binRight, binLeft >= 0)
+    binRight[binRight >= numBins] = -1
+
+    idx = np.concatenate((np.arange(len(t)), np.nonzero(onEdge)[0]))
+    bins = np.concatenate((binRight, binLeft[onEdge]))
+    valid = bins >= 0
+    idx, bins = idx[valid], bins[valid]
+
+    #sort by bin, then radius, then original row-major position
+    order = np.lexsort((idx, r[idx], bins))
+    idx, bins = idx[order], bins[order]
+    binStarts = np.searchsorted(bins, np.arange(numBins + 1))
+
+    return dy[idx], dx[idx], r[idx], t[idx], binStarts, numPolarBins
+
+
+def fitEllipsesBatched(t:np.ndarray, r:np.ndarray, valid:np.ndarray, maxIter:int = 100, tol:float = 1e-10):
+    """
+    Fits elFit to many point sets at once.
+    t, r and valid are M x B arrays of angles, radii and a mask of which entries are used for each of the M fits.
+    The fit is initialized by the closed form linear least squares solution of the ellipse equation in 1/r^2
+    and then refined with a batched Levenberg-Marquardt on the same residuals curve_fit uses, so that
+    the resulting errors match those of analyzePatch.
+    Returns M x 3 parameters (a,b,d) and the mean squared error for each fit, NaN where no fit was possible.
+    """
+    w = valid.astype('float')
+    n = w.sum(axis=1)
+    t = np.where(valid, t, 0)
+    r = np.where(valid, r, 1)
+
+    #1/r^2 = A + B cos(2t) + C sin(2t) is linear in A,B,C
+    X = np.stack((np.ones_like(t), np.cos(2 * t), np.sin(2 * t)), axis=2) * w[:, :, None]
+    y = w / r ** 2
+    XtX = np.einsum('mbi,mbj->mij', X, X) + np.eye(3) * 1e-12
+    Xty = np.einsum('mbi,mb->mi', X, y)
+    A, B, C = np.linalg.solve(XtX, Xty[:, :, None])[:, :, 0].transpose()
+    K = np.sqrt(B ** 2 + C ** 2)
+    p, q = A + K, A - K
+
+    #fall back to a circle of mean radius, when the linear fit does not describe an ellipse
+    meanR = (r * w).sum(axis=1) / np.maximum(n, 1)
+    isEllipse = np.logical_and(p > 0, q > 0)
+    params = np.zeros((len(t), 3))
+    params[:, 0] = np.where(isEllipse, 1 / np.sqrt(np.where(isEllipse, p, 1)), meanR)
+    params[:, 1] = np.where(isEllipse, 1 / np.sqrt(np.where(isEllipse, q, 1)), meanR)
+    params[:, 2] = np.where(isEllipse, np.arctan2(-C, B) / 2, 0)
+
+    def residualsAndJacobian(par, idx):
+        a, b, d = par[:, 0, None], par[:, 1, None], par[:, 2, None]
+        c, s = np.cos(t[idx] + d), np.sin(t[idx] + d)
+        D = b * b * c * c + a * a * s * s
+        sD = np.sqrt(D)
+        res = (r[idx] - a * b / sD) * w[idx]
+        D3 = D * sD
+        J = np.stack((b ** 3 * c * c / D3, a ** 3 * s * s / D3, -a * b * s * c * (a * a - b * b) / D3), axis=2)
+        return res, J * w[idx, :, None]
+
+    res, J = residualsAndJacobian(params, slice(None))
+    cost = (res ** 2).sum(axis=1)
+    lam = np.full(len(t), 1e-3)
+    active = n >= 3
+    for i in range(maxIter):
+        if not active.any(): break
+        ai = np.nonzero(active)[0]
+        JtJ = np.einsum('mbi,mbj->mij', J[ai], J[ai])
+        Jtr = np.einsum('mbi,mb->mi', J[ai], res[ai])
+        damped = JtJ + lam[ai, None, None] * (np.eye(3) * np.diagonal(JtJ, axis1=1, axis2=2)[:, :, None] + np.eye(3) * 1e-12)
+        step = np.linalg.solve(damped, Jtr[:, :, None])[:, :, 0]
+        newParams = params[ai] + step
+        newRes, newJ = residualsAndJacobian(newParams, ai)
+        newCost = (newRes ** 2).sum(axis=1)
+        newCost[~np.isfinite(newCost)] = np.inf
+
+        improved = newCost < cost[ai]
+        ui = ai[improved]
+        converged = np.zeros(len(ai), dtype='bool')
+        converged[improved] = cost[ui] - newCost[improved] <= tol * np.maximum(cost[ui], 1e-12)
+        params[ui], res[ui], J[ui], cost[ui] = newParams[improved], newRes[improved], newJ[improved], newCost[improved]
+        lam[ui] /= 10
+        lam[ai[~improved]] *= 10
+        converged[~improved] = lam[ai[~improved]] > 1e10
+        active[ai[converged]] = False
+
+    err = cost / np.maximum(n, 1)
+    err[n < 3] = np.nan
+    return params, err
+
+
+def analyzePatches(skelImg:np.ndarray, positions:np.ndarray, radRange:Tuple[int,int], minPercOfBoundary:float = 0.8,
+                   batchSize:int = 2048, abortSig:Callable[[],bool] = None, progressFun:Callable[[float],None] = None, stencil = None,
+                   partialFun:Callable[[np.ndarray,np.ndarray],None] = None):
+    """
+    Batched version of analyzePatch (with repPointMode = 0) for many candidate centers at once.
+    Args:
+        skelImg (): Bordered skeleton image, every position needs to be at least radRange[1] away from the image border
+        positions (): N x 2 array of candidate centers (row, col)
+        stencil (): result of getPolarBinStencil, can be passed to avoid recomputation when calling this repeatedly
+        partialFun (): Called after each batch with the indices of the positions scored in it and their results
+    Returns:
+        N x 2 array of [err, boundaryFraction] with the same values analyzePatch returns for each position or None
+        if execution has been aborted.
+    """
+    if stencil is None:
+        stencil = getPolarBinStencil(radRange)
+    dy, dx, sr, st, binStarts, numPolarBins = stencil
+    numBins = len(binStarts) - 1
+    binLengths = np.diff(binStarts)
+    #score that is largest for the first entry inside a bin
+    firstScore = len(dy) - np.arange(len(dy))
+    reduceStarts = np.minimum(binStarts[:-1], len(dy) - 1)
+
+    positions = np.asarray(positions).astype('int')
+    res = np.zeros((len(positions), 2))
+    for start in range(0, len(positions), batchSize):
+        pos = positions[start:start + batchSize]
+
+        #white pixels of each patch at each stencil position
+        hits = skelImg[pos[:, 0, None] + dy[None, :], pos[:, 1, None] + dx[None, :]] != 0
+
+        #first hit in each bin is the representative point of that bin (smallest radius)
+        score = np.maximum.reduceat(hits * firstScore[None, :], reduceStarts, axis=1)
+        score[:, binLengths == 0] = 0
+        hasPoint = score > 0
+        repIdx = len(dy) - np.where(hasPoint, score, len(dy))
+        repIdx = np.minimum(repIdx, len(dy) - 1)
+
+        missingBins = numBins - hasPoint.sum(axis=1)
+        frac = 1 - missingBins / numPolarBins
+
+        params, err = fitEllipsesBatched(st[repIdx], sr[repIdx], hasPoint)
+        err[np.isnan(err)] = -1
+
+        accepted = frac >= minPercOfBoundary
+        res[start:start + batchSize, 0] = np.where(accepted, err, -1)
+        res[start:start + batchSize, 1] = np.where(accepted, frac, missingBins / numPolarBins)
+
+        if partialFun is not None:
+            done = np.arange(start, min(start + batchSize, len(positions)))
+            partialFun(done, res[done])
+        if progressFun is not None:
+            progressFun(min(start + batchSize, len(positions)) / len(positions))
+        if abortSig is not None and abortSig():
+            return None
+
+    return res
+
+
+def analyzeHeatmapTile(skelTile:np.ndarray, positions:np.ndarray, radRange:Tuple[int,int], minPercOfBoundary:float):
+    """Scores the positions inside a single tile. Runs inside a worker process of analyzePatchesTiled."""
+    return analyzePatches(skelTile, positions, radRange, minPercOfBoundary)
+
+
+def analyzePatchesTiled(skelImg:np.ndarray, positions:np.ndarray, radRange:Tuple[int,int], minPercOfBoundary:float,
+                        numWorkers:int, tileSize:int = 256, abortSig:Callable[[],bool] = None, progressFun:Callable[[float],None] = None,
+                        partialFun:Callable[[np.ndarray,np.ndarray],None] = None):
+    """
+    Same as analyzePatches, but splits the image into tiles of tileSize x tileSize pixels, that are scored in a pool of numWorkers processes.
+    Each tile is sent with an overlap of radRange[1] pixels, so that the patches around all its positions are complete.
+    partialFun is called for each finished tile, with the indices of its positions and their results.
+    Returns N x 2 array of [err, boundaryFraction] for each position or None if execution has been aborted.
+    """
+    positions = np.asarray(positions).astype('int')
+    res = np.zeros((len(positions), 2))
+    if len(positions) == 0:
+        return res
+
+    #group positions by the tile they fall into
+    tileIdx = positions // tileSize
+    tileKeys, tileOfPosition = np.unique(tileIdx, axis=0, return_inverse=True)
+    tileOfPosition = tileOfPosition.ravel()
+
+    with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+        futures = {}
+        for t, (tr, tc) in enumerate(tileKeys):
+            posInTile = np.nonzero(tileOfPosition == t)[0]
+            fromR = max(tr * tileSize - radRange[1], 0)
+            fromC = max(tc * tileSize - radRange[1], 0)
+            tile = skelImg[fromR:(tr + 1) * tileSize + radRange[1], fromC:(tc + 1) * tileSize + radRange[1]]
+            f = executor.submit(analyzeHeatmapTile, tile, positions[posInTile] - [fromR, fromC], radRange, minPercOfBoundary)
+            futures[f] = posInTile
+
+        numDone = 0
+        for f in as_completed(futures):
+            #cancel all tiles that did not start yet and wait for the running ones to finish
+            if abortSig is not None and abortSig():
+                for pending in futures: pending.cancel()
+                return None
+
+            res[futures[f], :] = f.result()
+            if partialFun is not None:
+                partialFun(futures[f], res[futures[f]])
+            numDone += len(futures[f])
+            if progressFun is not None:
+                progressFun(numDone / len(positions))
+
+    return res
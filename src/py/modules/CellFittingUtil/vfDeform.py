@@ -1,8 +1,10 @@
 import math
+from typing import List, Callable
 
 import numpy as np
 from matplotlib import pyplot as plt
 from scipy.interpolate import interpolate
+from scipy.spatial import cKDTree
 
 from src.sammie.py.util.imgutil import setUpSubplot
 
@@ -13,6 +15,13 @@ def forceFunLin(dist,maxDist):
     ret[ret < 0] = 0
     return ret
 
+#Constant force for all pixels closer than maxDist
+def forceFunStep(dist,maxDist):
+    ret = maxDist - dist
+    ret[ret < 0] = 0
+    ret[ret > 0] = 1
+    return ret
+
 # def forceFunLin2(dist,maxDist):
 #     ret = (maxDist - dist)/maxDist
 #     ret[ret < 0] = 0
@@ -26,9 +35,9 @@ def setupPatchForEllipse(thinnedImage,r,c,subtractBorder:int = 0, overshoot:floa
         overshoot: % to increase patch around r,c
     """
 
-    # r and c in original unbordered coordinate system
-    r -= subtractBorder
-    c -= subtractBorder
+    # r and c in original unbordered coordinate system, copied so the caller's coordinates are not modified
+    r = r - subtractBorder
+    c = c - subtractBorder
 
     numElRows = r.max() - r.min()
     numElCols = c.max() - c.min()
@@ -67,28 +76,66 @@ def visVectorField(patch,rr,cc,uu,vv):
     ax[0].imshow(patch,cmap='gray')
     ax[0].quiver(ppcs,pprs,-vcs,vrs,color='green')
 
-def getBoundaryVectorfieldInPoints(forcefun, points:np.ndarray,whitePixels = None, patch = None, plot:bool = False):
+class WhitePixelIndex:
     """
-    Will retrieve the force each whitepixel has on an array of points in the given patch
+    Spatial index over the white pixels of a patch. Since the force function has a hard cutoff at influenceRange
+    only white pixels within that range of a point need to be visited when evaluating the vectorfield in that point.
+    The index is built once per patch and can be reused for all trajectory steps.
     """
+    whitePixels:np.ndarray #Nx2 array of white pixel coordinates
+    influenceRange:float #distance beyond which a white pixel has no force on a point
+    tree:cKDTree
 
-    if whitePixels is None:
-        whitePixels = np.stack(np.nonzero(patch),axis=1)
+    def __init__(self, whitePixels:np.ndarray, influenceRange:float):
+        self.whitePixels = whitePixels
+        self.influenceRange = influenceRange
+        self.tree = cKDTree(whitePixels) if len(whitePixels) > 0 else None
 
-    fullVectorField = np.zeros_like(points)
+    def getVectorfieldInPoints(self, forcefun, points:np.ndarray)->np.ndarray:
+        """Returns the unnormalized sum of forces all white pixels in range have onto each of the points (Mx2)"""
+        fullVectorField = np.zeros_like(points)
+        if self.tree is None: return fullVectorField
+
+        #all pairs of white pixels and points that are within range of each other
+        pairs = self.tree.sparse_distance_matrix(cKDTree(points), self.influenceRange, output_type='ndarray')
+        pixelIdx, pointIdx = pairs['i'], pairs['j']
 
-    for i in range(0,len(whitePixels)):
         #calculate direction and distance to white pixel
-        d = points - whitePixels[i,:]
+        d = points[pointIdx] - self.whitePixels[pixelIdx]
         dist = np.sqrt(d[:,0]**2 + d[:,1]**2)
 
-        #calculate the force each pixel has according to the distance based firceFunction
-        force = forcefun(dist)
-        d = force * d.transpose() / dist
-        d = d.transpose()
+        #calculate the force each pixel has according to the distance based firceFunction and sum up per point
+        force = forcefun(dist) / dist
+        fullVectorField[:,0] = np.bincount(pointIdx, force * d[:,0], minlength=len(points))
+        fullVectorField[:,1] = np.bincount(pointIdx, force * d[:,1], minlength=len(points))
+        return fullVectorField
 
-        #add onto collective vectorfield
-        fullVectorField += d
+def getBoundaryVectorfieldInPoints(forcefun, points:np.ndarray,whitePixels = None, patch = None, plot:bool = False, pixelIndex:WhitePixelIndex = None):
+    """
+    Will retrieve the force each whitepixel has on an array of points in the given patch
+    If a pixelIndex is given, only the white pixels within its influence range are visited.
+    """
+
+    if pixelIndex is not None:
+        fullVectorField = pixelIndex.getVectorfieldInPoints(forcefun, points)
+    else:
+        if whitePixels is None:
+            whitePixels = np.stack(np.nonzero(patch),axis=1)
+
+        fullVectorField = np.zeros_like(points)
+
+        for i in range(0,len(whitePixels)):
+            #calculate direction and distance to white pixel
+            d = points - whitePixels[i,:]
+            dist = np.sqrt(d[:,0]**2 + d[:,1]**2)
+
+            #calculate the force each pixel has according to the distance based firceFunction
+            force = forcefun(dist)
+            d = force * d.transpose() / dist
+            d = d.transpose()
+
+            #add onto collective vectorfield
+            fullVectorField += d
 
     #normalize field such that the longest vector has unit length
     maxDist = np.sqrt(fullVectorField[:,0] ** 2 + fullVectorField[:,1] ** 2).max()
@@ -186,18 +233,27 @@ def visBoundaryTrajectory(patch,elPTraj,totalDist):
             a.plot(el[:,1],el[:,0],'r-')
 
 
-def defineBoundaryPointTrajectories2(forceFun, patch,elP,patchWhitePixels:np.ndarray = None, plot:bool = False , numSteps = 10, maxStepSize = 5):
+def defineBoundaryPointTrajectories2(forceFun, patch,elP,patchWhitePixels:np.ndarray = None, plot:bool = False , numSteps = 10, maxStepSize = 5,
+                                     influenceRange:float = None):
     """
     Same as defineBoundaryPointTrajectories but will not use the vectorfield, but rather estimate
     point distortion at each point of ellipse at a time.
+    influenceRange: If the forceFun has a hard cutoff, passing its range builds a WhitePixelIndex once for the patch
+    and only visits nearby white pixels in every step.
     NOTE: estimating and normalizing the whole vectorfield gives different absolute strength of it, compared to only estimating the
     vf in points of the ellipse, since normalization in the latter case will happen for just the ellipse outlines. In that case things like stepsize might need to be changed.
     """
+    pixelIndex = None
+    if influenceRange is not None:
+        if patchWhitePixels is None:
+            patchWhitePixels = np.stack(np.nonzero(patch), axis=1)
+        pixelIndex = WhitePixelIndex(patchWhitePixels, influenceRange)
+
     elPTraj = np.zeros((numSteps + 1, elP.shape[0], 2))
     elPTraj[0, :, :] = elP
     totalDistortion = [0]
     for i in range(0, numSteps):
-        dif = getBoundaryVectorfieldInPoints(forceFun,elPTraj[i, :, :], patchWhitePixels, patch, False)
+        dif = getBoundaryVectorfieldInPoints(forceFun,elPTraj[i, :, :], patchWhitePixels, patch, False, pixelIndex)
         elPTraj[i + 1, :, :], dist = deformEllipsePixels(elPTraj[i, :, :], maxStepSize,
                                                          dif, patch, False)
 
@@ -335,4 +391,167 @@ def deformEllipsePixels(elP, stepSize:float, dif:np.ndarray, patch = None, plot
         # plt.plot(nC[0],nR[0],'oy')
         # plt.plot(npc,npr,'dm')
 
-    return elPNew,[maxDistortion,meanDistortion,totalDistortion]
\ No newline at end of file
+    return elPNew,[maxDistortion,meanDistortion,totalDistortion]
+
+
+def interpRows(x:np.ndarray, xp:np.ndarray, fp:np.ndarray)->np.ndarray:
+    """
+    Row-wise version of np.interp for M x N arrays, each row of x is interpolated in the respective rows of xp and fp.
+    Follows np.interp exactly, xp needs to be non-decreasing in each row.
+    """
+    #index of last xp <= x, same as np.searchsorted(xp,x,'right') - 1 for each row
+    j = np.sum(xp[:, None, :] <= x[:, :, None], axis=2) - 1
+    jc = np.clip(j, 0, xp.shape[1] - 2)
+    xpj = np.take_along_axis(xp, jc, axis=1)
+    xpj1 = np.take_along_axis(xp, jc + 1, axis=1)
+    fpj = np.take_along_axis(fp, jc, axis=1)
+    fpj1 = np.take_along_axis(fp, jc + 1, axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = (fpj1 - fpj) / (xpj1 - xpj) * (x - xpj) + fpj
+    res = np.where(xpj == x, fpj, res)
+    res = np.where(x < xp[:, :1], fp[:, :1], res)
+    res = np.where(x >= xp[:, -1:], fp[:, -1:], res)
+    return res
+
+
+def deformEllipsesPixels(elP:np.ndarray, stepSize:float, dif:np.ndarray, resample:bool = True):
+    """
+    Batched version of deformEllipsePixels for M ellipses at once.
+    elP and dif are M x N x 2 arrays, returns the deformed M x N x 2 points and an M x 3 array of [max,mean,total] distortion.
+    """
+    dif = dif * stepSize
+
+    #move elllipses
+    elPNew = elP - dif
+
+    #ensure first and last point move ins ame direction as middle between them, to maintain closeness
+    lastPoint = (elPNew[:,0,:] + elPNew[:,-1,:])/2
+    elPNew[:,0,:] = lastPoint
+    elPNew[:,-1,:] = lastPoint
+
+    #normal at each point as mean of the normals of the lines to previous and next point
+    difPrev = elP - np.roll(elP, -1, axis=1)
+    normPrev = np.stack((-difPrev[:,:,1], difPrev[:,:,0]), axis=2)
+    difNext = np.roll(elP, 1, axis=1) - elP
+    normNext = np.stack((-difNext[:,:,1], difNext[:,:,0]), axis=2)
+    norm = (normNext + normPrev)/2
+
+    #project distortion onto normal (normalize by normal length)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distortionPerPoint = np.sum(norm * dif,axis=2) / np.sqrt(norm[:,:,0]**2 + norm[:,:,1]**2)
+    distortionPerPoint[np.isnan(distortionPerPoint)] = 0
+
+    distortion = np.stack((np.max(np.abs(distortionPerPoint), axis=1),
+                           np.mean(np.abs(distortionPerPoint), axis=1),
+                           np.sum(np.abs(distortionPerPoint), axis=1)), axis=1)
+
+    if resample:
+        #resample elPNew such that the points are equidistant along each boundary
+        dif = elPNew - np.roll(elPNew, -1, axis=1)
+        dtab = np.sqrt(dif[:,:,0]**2 + dif[:,:,1]**2)
+        dtab[:,-1] = dtab[:,0]
+        dtab = np.cumsum(dtab, axis=1)
+        #same as np.linspace(0,dtab[-1],N) for each row
+        numP = elPNew.shape[1]
+        samplePos = np.arange(numP)[None, :] * (dtab[:, -1:] / (numP - 1))
+        samplePos[:, -1] = dtab[:, -1]
+        ir = interpRows(samplePos, dtab, elPNew[:,:,0])
+        ic = interpRows(samplePos, dtab, elPNew[:,:,1])
+
+        elPNew[:,:,0] = ir
+        elPNew[:,:,1] = ic
+
+    return elPNew, distortion
+
+
+class MultiPatchPixelIndex:
+    """
+    Spatial index over the white pixels of many patches at once. Each patch has its own set of white pixels and
+    a point of a patch is only influenced by the white pixels of that patch.
+    All white pixels are stored in one flat array with the patch each of them belongs to (segment offsets). Inside the
+    index patch i is moved by i * patchSpacing rows, so that pixels of different patches are not found as neighbours and
+    the vectorfield for all points of all patches can be evaluated in a single pass.
+    """
+    whitePixels:np.ndarray #Wx2 white pixel coordinates inside their patch
+    patchOfPixel:np.ndarray #W patch index of each white pixel
+    patchSpacing:float #distance between patches inside the index
+    influenceRange:float
+    tree:cKDTree
+
+    def __init__(self, patchWhitePixels:List[np.ndarray], influenceRange:float, patchSpacing:float):
+        self.influenceRange = influenceRange
+        self.patchSpacing = patchSpacing
+        self.whitePixels = np.concatenate([wp.reshape(-1,2) for wp in patchWhitePixels]) if len(patchWhitePixels) > 0 else np.zeros((0,2))
+        self.patchOfPixel = np.repeat(np.arange(len(patchWhitePixels)), [len(wp) for wp in patchWhitePixels])
+        self.tree = cKDTree(self.__separate(self.whitePixels, self.patchOfPixel)) if len(self.whitePixels) > 0 else None
+
+    def __separate(self, coords:np.ndarray, patchIdx:np.ndarray):
+        sep = np.array(coords, dtype='float')
+        sep[:,0] += patchIdx * self.patchSpacing
+        return sep
+
+    def getVectorfieldInPoints(self, forcefun, points:np.ndarray)->np.ndarray:
+        """
+        Returns the unnormalized sum of forces onto each of the points (P x N x 2, in coordinates of their patch),
+        caused by the white pixels of their respective patch.
+        """
+        numPatches, numPoints = points.shape[0], points.shape[1]
+        flatPoints = points.reshape(-1, 2)
+        patchOfPoint = np.repeat(np.arange(numPatches), numPoints)
+        fullVectorField = np.zeros_like(flatPoints)
+        if self.tree is None: return fullVectorField.reshape(points.shape)
+
+        #candidate pairs, the small tolerance ensures no pair within range is lost due to rounding when separating patches.
+        #points that drifted further than the spacing could see pixels of other patches, these pairs are removed.
+        pairs = self.tree.sparse_distance_matrix(cKDTree(self.__separate(flatPoints, patchOfPoint)), self.influenceRange + 1e-6, output_type='ndarray')
+        pixelIdx, pointIdx = pairs['i'], pairs['j']
+        samePatch = self.patchOfPixel[pixelIdx] == patchOfPoint[pointIdx]
+        pixelIdx, pointIdx = pixelIdx[samePatch], pointIdx[samePatch]
+
+        #direction and distance in patch coordinates
+        d = flatPoints[pointIdx] - self.whitePixels[pixelIdx]
+        dist = np.sqrt(d[:,0]**2 + d[:,1]**2)
+
+        force = forcefun(dist) / dist
+        fullVectorField[:,0] = np.bincount(pointIdx, force * d[:,0], minlength=len(flatPoints))
+        fullVectorField[:,1] = np.bincount(pointIdx, force * d[:,1], minlength=len(flatPoints))
+        return fullVectorField.reshape(points.shape)
+
+
+def defineBoundaryPointTrajectoriesBatched(forceFun, elP:np.ndarray, patchWhitePixels:List[np.ndarray], influenceRange:float,
+                                           numSteps = 10, maxStepSize = 5, abortSignal:Callable[[],bool] = None, progress:Callable[[float],None] = None):
+    """
+    Same as defineBoundaryPointTrajectories2, but deforms M ellipses at once.
+    elP: M x N x 2 ellipse points, each in the coordinate system of its patch
+    patchWhitePixels: List of M arrays with the white pixel coordinates of each patch
+    Returns the M x K x N x 2 trajectories and M x K cumulated normed distortions or None if execution has been aborted.
+    """
+    #points move at most maxStepSize per step, so patches spaced by this distance never see each other
+    extent = np.concatenate([elP[:,:,0].ravel()] + [wp[:,0] for wp in patchWhitePixels])
+    patchSpacing = extent.max() - extent.min() + 2 * (influenceRange + numSteps * maxStepSize) + 1
+    pixelIndex = MultiPatchPixelIndex(patchWhitePixels, influenceRange, patchSpacing)
+
+    elPTraj = np.zeros((elP.shape[0], numSteps + 1, elP.shape[1], 2))
+    elPTraj[:, 0, :, :] = elP
+    totalDistortion = np.zeros((elP.shape[0], numSteps + 1))
+    for i in range(0, numSteps):
+        dif = pixelIndex.getVectorfieldInPoints(forceFun, elPTraj[:, i, :, :])
+
+        #normalize field such that the longest vector of each ellipse has unit length
+        maxDist = np.sqrt(dif[:,:,0] ** 2 + dif[:,:,1] ** 2).max(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dif /= maxDist[:, None, None]
+
+        elPTraj[:, i + 1, :, :], dist = deformEllipsesPixels(elPTraj[:, i, :, :], maxStepSize, dif)
+        totalDistortion[:, i + 1] = dist[:, 2]
+
+        if progress is not None: progress((i + 1) / numSteps)
+        if abortSignal is not None and abortSignal():
+            return None
+
+    totalDistortion = np.cumsum(totalDistortion, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        totalDistortion /= totalDistortion[:, -1:]
+
+    return elPTraj, totalDistortion
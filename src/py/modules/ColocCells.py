@@ -7,11 +7,11 @@ from scipy.stats import pearsonr
 from shapely.geometry import Polygon
 
 from src.py.modules.ColocCellsUtil.colocdatatypes import CCCells
-from src.py.modules.ColocCellsUtil.colocutil import identifyCellPartners, getColocImages
+from src.py.modules.ColocCellsUtil.colocutil import identifyCellPartners, getColocImages, getColocPreviews
 from src.py.types.CellsDataset import CellsDataset
 from src.sammie.py.modules.ModuleBase import ModuleBase
 from src.sammie.py.util import imgutil, shapeutil
-from src.sammie.py.util.imgutil import getPreviewImage
+from src.sammie.py.util.imgutil import getPreviewImage, getPreviewPlaceholder, renderPreviews
 import numpy as np
 
 
@@ -29,7 +29,9 @@ class ColocCells(ModuleBase):
     keys: ColocCellsKeys
     alignedDataSets: List[Tuple[CellsDataset, CellsDataset]]
     cellImages: List[
-        Tuple[ndarray, ndarray, ndarray, ndarray]]  # PreviewImages for each cell, both channels, mix and coloc only
+        Tuple[Dict, Dict, Dict, Dict]]  # Placeholders of the preview images for each cell, both channels, mix and coloc only
+    previewKeys: List[str]  # Key of the previews of each cell
+    previewSettings: Tuple[List[Tuple[int,int,int]], bool]  # colors and normalization the previews are rendered with
     cellContours: List[Dict]  # Outlines of each cell
     cellFoci: Tuple[List[List[Dict]], List[List[Dict]]]  # For each channel, each cell a list of contours
     selectedCells: List[int]  # Indices of cells selected
@@ -111,15 +113,24 @@ class ColocCells(ModuleBase):
             self.selectedCells = params['select']
             self.addGeneratedData(params)
             return True
+        elif action == 'previews':
+            # previews of the cells visible in the UI
+            cells = [int(c) for c in params['cells']]
+            col, norm = self.previewSettings
+            imgs = renderPreviews(lambda c: getColocPreviews(self.rawImages[c], self.previewKeys[c], col, norm), cells)
+            return {'cells': cells, 'imgs': imgs}
+
         elif action == 'apply':
 
             col,shift,norm = self.unpackParams(**params)
+            self.previewSettings = (col, norm)
 
             # get the input that this step is working on
             self.alignedDataSets = self.session.getData(self.keys.inAlignedDatasets)
 
             # Identify which cell numbers correspond to which in two aligned batches
             self.cellImages = []
+            self.previewKeys = []
             self.rawImages = []
             self.cellContours = []
             self.cellFoci = [[], []]
@@ -132,19 +143,21 @@ class ColocCells(ModuleBase):
                 p = identifyCellPartners(ds1, ds2)
                 p1 = [i for i, j in p]  # cellnumbers in ds1
                 p2 = [j for i, j in p]  # cellnumbers in ds2
-                colocImgs = getColocImages(ds1, ds2, p, '%s_%d' % (self.keys.outIncludedCells, dsnum), col,border,shift,norm)
-                p1 = colocImgs[3]
-                p2 = colocImgs[4]
+                colocImgs = getColocImages(ds1, ds2, p, border,shift,norm)
+                p1 = colocImgs[2]
+                p2 = colocImgs[3]
                 self.cellContours += ds1.getSingleCellContours(p1,border)
+                # previews are requested by JS for the visible cells only, see 'previews' action
+                self.cellImages += [(getPreviewPlaceholder(i1),) * 4 for i1, _, _ in colocImgs[0]]
+                self.previewKeys += ['%s_%d_%d' % (self.keys.outIncludedCells, dsnum, c) for c in p1]
                 dsnum += 1
-                self.cellImages += colocImgs[0]
-                self.rawImages += colocImgs[1]
+                self.rawImages += colocImgs[0]
                 fociContours1 = ds1.getFociContours(p1,True,(border - dsborder,border - dsborder))
                 fociContours2 = ds2.getFociContours(p2, True, (border+shift[0] - dsborder,border+shift[1] - dsborder))
                 self.cellFoci[0] += fociContours1
                 self.cellFoci[1] += fociContours2
-                self.pcc += colocImgs[2]
-                for i, ci in enumerate(colocImgs[1]):
+                self.pcc += colocImgs[1]
+                for i, ci in enumerate(colocImgs[0]):
                     i1, i2, _ = ci
                     self.fpcc += [self.__getCorrelationInFoci(i1, i2, fociContours1[i], fociContours2[i])]
             self.selectedCells = list(range(0, len(self.cellContours)))
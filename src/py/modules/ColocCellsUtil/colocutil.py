@@ -20,7 +20,7 @@ def writeXLSX(csvDataSheets:List[List],names:List[str],path:str):
             ws.write_row(j,0,r)
     wb.close()
 
-def getColocImages(d1:CellsDataset,d2:CellsDataset, partners:List[Tuple[int,int]],key:str, color:List[Tuple[int,int,int]], border:int = 3, shift:Tuple[float,float] = None, normalize:bool = True):
+def getColocImages(d1:CellsDataset,d2:CellsDataset, partners:List[Tuple[int,int]], border:int = 3, shift:Tuple[float,float] = None, normalize:bool = True):
     d2img = d2.img
     if shift is not None:
         f = interpolate.interp2d(np.arange(0,d2.img.shape[0],1),
@@ -28,8 +28,7 @@ def getColocImages(d1:CellsDataset,d2:CellsDataset, partners:List[Tuple[int,int]
 
         d2img = f(np.arange(-shift[1], -shift[1] + d2.img.shape[0]), np.arange(-shift[0], -shift[0] + d2.img.shape[1]))
 
-    """Preview Images are generated as the overlap area of the two cell images and exported as semi transparent masks"""
-    allImgs = []
+    """Images are generated as the overlap area of the two cell images, previews of them are generated with getColocPreviews"""
     allImgsNumpy = []
     allCorrelations = []
     usedP1 = []
@@ -68,19 +67,11 @@ def getColocImages(d1:CellsDataset,d2:CellsDataset, partners:List[Tuple[int,int]
             img1 = addBorder(img1,border)
             img2 = addBorder(img2,border)
 
-        mixColor = tuple(map(sum, zip(color[0], color[1])))
         if normalize:
             imgMix = norm(img1) * norm(img2)
         else:
             imgMix = img1 * img2
 
-        mix = getPreviewImage(imgMix,'%s_m_%d'%(key,p1),True,mixColor,False)
-
-        allImgs += [(getPreviewImage(img1,'%s_0_%d'%(key,p1),True,color[0],normalize), # CHANNEL 1
-                     getPreviewImage(img2,'%s_1_%d'%(key,p1),True,color[1],normalize), #CHANNEL 2
-                     mix, #COLOC ONLY IMAGE
-                     joinChannels('%s_j_%d' % (key, p1), img1, color[0], img2, color[1], normalize) #MIXED IMAGE
-                     )]
         allImgsNumpy += [[img1,img2,imgMix]]
         usedP1 += [p1]
         usedP2 += [p2]
@@ -88,7 +79,19 @@ def getColocImages(d1:CellsDataset,d2:CellsDataset, partners:List[Tuple[int,int]
     if numskipped > 0:
         print('Warning: Colocalization skipped %d cells, due to closeness to border'%numskipped)
 
-    return allImgs,allImgsNumpy,allCorrelations,usedP1,usedP2
+    return allImgsNumpy,allCorrelations,usedP1,usedP2
+
+
+def getColocPreviews(imgs:List[np.ndarray], key:str, color:List[Tuple[int,int,int]], normalize:bool = True):
+    """Preview images of a cell, for both channels, the coloc only image and both channels joined. imgs are the images of the cell returned by getColocImages"""
+    img1, img2, imgMix = imgs
+    mixColor = tuple(map(sum, zip(color[0], color[1])))
+
+    return (getPreviewImage(img1,'%s_0'%key,True,color[0],normalize), # CHANNEL 1
+            getPreviewImage(img2,'%s_1'%key,True,color[1],normalize), #CHANNEL 2
+            getPreviewImage(imgMix,'%s_m'%key,True,mixColor,False), #COLOC ONLY IMAGE
+            joinChannels('%s_j' % key, img1, color[0], img2, color[1], normalize) #MIXED IMAGE
+            )
 
 
 def identifyCellPartners(d1:CellsDataset,d2:CellsDataset):
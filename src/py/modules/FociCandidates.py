@@ -27,9 +27,9 @@ class FociCandidates(ModuleBase):
         self.log = 'FociCandidates'
         self.trace('initialized')
 
-    def unpackParams(self,fociSize, granularity, cellNum):
+    def unpackParams(self,fociSize, granularity, cellNum, engine = 'levels'):
         #unpack and possibly parse/cast all parameters
-        return fociSize,granularity[0], cellNum
+        return fociSize,granularity[0], cellNum, engine
 
     def run(self, action, params, inputkeys,outputkeys):
         self.keys = FociCandidatesKeys(inputkeys, outputkeys)
@@ -49,9 +49,9 @@ class FociCandidates(ModuleBase):
             return {'imgs':previews,'contours':allContours}
 
         elif action == 'apply':
-            fociSize,granularity,cellNum = self.unpackParams(**params)
+            fociSize,granularity,cellNum,engine = self.unpackParams(**params)
 
-            ss = self.fociData.extractSingleContour(fociSize,granularity,cellNum)
+            ss = self.fociData.extractSingleContour(fociSize,granularity,cellNum,engine)
 
             #we do not pass any data here, since the only relevant thing are the parameters.
             self.onGeneratedData(self.keys.outCandidateParameters, [], params)
@@ -0,0 +1,78 @@
+from typing import List, Dict
+
+import numpy as np
+
+from src.py.util.modelutil import getFlatPolygonAreas
+
+
+class CellContours:
+    """
+    The contours of all foci of a cell at all their levels, as generated for labelling. All coordinates are stored in a single buffer,
+    contours and foci are ranges inside of it. Indexing behaves like the nested lists used before: cellContours[focus][level] is a Kx2 array,
+    which is a view into the buffer.
+    """
+
+    coords: np.ndarray #P x 2 (row,col) coordinates of all contours
+    contourOffsets: np.ndarray #C+1 start of each contour in coords, the last entry is P
+    fociOffsets: np.ndarray #F+1 start of the contours of each focus in contourOffsets, the last entry is C
+    levels: np.ndarray #C intensity level of each contour
+
+    def __init__(self, coords:np.ndarray, contourOffsets:np.ndarray, fociOffsets:np.ndarray, levels:np.ndarray):
+        self.coords = coords
+        self.contourOffsets = contourOffsets
+        self.fociOffsets = fociOffsets
+        self.levels = levels
+
+    @classmethod
+    def fromLists(cls, cnts:List[List[np.ndarray]], lvls:List[List[float]])->'CellContours':
+        """Creates the container from a list of contours and a list of levels per focus."""
+        allCnts = [cnt for f in cnts for cnt in f]
+        coords = np.concatenate(allCnts).astype('float') if len(allCnts) > 0 else np.zeros((0, 2))
+        contourOffsets = np.concatenate([[0], np.cumsum([len(cnt) for cnt in allCnts])]).astype('int')
+        fociOffsets = np.concatenate([[0], np.cumsum([len(f) for f in cnts])]).astype('int')
+        levels = np.array([l for f in lvls for l in f], dtype='float')
+        return cls(coords, contourOffsets, fociOffsets, levels)
+
+    @classmethod
+    def fromJS(cls, foci:List[List[Dict]])->'CellContours':
+        """Creates the container from the JS format, see toJS"""
+        cnts = [[np.column_stack((cnt['y'], cnt['x'])) for cnt in f] for f in foci]
+        lvls = [[cnt['lvl'] for cnt in f] for f in foci]
+        return cls.fromLists(cnts, lvls)
+
+    def __len__(self):
+        return len(self.fociOffsets) - 1
+
+    def __getitem__(self, focus:int)->List[np.ndarray]:
+        if focus < 0: focus += len(self)
+        if focus < 0 or focus >= len(self): raise IndexError('Focus %d out of range' % focus)
+
+        return [self.getContour(i) for i in range(self.fociOffsets[focus], self.fociOffsets[focus + 1])]
+
+    def __iter__(self):
+        for f in range(len(self)):
+            yield self[f]
+
+    def getContour(self, contourIndex:int)->np.ndarray:
+        """Contour by its index among all contours of the cell"""
+        return self.coords[self.contourOffsets[contourIndex]:self.contourOffsets[contourIndex + 1]]
+
+    def getLevels(self)->List[np.ndarray]:
+        """The levels of the contours of each focus"""
+        return [self.levels[self.fociOffsets[f]:self.fociOffsets[f + 1]] for f in range(len(self))]
+
+    def getAreas(self)->List[np.ndarray]:
+        """The areas of the contours of each focus"""
+        areas = getFlatPolygonAreas(self.coords, self.contourOffsets)
+        return [areas[self.fociOffsets[f]:self.fociOffsets[f + 1]] for f in range(len(self))]
+
+    def toJS(self)->List[List[Dict]]:
+        """Contours in the JSON capable format of the JS SingleCellLabelingData datatype."""
+        x, y = self.coords[:, 1].tolist(), self.coords[:, 0].tolist()
+        o = self.contourOffsets
+        res = []
+        for f in range(len(self)):
+            res += [[{'x': x[o[i]:o[i + 1]], 'y': y[o[i]:o[i + 1]], 'lvl': self.levels[i]}
+                     for i in range(self.fociOffsets[f], self.fociOffsets[f + 1])]]
+
+        return res
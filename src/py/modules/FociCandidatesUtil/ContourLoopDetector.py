@@ -3,6 +3,8 @@ from typing import Tuple
 import numpy as np
 import skimage
 import skimage.filters
+import skimage.measure
+import skimage.morphology
 import src.sammie.py.util.imgutil as imgutil
 from src.py.modules.FociCandidatesUtil.ContourLoopsInCell import ContourLoopsInCell
 from src.sammie.py.util import shapeutil
@@ -13,16 +15,20 @@ class ContourLoopDetectorParams:
     #Average size of Foci, 2x0 Array
     lenBounds:np.ndarray
 
-    def __init__(self, lenBounds:Tuple[int,int] , granularity:int = 100 ):
+    def __init__(self, lenBounds:Tuple[int,int] , granularity:int = 100, engine:str = 'levels' ):
         """
         Parameters for Contour Loop detection
         Args:
             lenBounds (Tuple(int,int)): Desired circumference of inner loop and outer loop
             granularity (int): Contour Loops are analyzed by first finding all contours at this many levels and then picking out closed loops.
             Not overly critical but governs how close the shortest and longest contours will be to the desired size
+            engine (str): 'levels' extracts and compares all contours level by level, 'maxtree' reads the nesting of contours off a
+            component tree of the image and only extracts the contours it needs. Much faster, but approximate: it assumes that contours get shorter
+            with rising level, which noise can break, so some bounds can differ by a few levels.
         """
         self.lenBounds = np.array(lenBounds)
         self.granularity = granularity
+        self.engine = engine
 
     def getFociAreaBounds(self):
         return np.pi * self.lenBounds ** 2
@@ -38,6 +44,8 @@ class ContourLoopDetector:
         return np.count_nonzero(skimage.measure.points_in_poly([p], cnt)) > 0
 
     def run(self, cellImg, debug = False)->ContourLoopsInCell:
+        if self.__params.engine == 'maxtree':
+            return self.__runMaxTree(cellImg)
 
         level = np.linspace(cellImg.max(), cellImg.min(), self.__params.granularity)
 
@@ -79,4 +87,157 @@ class ContourLoopDetector:
         if debug:
             self.__plotResult(cellImg, result)
 
-        return result
\ No newline at end of file
+        return result
+
+    def __runMaxTree(self, cellImg)->ContourLoopsInCell:
+        """
+        Approximates the level by level search, the nesting of contours is taken from a max-tree of the image quantized to
+        the granularity levels. Each node of the tree is a 4-connected region above a range of levels, the same regions marching squares
+        draws contours around. Contours are only extracted on a patch around a node and only at the levels needed to find the bounds.
+        The bounds are found by binary searches over the contour lengths, if noise makes the lengths non monotonic they can be off by a few levels.
+        Loops are returned in the same order as the level by level search returns them.
+        """
+        lb, ub = self.__params.lenBounds
+        levels = np.linspace(cellImg.max(), cellImg.min(), self.__params.granularity)[::-1] #same levels, ascending
+        # the region above levels[j] is the region with q > j
+        q = np.searchsorted(levels, cellImg, side='left')
+        parent, traverser = skimage.morphology.max_tree(q, connectivity=1)
+        parent, q, img = parent.ravel(), q.ravel(), cellImg
+
+        #canonical pixels represent the nodes of the tree, traverser lists parents before children
+        isCanonical = np.logical_or(parent == np.arange(len(parent)), q[parent] != q)
+        nodes = traverser[isCanonical[traverser]]
+        nodeOf = np.where(isCanonical, np.arange(len(parent)), parent)
+
+        #bounding box of every subtree
+        rr, cc = np.unravel_index(np.arange(len(parent)), cellImg.shape)
+        bbox = np.zeros((len(parent), 4), dtype='int')
+        bbox[:, 0:2] = np.iinfo('int').max
+        bbox[:, 2:4] = -1
+        np.minimum.at(bbox[:, 0], nodeOf, rr)
+        np.minimum.at(bbox[:, 1], nodeOf, cc)
+        np.maximum.at(bbox[:, 2], nodeOf, rr)
+        np.maximum.at(bbox[:, 3], nodeOf, cc)
+        children = {n: [] for n in nodes}
+        for n in nodes[:0:-1]:
+            pn = parent[n]
+            children[pn] += [n]
+            bbox[pn, 0:2] = np.minimum(bbox[pn, 0:2], bbox[n, 0:2])
+            bbox[pn, 2:4] = np.maximum(bbox[pn, 2:4], bbox[n, 2:4])
+
+        #open contours touch the image border
+        isClosed = np.logical_and(np.all(bbox[:, 0:2] > 0, axis=1), np.logical_and(bbox[:, 2] < cellImg.shape[0] - 1, bbox[:, 3] < cellImg.shape[1] - 1))
+
+        contourCache = {}
+        def getContour(n, j):
+            #None if marching squares closes no contour around the node, e.g. where it connects regions diagonally
+            if (n, j) not in contourCache:
+                contourCache[(n, j)] = None
+                rs = slice(bbox[n, 0] - 1, bbox[n, 2] + 2)
+                cs = slice(bbox[n, 1] - 1, bbox[n, 3] + 2)
+                p = [[rr[n] - rs.start, cc[n] - cs.start]]
+                for cnt in skimage.measure.find_contours(img[rs, cs], levels[j]):
+                    if np.all(cnt[0, :] == cnt[-1, :]) and np.count_nonzero(skimage.measure.points_in_poly(p, cnt)) > 0:
+                        cnt = cnt + [rs.start, cs.start]
+                        contourCache[(n, j)] = (cnt, shapeutil.contourLength(cnt))
+                        break
+            return contourCache[(n, j)]
+
+        def lastWhere(cond, lo, hi):
+            #largest j in [lo,hi] for which cond holds, assuming it holds up to some j and not after. lo-1 if none
+            while lo <= hi:
+                mid = (lo + hi) // 2
+                if cond(mid): lo = mid + 1
+                else: hi = mid - 1
+            return hi
+
+        #a closed contour around a region is at least as long as twice the diagonal of the region's bounding box
+        minLength = 2 * np.sqrt((bbox[:, 2] - bbox[:, 0]) ** 2 + (bbox[:, 3] - bbox[:, 1]) ** 2)
+
+        #chains of nodes without branches form segments, along which contours shrink with each level.
+        #Only the part of a segment where contours are closed and can be short enough is of interest.
+        segments = [] #nodes in segment with their lowest level, rising
+        segChildren = []
+        segOf = {}
+        for n in nodes:
+            pn = parent[n]
+            if pn != n and len(children[pn]) == 1:
+                sid = segOf[pn]
+            else:
+                sid = len(segments)
+                segments += [[]]
+                segChildren += [[]]
+                if pn != n: segChildren[segOf[pn]] += [sid]
+            segOf[n] = sid
+            lo = q[pn] if pn != n else 0
+            if isClosed[n] and lo < q[n] and minLength[n] <= ub:
+                segments[sid] += [(lo, n)]
+
+        def segContour(sid, j):
+            los = [lo for lo, n in segments[sid]]
+            return getContour(segments[sid][np.searchsorted(los, j, side='right') - 1][1], j)
+
+        def segLength(sid, j):
+            #a missing contour is never valid
+            c = segContour(sid, j)
+            return np.inf if c is None else c[1]
+
+        def segRange(sid):
+            return segments[sid][0][0], q[segments[sid][-1][1]] - 1
+
+        #find the lowest level with a valid contour in each segment, top down
+        validFrom = {}
+        toVisit = [0]
+        visited = []
+        while len(toVisit) > 0:
+            sid = toVisit.pop()
+            visited += [sid]
+            if len(segments[sid]) == 0:
+                toVisit += segChildren[sid]
+                continue
+
+            lo, hi = segRange(sid)
+            ja = lastWhere(lambda j: segLength(sid, j) > ub, lo, hi) + 1
+            if ja <= hi and lb <= segLength(sid, ja) <= ub:
+                validFrom[sid] = ja
+
+            #contours of child segments are shorter than the shortest in this one
+            if segLength(sid, hi) >= lb:
+                toVisit += segChildren[sid]
+
+        subtreeValid = {}
+        for sid in visited[::-1]:
+            subtreeValid[sid] = sid in validFrom or any([subtreeValid.get(c, False) for c in segChildren[sid]])
+
+        #seeds are the innermost valid contours, their outer contour is the lowest valid contour of the topmost valid segment above
+        segParent = {c: sid for sid in visited for c in segChildren[sid]}
+        result = ContourLoopsInCell(cellImg)
+        seeds = []
+        for sid in visited:
+            if sid not in validFrom or any([subtreeValid.get(c, False) for c in segChildren[sid]]): continue
+            outerSeg, a = sid, sid
+            while a in segParent:
+                a = segParent[a]
+                if a in validFrom: outerSeg = a
+
+            ja = validFrom[outerSeg]
+            jb = lastWhere(lambda j: lb <= segLength(sid, j) <= ub, validFrom[sid], segRange(sid)[1])
+            if outerSeg == sid and ja == jb: continue #no contour containing the seed
+
+            seeds += [(jb, sid, outerSeg, ja)]
+
+        def scanOrder(cnt):
+            #find_contours returns the contours of a level in the order their first square is reached scanning the image row by row
+            squares = np.floor(np.minimum(cnt[:-1], cnt[1:])).astype('int')
+            return tuple(squares[np.lexsort((squares[:, 1], squares[:, 0]))[0]])
+
+        #same order as when going through the levels from top to bottom
+        for jb, sid, outerSeg, ja in sorted(seeds, key=lambda s: (-s[0], scanOrder(segContour(s[1], s[0])[0]), s[1])):
+            result.contours += [[segContour(outerSeg, ja)[0], segContour(sid, jb)[0]]]
+            result.levels += [[levels[ja], levels[jb]]]
+
+        result.discardSeedContoursWithoutOuter()
+        result.analyzeMergableContours()
+
+        return result
+
@@ -1,7 +1,165 @@
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 import skimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src.py.modules.FociCandidatesUtil.CellContours import CellContours
+
+#Marching squares cases (bit 1: upper left, 2: upper right, 4: lower left, 8: lower right above level) and their segments
+#as (from,to) edges 0: top, 1: bottom, 2: left, 3: right. Orientation and order is the one of skimage.measure.find_contours with
+#fully_connected = 'low', saddles are always split.
+_TOP, _BOTTOM, _LEFT, _RIGHT = 0, 1, 2, 3
+_NONE = -1
+SQUARE_SEGMENTS = np.array([
+    [[_NONE, _NONE], [_NONE, _NONE]], [[_TOP, _LEFT], [_NONE, _NONE]], [[_RIGHT, _TOP], [_NONE, _NONE]], [[_RIGHT, _LEFT], [_NONE, _NONE]],
+    [[_LEFT, _BOTTOM], [_NONE, _NONE]], [[_TOP, _BOTTOM], [_NONE, _NONE]], [[_RIGHT, _TOP], [_LEFT, _BOTTOM]], [[_RIGHT, _BOTTOM], [_NONE, _NONE]],
+    [[_BOTTOM, _RIGHT], [_NONE, _NONE]], [[_TOP, _LEFT], [_BOTTOM, _RIGHT]], [[_BOTTOM, _TOP], [_NONE, _NONE]], [[_BOTTOM, _LEFT], [_NONE, _NONE]],
+    [[_LEFT, _RIGHT], [_NONE, _NONE]], [[_TOP, _RIGHT], [_NONE, _NONE]], [[_LEFT, _TOP], [_NONE, _NONE]], [[_NONE, _NONE], [_NONE, _NONE]],
+])
+
+
+def findLoopsAroundPoints(patches: List[np.ndarray], levels: np.ndarray, points: np.ndarray) -> List[List[Tuple[int, np.ndarray]]]:
+    """
+    Finds the closed contours that contain a point at a number of levels, for several patches in one sweep.
+    The result is the same as running skimage.measure.find_contours on each patch for each level and keeping the closed contours that
+    contain the point (including it as vertex), with the same order and starting point of contours.
+    Args:
+        patches (List[np.ndarray]): P image patches
+        levels (np.ndarray): P x N levels to search at in each patch
+        points (np.ndarray): P x 2 (row,col) points inside the patches
+
+    Returns:
+        For each patch a list of (level index, K x 2 contour) ordered by level and by the order find_contours would return them.
+    """
+    numLevels = levels.shape[1]
+    # stack all patches, padding with NaN. Squares touching padding have no segments, like squares outside the patch.
+    h = max([p.shape[0] for p in patches])
+    w = max([p.shape[1] for p in patches])
+    img = np.full((len(patches), h, w), np.nan)
+    for i, p in enumerate(patches):
+        img[i, 0:p.shape[0], 0:p.shape[1]] = p
+
+    # case of every square at every level, ordered by patch, level, row, col
+    lvl = levels[:, :, None, None]
+    above = (img[:, None, :, :] > lvl).astype('uint8')
+    case = above[:, :, :-1, :-1] + 2 * above[:, :, :-1, 1:] + 4 * above[:, :, 1:, :-1] + 8 * above[:, :, 1:, 1:]
+    valid = ~np.isnan(img[:, :-1, :-1] + img[:, :-1, 1:] + img[:, 1:, :-1] + img[:, 1:, 1:])
+    case[~np.broadcast_to(valid[:, None], case.shape)] = 0
+    pi, li, r, c = np.nonzero(np.logical_and(case > 0, case < 15))
+    case = case[pi, li, r, c]
+
+    # interpolated points on the edges of these squares
+    ul, ur, ll, lr = img[pi, r, c], img[pi, r, c + 1], img[pi, r + 1, c], img[pi, r + 1, c + 1]
+    l = levels[pi, li]
+    def frac(fromVal, toVal):
+        d = toVal - fromVal
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(d == 0, 0, (l - fromVal) / np.where(d == 0, 1, d))
+    edgePts = np.stack([
+        np.stack([r.astype('float'), c + frac(ul, ur)], axis=1),  # top
+        np.stack([r + 1.0, c + frac(ll, lr)], axis=1),  # bottom
+        np.stack([r + frac(ul, ll), c.astype('float')], axis=1),  # left
+        np.stack([r + frac(ur, lr), c + 1.0], axis=1),  # right
+    ])
+
+    # segments in the order find_contours generates them, the second segment of saddles directly after the first
+    segs = SQUARE_SEGMENTS[case]  # S x 2 x 2
+    sq = np.repeat(np.arange(len(case)), 2)
+    segs = segs.reshape(-1, 2)
+    hasSeg = segs[:, 0] != _NONE
+    sq, segs = sq[hasSeg], segs[hasSeg]
+    fromPts = edgePts[segs[:, 0], sq]
+    toPts = edgePts[segs[:, 1], sq]
+    group = pi[sq] * numLevels + li[sq] #patch and level a segment belongs to
+
+    # degenerate segments occur when a corner lies exactly on the level
+    nonDegenerate = np.any(fromPts != toPts, axis=1)
+    fromPts, toPts, group, sq, segs = fromPts[nonDegenerate], toPts[nonDegenerate], group[nonDegenerate], sq[nonDegenerate], segs[nonDegenerate]
+    numSegs = len(group)
+    if numSegs == 0: return [[] for p in patches]
+
+    # identify points by their coordinates within a patch and level, as find_contours does. A point lies on a grid edge and can only
+    # coincide with a point of another edge if it lies on a corner, giving an integer key for each point.
+    sqR, sqC = r[sq], c[sq]
+    numCorners, numHor = (h + 1) * (w + 1), (h + 1) * w
+    def pointKeys(edge, pt):
+        onHor = edge < 2
+        row = sqR + (edge == 1)
+        col = sqC + (edge == 3)
+        along = np.where(onHor, pt[:, 1], pt[:, 0])
+        onCorner = along == np.floor(along)
+        key = np.where(onHor, numCorners + row * w + col, numCorners + numHor + row * (w + 1) + col)
+        corner = np.where(onHor, row * (w + 1) + along.astype('int'), along.astype('int') * (w + 1) + col)
+        return group * (numCorners + numHor + h * (w + 1)) + np.where(onCorner, corner, key)
+
+    keys = np.concatenate([pointKeys(segs[:, 0], fromPts), pointKeys(segs[:, 1], toPts)])
+    _, firstIdx, ids = np.unique(keys, return_index=True, return_inverse=True)
+    fromID, toID = ids[:numSegs], ids[numSegs:]
+    pts = np.concatenate([fromPts, toPts])[firstIdx]
+    ptGroup = np.concatenate([group, group])[firstIdx]
+    numPts = len(pts)
+
+    # each chain of segments is a component, it is a closed loop if every point has exactly one segment in and out
+    numComp, comp = connected_components(coo_matrix((np.ones(numSegs), (fromID, toID)), shape=(numPts, numPts)), directed=False)
+    degreeOk = np.logical_and(np.bincount(fromID, minlength=numPts) == 1, np.bincount(toID, minlength=numPts) == 1)
+    closed = np.bincount(comp, weights=~degreeOk, minlength=numComp) == 0
+
+    # point in polygon as skimage.measure.points_in_poly tests it: crossings of a ray to either side, points on a vertex or edge are inside
+    segComp = comp[fromID]
+    compGroup = np.zeros(numComp, dtype='int')
+    compGroup[segComp] = group
+    p = points[group // numLevels]
+    x0, y0 = toPts[:, 0] - p[:, 0], toPts[:, 1] - p[:, 1]
+    x1, y1 = fromPts[:, 0] - p[:, 0], fromPts[:, 1] - p[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crossing = (x0 * y1 - x1 * y0) / (y1 - y0)
+    rightCross = np.logical_and((y0 > 0) != (y1 > 0), crossing > 0)
+    leftCross = np.logical_and((y0 < 0) != (y1 < 0), crossing < 0)
+    rightOdd = np.bincount(segComp, weights=rightCross, minlength=numComp) % 2 == 1
+    leftOdd = np.bincount(segComp, weights=leftCross, minlength=numComp) % 2 == 1
+    inside = np.logical_or(rightOdd, rightOdd != leftOdd)
+    isVertex = np.all(np.abs(pts - points[ptGroup // numLevels]) < 1e-12, axis=1)
+    inside[comp[isVertex]] = True
+    selected = np.nonzero(np.logical_and(closed, inside))[0]
+    if len(selected) == 0: return [[] for p in patches]
+
+    # find_contours numbers contours by their first segment and starts a closed one at the end point of its last segment
+    segIdx = np.arange(numSegs)
+    firstSeg = np.full(numComp, numSegs)
+    np.minimum.at(firstSeg, segComp, segIdx)
+    lastSeg = np.full(numComp, -1)
+    np.maximum.at(lastSeg, segComp, segIdx)
+    selected = selected[np.lexsort((firstSeg[selected], compGroup[selected]))]
+
+    # order the points of the selected loops by following the segments, using pointer jumping
+    nxt = np.arange(numPts)
+    nxt[fromID] = toID
+    startPt = toID[lastSeg[selected]]
+    endPt = fromID[lastSeg[selected]]
+    nxt[endPt] = endPt
+    dist = np.ones(numPts, dtype='int')
+    dist[endPt] = 0
+    for i in range(int(np.ceil(np.log2(numPts))) + 1):
+        dist = dist + dist[nxt]
+        nxt = nxt[nxt]
+
+    isSelected = np.zeros(numComp, dtype='bool')
+    isSelected[selected] = True
+    selPts = np.nonzero(isSelected[comp])[0]
+    rank = np.zeros(numComp, dtype='int')
+    rank[selected] = np.arange(len(selected))
+    compRank = rank[comp[selPts]]
+    pos = dist[startPt[compRank]] - dist[selPts]
+    selPts = selPts[np.lexsort((pos, compRank))]
+    loops = np.split(pts[selPts], np.cumsum(np.bincount(compRank, minlength=len(selected)))[:-1])
+
+    res = [[] for p in patches]
+    for i, cmp in enumerate(selected):
+        g = compGroup[cmp]
+        res[g // numLevels] += [(g % numLevels, np.concatenate([loops[i], loops[i][:1]]))]
+    return res
 
 
 class ContourLoopsInCell:
@@ -24,42 +182,48 @@ class ContourLoopsInCell:
         rs = slice(max(rmin, 0), min(rmax + 1, self.img.shape[0]))
         cs = slice(max(cmin, 0), min(cmax + 1, self.img.shape[1]))
         return rs, cs, self.img[rs,cs]
-    def getJSLabelingContours(self, numLevelsPerFoci:int):
+    def getLabelingContours(self, numLevelsPerFoci:int)->CellContours:
         """
-        Sends all contours for all foci, for the user to be able to specify the exact contour they want
+        Generates all contours for all foci, that the user can choose the boundary of a foci from. All foci of the cell are
+        searched in a single sweep over all levels, see findLoopsAroundPoints.
         Args:
             numLevelsPerFoci (int): The number of polygons to generate for each foci, simply governs how fine the user can set the boundary.
             The absolute levels are not accounted for, so sometimes the changes are minute if max and min levels differ onyl insignificantly
         Returns:
-            A JSON capable dictionary corresponding to the JS SingleCellLabelingData datatype.
+            The contours of all foci and the levels they were found at.
         """
-        res = {'foci':[]}
-
-        if self.contours is None or len(self.contours) == 0: return res
+        if self.contours is None or len(self.contours) == 0: return CellContours.fromLists([], [])
 
+        patches, offsets, checkPoints = [], [], []
+        lvls = np.zeros((len(self.contours), numLevelsPerFoci))
         for i, (outer, inner) in enumerate(self.contours):
-            lvl = np.linspace(self.levels[i, 1], self.levels[i, 0], numLevelsPerFoci)
+            lvls[i, :] = np.linspace(self.levels[i, 1], self.levels[i, 0], numLevelsPerFoci)
             rs, cs, patch = self.__minMaxPatchAround(outer)
+            patches += [patch]
+            offsets += [[rs.start, cs.start]]
+            # found contour needs to contain the inner one
+            checkPoints += [inner[0, :] - offsets[-1]]
 
-            checkPoint = [inner[0, :] - [rs.start, cs.start]]
-            fociRes = []
-            for l in lvl:
-                contours = skimage.measure.find_contours(patch, l)
-                for cnt in contours:
-                    # plt.plot(cnt[:, 1], cnt[:, 0], 'r-')
-                    isClosed = np.all(cnt[0, :] == cnt[-1, :])
-                    # found contour needs to contain the inner one
-                    containsInner = np.count_nonzero(skimage.measure.points_in_poly(checkPoint, cnt)) > 0
-                    if not isClosed or not containsInner:
-                        continue
+        allCnts, allLvls, numPerFoci = [], [], []
+        for i, loops in enumerate(findLoopsAroundPoints(patches, lvls, np.array(checkPoints))):
+            allCnts += [cnt + offsets[i] for l, cnt in loops]
+            allLvls += [lvls[i, l] for l, cnt in loops]
+            numPerFoci += [len(loops)]
 
-                    fociRes += [{'x': np.around((cnt[:, 1] + cs.start), decimals=3).tolist(),
-                                 'y': np.around((cnt[:, 0] + rs.start), decimals=3).tolist(),
-                                 'lvl': l}]
+        coords = np.around(np.concatenate(allCnts), decimals=3) if len(allCnts) > 0 else np.zeros((0, 2))
+        contourOffsets = np.concatenate([[0], np.cumsum([len(cnt) for cnt in allCnts])]).astype('int')
+        fociOffsets = np.concatenate([[0], np.cumsum(numPerFoci)]).astype('int')
+        return CellContours(coords, contourOffsets, fociOffsets, np.array(allLvls, dtype='float'))
 
-            res['foci'] += [fociRes]
-
-        return res
+    def getJSLabelingContours(self, numLevelsPerFoci:int):
+        """
+        Sends all contours for all foci, for the user to be able to specify the exact contour they want
+        Args:
+            numLevelsPerFoci (int): See getLabelingContours
+        Returns:
+            A JSON capable dictionary corresponding to the JS SingleCellLabelingData datatype.
+        """
+        return {'foci': self.getLabelingContours(numLevelsPerFoci).toJS()}
 
     def getJSPreviewContours(self):
         """Sends the largest and shortest contours for the user to preview the effects of parameters"""
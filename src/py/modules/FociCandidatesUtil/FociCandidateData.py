@@ -1,69 +1,183 @@
-from typing import List, Tuple, Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import List, Tuple, Callable, Dict
 
 import numpy as np
 from numpy import ndarray
 
 from src.sammie.py.eeljsinterface import eeljs_sendProgress
 from src.py.modules.FociCandidatesUtil.ContourLoopDetector import ContourLoopDetectorParams, ContourLoopDetector
+from src.py.modules.FociCandidatesUtil.CellContours import CellContours
 from src.py.modules.FociCandidatesUtil.ContourLoopsInCell import ContourLoopsInCell
 from src.sammie.py.util import imgutil
 import matplotlib.pyplot as plt
 
+
+def detectContourLoopsInChunk(shmName:str, layout:List[Tuple[int,Tuple,str]], circRange:Tuple[int,int], granularity:int, engine:str)->List[ContourLoopsInCell]:
+    """
+    Runs the contour loop detection on a chunk of cells inside a worker process of FociCandidateData.extractContours.
+    Args:
+        shmName (str): Name of the shared memory block holding the cell images
+        layout (List): For each cell of the chunk the (byte offset, shape, dtype) of its image inside the shared memory block
+    Returns: The detected loops for each cell, without their image to avoid sending it back to the main process.
+    """
+    shm = shared_memory.SharedMemory(name=shmName)
+    try:
+        cld = ContourLoopDetector(ContourLoopDetectorParams(circRange, granularity, engine))
+        res = []
+        for offset, shape, dtype in layout:
+            img = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset).copy()
+            r = cld.run(img)
+            r.img = None
+            res += [r]
+        return res
+    finally:
+        shm.close()
+
+
 class FociCandidateData:
     #Stores all Images for a dataset, can extract contours cell by cell.
 
     images: List[ndarray]
     allContours: List[ContourLoopsInCell]
+    __loopsParams: Tuple #extraction parameters the cached loops were generated with
+    __loopsByCell: Dict[int, ContourLoopsInCell] #cache of detected loops by cell index
+    minCellsPerWorker = 50 #cells are only extracted in a process pool if each worker gets at least this many cells
+    cellsPerChunk = 25 #number of cells sent to a worker at once, small chunks keep progress updates and aborting responsive
 
     def __init__(self, allImages:List[np.ndarray]):
         self.images = allImages
         self.allContours = []
+        self.__loopsParams = None
+        self.__loopsByCell = {}
+
+    def __useParams(self, circRange:Tuple[int,int], granularity:int, engine:str):
+        #drops memoized loops, if they were generated with other parameters
+        params = (tuple(circRange), granularity, engine)
+        if params != self.__loopsParams:
+            self.__loopsParams = params
+            self.__loopsByCell = {}
+
+    def getContourLoops(self, cell:int, circRange:Tuple[int,int], granularity:int, engine:str = 'levels')->ContourLoopsInCell:
+        """
+        Runs the contour loop detection on a cell. Results are memoized by cell, only for the most recently used parameters,
+        so switching between parameters in the UI doesn't accumulate results for the whole dataset multiple times.
+        """
+        self.__useParams(circRange, granularity, engine)
 
-    def extractSingleContour(self,circRange:Tuple[int,int], granularity:int, cell:int)->ContourLoopsInCell:
-        cldp = ContourLoopDetectorParams(circRange,granularity)
-        cld = ContourLoopDetector(cldp)
-        return cld.run(self.images[cell])
+        if cell not in self.__loopsByCell:
+            cld = ContourLoopDetector(ContourLoopDetectorParams(circRange, granularity, engine))
+            self.__loopsByCell[cell] = cld.run(self.images[cell])
+
+        return self.__loopsByCell[cell]
+
+    def extractSingleContour(self,circRange:Tuple[int,int], granularity:int, cell:int, engine:str = 'levels')->ContourLoopsInCell:
+        return self.getContourLoops(cell, circRange, granularity, engine)
 
     def showCell(self, cellNum:int,circRange:Tuple[int,int], granularity:int):
         plt.imshow(self.images[cellNum],'gray')
-        cldp = ContourLoopDetectorParams(circRange, granularity)
-        cld = ContourLoopDetector(cldp)
-        r:ContourLoopsInCell = cld.run(self.images[cellNum])
-        js = r.getJSLabelingContours(20)['foci']
-        for f in js:
-            cnt = np.column_stack((f[-1]['y'], f[-1]['x']))
-            imgutil.plotContour(plt, cnt)
+        r:ContourLoopsInCell = self.getContourLoops(cellNum, circRange, granularity)
+        for f in r.getLabelingContours(20):
+            imgutil.plotContour(plt, f[-1])
 
 
-    def extractLabellingContour(self,forCell:int, circRange:Tuple[int,int], granularity:int, numLevelsPerFoci:int = 20):
+    def extractLabellingContour(self,forCell:int, circRange:Tuple[int,int], granularity:int, numLevelsPerFoci:int = 20, engine:str = 'levels'):
         """
         Extracts a dictionary of JSON contours for all cells and returns them.
         Args:
             circRange ():
             granularity ():
             numLevelsPerFoci ():
+            engine (): See ContourLoopDetectorParams
 
         Returns: A List of JSONable dictionaries for labelling
         """
-        cldp = ContourLoopDetectorParams(circRange, granularity)
-        cld = ContourLoopDetector(cldp)
-        self.allContours = []
-        r:ContourLoopsInCell = cld.run(self.images[forCell])
+        r:ContourLoopsInCell = self.getContourLoops(forCell, circRange, granularity, engine)
 
         return r.getJSLabelingContours(numLevelsPerFoci)
 
-    def extractContours(self,abortSignal:Callable, circRange:Tuple[int,int], granularity:int, forCells:List[int] = None, progressMsg:str = 'Extracting Contour Candidates'):
-        """Extracts all contours in the dataset"""
-        cldp = ContourLoopDetectorParams(circRange,granularity)
-        cld = ContourLoopDetector(cldp)
+    def extractLabellingContourArrays(self,forCell:int, circRange:Tuple[int,int], granularity:int, numLevelsPerFoci:int = 20, engine:str = 'levels')->CellContours:
+        """
+        Same as extractLabellingContour, but returns the contours in a CellContours container, for use in python
+        without the conversion to and from JSON.
+        """
+        r:ContourLoopsInCell = self.getContourLoops(forCell, circRange, granularity, engine)
+
+        return r.getLabelingContours(numLevelsPerFoci)
+
+    def extractContours(self,abortSignal:Callable, circRange:Tuple[int,int], granularity:int, forCells:List[int] = None,
+                        progressMsg:str = 'Extracting Contour Candidates', engine:str = 'levels', numWorkers:int = 1,
+                        partialFun:Callable[[List[int]],None] = None):
+        """
+        Extracts all contours in the dataset
+        Args:
+            numWorkers (int): Number of processes to split the cells between, 1 extracts all cells in this process.
+            partialFun (Callable): Called with the indices of cells whose loops are available, as soon as they are. Cells can be
+            reported out of order, when extracting in parallel.
+        """
         self.allContours = []
         if forCells is None:
             forCells = range(0,len(self.images))
 
+        self.__useParams(circRange, granularity, engine)
+        toCompute = [c for c in forCells if c not in self.__loopsByCell]
+        numChunks = min(numWorkers, len(toCompute) // self.minCellsPerWorker)
+        reported = set() #cells already passed to partialFun
+        if numChunks > 1:
+            #memoized cells are available right away
+            reported = set(forCells) - set(toCompute)
+            if partialFun is not None and len(reported) > 0:
+                partialFun(sorted(reported))
+            self.__extractContoursParallel(abortSignal, circRange, granularity, toCompute, progressMsg, engine, numChunks, partialFun)
+            reported.update(toCompute)
+
         for i,c in enumerate(forCells):
-            img = self.images[c]
-            eeljs_sendProgress(i/len(forCells),progressMsg)
-            self.allContours += [cld.run(img)]
+            if numChunks <= 1: eeljs_sendProgress(i/len(forCells),progressMsg)
+            self.allContours += [self.getContourLoops(c, circRange, granularity, engine)]
+            if partialFun is not None and c not in reported:
+                partialFun([c])
 
             if abortSignal():
-                raise RuntimeError('Aborted execution.')
\ No newline at end of file
+                raise RuntimeError('Aborted execution.')
+
+    def __extractContoursParallel(self, abortSignal:Callable, circRange:Tuple[int,int], granularity:int, cells:List[int],
+                                  progressMsg:str, engine:str, numWorkers:int, partialFun:Callable[[List[int]],None] = None):
+        """
+        Detects the loops of the given cells in a pool of numWorkers processes and memoizes them. The images are copied once into
+        a shared memory block, workers receive chunks of cellsPerChunk cells.
+        """
+        #pack all images into one block, aligned to 8 bytes
+        layout = []
+        size = 0
+        for c in cells:
+            img = self.images[c]
+            layout += [(size, img.shape, img.dtype.str)]
+            size += (img.nbytes + 7) // 8 * 8
+
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        try:
+            for c, (offset, shape, dtype) in zip(cells, layout):
+                np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[:] = self.images[c]
+
+            chunks = [np.arange(i, min(i + self.cellsPerChunk, len(cells))) for i in range(0, len(cells), self.cellsPerChunk)]
+            with ProcessPoolExecutor(max_workers=numWorkers) as executor:
+                futures = {executor.submit(detectContourLoopsInChunk, shm.name, [layout[i] for i in ch], circRange, granularity, engine): ch
+                           for ch in chunks}
+                numDone = 0
+                for f in as_completed(futures):
+                    #cancel all chunks that did not start yet, the running ones are waited for when the pool shuts down
+                    if abortSignal():
+                        for pending in futures: pending.cancel()
+                        raise RuntimeError('Aborted execution.')
+
+                    for i, r in zip(futures[f], f.result()):
+                        r.img = self.images[cells[i]]
+                        self.__loopsByCell[cells[i]] = r
+
+                    numDone += len(futures[f])
+                    eeljs_sendProgress(numDone / len(cells), progressMsg)
+                    if partialFun is not None:
+                        partialFun([cells[i] for i in futures[f]])
+        finally:
+            shm.close()
+            shm.unlink()
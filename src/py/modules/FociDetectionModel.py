@@ -6,7 +6,6 @@ from itertools import chain
 import matplotlib.pyplot as plt
 import numpy as np
 import skimage.measure
-from shapely.geometry import Polygon
 from skimage.measure._regionprops import RegionProperties
 
 from src.py.aggregators.focidataset import addFocusToCellSet, resetFociInCellSet
@@ -16,7 +15,7 @@ from src.py.modules.LabelingUtil import LabelingResult
 from src.py.modules.LabelingUtil.TrainingData import TrainingData
 from src.sammie.py.modules.ModuleBase import ModuleBase
 from src.py.modules.TrainingUtil.SVMClassifier import SVMClassifier
-from src.sammie.py.util.imgutil import addBorder, getPreviewImage, norm
+from src.sammie.py.util.imgutil import addBorder, getPreviewImage, norm, getPreviewPlaceholder, renderPreviews
 from src.py.util.modelutil import getCutoffLevel
 from src.sammie.py.util.shapeutil import getPolygonMaskPatch
 import xlsxwriter as xls
@@ -56,9 +55,9 @@ class FociDetectionModel(ModuleBase):
         self.trace('initialized')
         self.dataLoaded = False
 
-    def unpackParams(self,sizeadjustment,portion,**other):
+    def unpackParams(self,sizeadjustment,portion,workers = (1,),**other):
         #unpack and possibly parse/cast all parameters
-        return sizeadjustment[0],portion[0]
+        return sizeadjustment[0],portion[0],int(workers[0])
 
     def run(self, action, params, inputkeys,outputkeys):
         self.keys = FociDetectionModelKeys(inputkeys, outputkeys)
@@ -69,13 +68,19 @@ class FociDetectionModel(ModuleBase):
 
             return True
 
+        elif action == 'previews':
+            #previews of the cells visible in the UI
+            cells = [int(c) for c in params['cells']]
+            imgs = renderPreviews(lambda c: getPreviewImage(self.trainingData.imgs[c], self.keys.outFoci + '_%d' % c), cells)
+            return {'cells': cells, 'imgs': imgs}
+
         elif action == 'changefociselection':
             self.userSelectedFociPerCell = params['foci']
             d = self.session.getData(self.keys.outFoci)
             self.onGeneratedData(self.keys.outFoci, {'foci': d['foci'], 'selection': self.userSelectedFociPerCell},params)
         elif action == 'apply':
 
-            sizeAdjustment,portion = self.unpackParams(**params)
+            sizeAdjustment,portion,numWorkers = self.unpackParams(**params)
 
             if not self.dataLoaded or self.loadedPortion != portion:
                 self.loadedPortion = portion
@@ -104,17 +109,19 @@ class FociDetectionModel(ModuleBase):
 
                 #Generate the contour loops candidates
                 fociData = FociCandidateData(allCellImages)
+                #models trained before the engine could be chosen used the level by level search
+                engine = model['extractionparams'].get('engine', 'levels')
                 fociData.extractContours(self.abortSignal, model['extractionparams']['fociSize'],
                                               model['extractionparams']['granularity'][0],
-                                         progressMsg='1/2 Extracting Contour Candidates')
+                                         progressMsg='1/2 Extracting Contour Candidates', engine=engine, numWorkers=numWorkers)
 
                 #Create a full list of all contours for all foci in all cells in dataset
                 self.trainingData:TrainingData = TrainingData()
                 for i in self.cellInidices:
-                    cnt = fociData.extractLabellingContour(i,model['extractionparams']['fociSize'],
-                                              model['extractionparams']['granularity'][0])
+                    cnts = fociData.extractLabellingContourArrays(i,model['extractionparams']['fociSize'],
+                                              model['extractionparams']['granularity'][0], engine=engine)
                     #Add the cells to the training set and extract features
-                    self.trainingData.addCell(allCellImages[i], cnt['foci'])
+                    self.trainingData.addCellContours(allCellImages[i], cnts)
                     eeljs_sendProgress(i / len(self.cellInidices), '2/2 Extracting Foci Features')
                     if self.abortSignal():
                         raise RuntimeError('Aborted execution.')
@@ -125,7 +132,8 @@ class FociDetectionModel(ModuleBase):
                     allContoursInCell = self.trainingData.contours[cellIndex]
                     sel = []
                     for fociIndex,cnt in enumerate(allContoursInCell):
-                        sel += [getCutoffLevel(self.trainingData.contourLevels[cellIndex][fociIndex],cnt)[1]]
+                        sel += [getCutoffLevel(self.trainingData.contourLevels[cellIndex][fociIndex],cnt,
+                                               area=self.trainingData.getContourAreas(cellIndex,fociIndex))[1]]
                     self.allPossibleContourSelections += [sel]
                     if self.abortSignal():
                         raise RuntimeError('Aborted execution.')
@@ -141,8 +149,8 @@ class FociDetectionModel(ModuleBase):
 
                 self.modelSelectedFociPerCell = [k.copy() for k in self.userSelectedFociPerCell]
 
-                # generate preview Images for all cells
-                self.previews = [getPreviewImage(img, self.keys.outFoci + '_%d' % i) for i, img in enumerate(allCellImages)]
+                #preview images are requested by JS for the visible cells only, see 'previews' action
+                self.previews = [getPreviewPlaceholder(img) for img in allCellImages]
 
                 self.dataLoaded = True
 
@@ -199,7 +207,7 @@ class FociDetectionModel(ModuleBase):
                 if lvl == -1: continue
 
                 #get areas of all contour of this focus
-                areas = np.array([Polygon(c).area for c in self.trainingData.contours[c][f]])
+                areas = self.trainingData.getContourAreas(c, f)
                 #calculate the desired area
                 desiredArea = areas[lvl] * adjFactor
                 cc2[f] = np.argmin(np.abs(areas - desiredArea))
@@ -287,7 +295,7 @@ class FociDetectionModel(ModuleBase):
                 meanIntensity = (meanIntensity*(nmax - nmin)) + nmin
                 contourIntensity = (contourIntensity*(nmax - nmin)) + nmin
 
-                area = Polygon(self.trainingData.contours[c][f][lvl]).area
+                area = self.trainingData.getContourAreas(c, f)[lvl]
                 center = self.trainingData.getFociCenters(c, [f])
                 avgArea += [area * (scale**2)]
                 avgIntensity += [meanIntensity]
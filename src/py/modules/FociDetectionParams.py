@@ -4,7 +4,6 @@ from typing import List, Set, Tuple, Dict
 import matplotlib.pyplot as plt
 import numpy as np
 from attr import asdict
-from shapely.geometry import Polygon
 from skimage.measure._regionprops import RegionProperties
 import skimage.measure
 
@@ -13,7 +12,6 @@ from src.py.modules.FociCandidatesUtil.FociCandidateData import FociCandidateDat
 from src.py.modules.FociDetectionUtil.fdu_types import FociInfo
 from src.py.modules.LabelingUtil.TrainingData import TrainingData
 from src.py.util.modelutil import getCutoffLevel
-from src.sammie.py.eeljsinterface import eeljs_sendProgress
 from src.sammie.py.modules.ModuleBase import ModuleBase
 from src.sammie.py.util import imgutil
 from src.sammie.py.util.imgutil import norm
@@ -41,16 +39,22 @@ class FociDetectionParams(ModuleBase):
     userSelectedFociPerCell: List[List[int]] # refers to allFoci,fociBrightness
     cellsInExport: Set[int]
     allFoci:List[Dict] #x,y arrays
-    fociBrightness:List[Dict] #mean, drop
+    fociBrightness:List[List[FociInfo]] #mean, drop
+    adjustedSelections:List[List[int]] #size adjusted contour levels of the last apply, before merging
+    resultRevision:int #revision of the last apply result, JS sends back the one it holds to get incremental results
+    fociAtLevelCache:Dict[Tuple[int,int,int],Tuple[Dict,FociInfo]] #JS contour and stats by cell, focus and level
 
     def __init__(self,*args,**kwargs):
         super().__init__(*args,**kwargs)
         self.log = 'FociDetectionParams'
         self.dataLoaded = False
+        self.adjustedSelections = None
+        self.resultRevision = 0
+        self.fociAtLevelCache = {}
         self.trace('initialized')
 
-    def unpackParams(self,sizeadjustment,portion,**other):
-        return sizeadjustment[0],portion[0]
+    def unpackParams(self,sizeadjustment,portion,workers = (1,),**other):
+        return sizeadjustment[0],portion[0],int(workers[0])
 
     def run(self, action, params, inputkeys,outputkeys):
         self.keys = FociDetectionParamsKeys(inputkeys, outputkeys)
@@ -61,7 +65,7 @@ class FociDetectionParams(ModuleBase):
         elif action == 'apply':
 
             #Parse Parameters out of the dictionary arriving from JS
-            sizeAdjustment,portion = self.unpackParams(**params)
+            sizeAdjustment,portion,numWorkers = self.unpackParams(**params)
 
             # Will extract loops again
             if not self.dataLoaded or self.loadedPortion != portion:
@@ -79,102 +83,156 @@ class FociDetectionParams(ModuleBase):
                 self.allCellImages = [norm(cimg) for cimg in self.allCellImages]
                 self.cellInidices = set(range(0, len(self.allCellImages)))
 
-                #generate unnormalized images
-                self.tic()
+                #Use the TrainingData class, but without extracting the features
+                # Create a full list of all contours for all foci in all cells in dataset
+                self.trainingData: TrainingData = TrainingData()
+                self.allPossibleContourSelections = []
+                self.fociAtLevelCache = {}
+                self.dataLoaded = False
+
+                #sizes are predicted while loops of other cells are still extracted, cells are added in order though
                 fociParams = self.session.getParams(self.keys.inCandidateParameters)
                 fociData:FociCandidateData = FociCandidateData(self.allCellImages)
+                cellsWithLoops = set()
+                partialCells = []
+                def onLoopsExtracted(cells:List[int]):
+                    cellsWithLoops.update(cells)
+                    while len(self.allPossibleContourSelections) in cellsWithLoops:
+                        c = len(self.allPossibleContourSelections)
+                        self.predictFociSizes(fociData, fociParams, c)
+                        partialCells.append(c)
+
+                    if len(partialCells) > 0 and self.partialDue('foci'):
+                        self.emitPartial('foci', self.getFociResult(partialCells, sizeAdjustment))
+                        partialCells.clear()
+
+                self.tic()
                 fociData.extractContours(self.abortSignal,
                                          fociParams['fociSize'],
                                          fociParams['granularity'][0],
-                                         progressMsg='1/2 Extracting Contour Candidates')
-                self.toc('Loop Extraction')
+                                         progressMsg='Extracting Contour Candidates',
+                                         engine=fociParams.get('engine', 'levels'),
+                                         numWorkers=numWorkers,
+                                         partialFun=onLoopsExtracted)
+                self.toc('Loop Extraction and area prediction')
 
-                #Use the TrainingData class, but without extracting the features
-                # Create a full list of all contours for all foci in all cells in dataset
-                self.trainingData: TrainingData = TrainingData()
-                self.allPossibleContourSelections = []
-                self.tic()
-                for c in self.cellInidices:
-                    cnt = fociData.extractLabellingContour(c,
-                                                           fociParams['fociSize'],
-                                                           fociParams['granularity'][0],)
-                    # Add the cells to the training set
-                    self.trainingData.addCell(self.allCellImages[c], cnt['foci'],extractFeatures=False)
-                    # Make size predictions
-                    allContoursInCell = self.trainingData.contours[c]
-                    sel = []
-                    for f, cnt in enumerate(allContoursInCell):
-                        sel += [getCutoffLevel(self.trainingData.contourLevels[c][f], cnt)[1]]
-
-                    self.allPossibleContourSelections += [sel]
-
-                    eeljs_sendProgress(c / len(self.cellInidices), '2/2 Calculating Foci Sizes')
-                    if self.abortSignal():
-                        raise RuntimeError('Aborted execution.')
-
-                self.toc('area prediction')
                 self.dataLoaded = True
+                self.adjustedSelections = None
 
             # print('Current APC',self.allPossibleContourSelections[0])
             #MAKE SIZE ADJUSTMENT & MERGE IF NECESSARY
             self.tic()
-            # get the polygon data for all foci of given size
-            self.allFoci = [] #polygon data in JS format
-            self.fociBrightness = [] #brightness data
-            self.fociContourSlections = []
+            #JS keeps the last result and only needs the cells that changed since then. A finished run, whose result was dropped
+            #because a newer one superseded it, changed the state here without JS getting its result, then the revisions differ
+            incremental = self.adjustedSelections is not None and params.get('revision') == self.resultRevision
+            numCells = len(self.allPossibleContourSelections)
+            #the state is only changed once the run is finished, an aborted one may have been superseded by a newer run
+            adjustedSelections = list(self.adjustedSelections) if incremental else [None] * numCells #size adjusted levels before merging
+            fociContourSlections = list(self.fociContourSlections) if incremental else [None] * numCells
+            allFoci = list(self.allFoci) if incremental else [None] * numCells #polygon data in JS format
+            fociBrightness = list(self.fociBrightness) if incremental else [None] * numCells #brightness data
+
+            changedCells = []
             for c in self.cellInidices:
-
-                cc = self.allPossibleContourSelections[c].copy()
-                # if c == 0: print('INITIAL CC',cc)
+                if self.abortSignal():
+                    raise RuntimeError('Aborted execution.')
 
                 #make size adjustment
-                for f, lvl in enumerate(cc):
-                    # get areas of all contours of this focus
-                    areas = np.array([Polygon(cnt).area for cnt in self.trainingData.contours[c][f]])
-                    desiredArea = areas[lvl] * sizeAdjustment
-                    adjustedLevel = np.argmin(np.abs(areas - desiredArea))
-
-                    # if c == 0: print('LEVELS (%d)'%adjustedLevel, np.abs(areas - desiredArea))
-
-                    cc[f] = adjustedLevel
+                cc = self.getSizeAdjustedLevels(c, sizeAdjustment)
+                if incremental and cc == adjustedSelections[c]: continue
+                adjustedSelections[c] = cc
 
                 #Merge if necessary
                 cc = self.trainingData.mergeContours(c,cc)
-
-                self.fociContourSlections += [cc]
+                if incremental and cc == fociContourSlections[c]: continue
+                fociContourSlections[c] = cc
 
                 # if c == 0: print('ADJUSTED AND MERGED CC',cc)
 
-                cellImg = self.allCellImages[c]
-
                 #create JS format of contours
-                fociInCell = []
-                brightnessInCell = []
-                for f, lvl in enumerate(cc):
-                    if lvl == -1: continue
-                    # get the contour at adjusted level
-                    cnt = self.trainingData.contours[c][f][lvl]
-                    lvlBrightness = self.trainingData.contourLevels[c][f][lvl]
-
-                    fociInCell += [{'x': np.around((cnt[:, 1]), decimals=3).tolist(),
-                                    'y': np.around((cnt[:, 0]), decimals=3).tolist()}]
-                    brightnessInCell += [self.extractFociStats(cnt, cellImg, lvlBrightness, self.normalizationFactors[c])]
-
-                self.allFoci += [fociInCell]
-                self.fociBrightness += [brightnessInCell]
+                allFoci[c], fociBrightness[c] = self.getFociAtLevels(c, cc)
+                changedCells += [c]
 
+            self.adjustedSelections, self.fociContourSlections = adjustedSelections, fociContourSlections
+            self.allFoci, self.fociBrightness = allFoci, fociBrightness
+            self.resultRevision += 1
             self.toc('JS conversion')
 
-            #parse to JS FORMAT
-            res = []
-            for fba in self.fociBrightness:
-                res += [[asdict(fi) for fi in fba]]
-
             #Generate an output that will go to javascript for displaying on the UI side
-            return {'foci':self.allFoci,
-                    'fociData':res}
-
-    def extractFociStats(self, cnt:np.ndarray, img:np.ndarray, lvl:float, normFactor:Tuple[float, float]):
+            #cells is None if all cells are sent, otherwise the indices of the cells foci and fociData belong to
+            res = self.getFociResult(changedCells)
+            res['cells'] = changedCells if incremental else None
+            res['revision'] = self.resultRevision
+            return res
+
+    def predictFociSizes(self, fociData:FociCandidateData, fociParams:Dict, c:int):
+        """Adds the contours of cell c to the training data and predicts the size of each of its foci. Cells need to be added in order."""
+        cnts = fociData.extractLabellingContourArrays(c,
+                                               fociParams['fociSize'],
+                                               fociParams['granularity'][0],
+                                               engine=fociParams.get('engine', 'levels'))
+        # Add the cells to the training set
+        self.trainingData.addCellContours(self.allCellImages[c], cnts, extractFeatures=False)
+        # Make size predictions
+        allContoursInCell = self.trainingData.contours[c]
+        sel = []
+        for f, cnt in enumerate(allContoursInCell):
+            sel += [getCutoffLevel(self.trainingData.contourLevels[c][f], cnt, area=self.trainingData.getContourAreas(c, f))[1]]
+
+        self.allPossibleContourSelections += [sel]
+
+    def getFociResult(self, cells:List[int], sizeAdjustment:float = None)->Dict:
+        """
+        Foci and their stats of the given cells in JS format. Without sizeAdjustment the ones of the last apply are used,
+        otherwise they are computed for the adjustment, e.g. for partial results while the data is still loading.
+        """
+        foci, fociData = [], []
+        for c in cells:
+            if sizeAdjustment is None:
+                fociInCell, brightnessInCell = self.allFoci[c], self.fociBrightness[c]
+            else:
+                cc = self.trainingData.mergeContours(c, self.getSizeAdjustedLevels(c, sizeAdjustment))
+                fociInCell, brightnessInCell = self.getFociAtLevels(c, cc)
+
+            foci += [fociInCell]
+            fociData += [[asdict(fi) for fi in brightnessInCell]]
+
+        return {'foci': foci, 'fociData': fociData, 'cells': list(cells)}
+
+    def getSizeAdjustedLevels(self, c:int, sizeAdjustment:float)->List[int]:
+        cc = self.allPossibleContourSelections[c].copy()
+        for f, lvl in enumerate(cc):
+            # get areas of all contours of this focus
+            areas = self.trainingData.getContourAreas(c, f)
+            desiredArea = areas[lvl] * sizeAdjustment
+            cc[f] = int(np.argmin(np.abs(areas - desiredArea)))
+
+        return cc
+
+    def getFociAtLevels(self, c:int, cc:List[int])->Tuple[List[Dict],List[FociInfo]]:
+        """JS contours and stats of the foci of a cell at the given levels. Both are cached per focus and level, since
+        small changes of the size adjustment only move few foci to a different level."""
+        fociInCell = []
+        brightnessInCell = []
+        for f, lvl in enumerate(cc):
+            if lvl == -1: continue
+
+            if (c, f, lvl) not in self.fociAtLevelCache:
+                # get the contour at adjusted level
+                cnt = self.trainingData.contours[c][f][lvl]
+                lvlBrightness = self.trainingData.contourLevels[c][f][lvl]
+                self.fociAtLevelCache[(c, f, lvl)] = ({'x': np.around((cnt[:, 1]), decimals=3).tolist(),
+                                                       'y': np.around((cnt[:, 0]), decimals=3).tolist()},
+                                                      self.extractFociStats(cnt, self.allCellImages[c], lvlBrightness, self.normalizationFactors[c],
+                                                                            self.trainingData.getContourAreas(c, f)[lvl]))
+
+            jsCnt, stats = self.fociAtLevelCache[(c, f, lvl)]
+            fociInCell += [jsCnt]
+            brightnessInCell += [stats]
+
+        return fociInCell, brightnessInCell
+
+    def extractFociStats(self, cnt:np.ndarray, img:np.ndarray, lvl:float, normFactor:Tuple[float, float], area:float):
         binMaskOuter, offx, offy = getPolygonMaskPatch(cnt[:, 1],
                                                        cnt[:, 0], 0)
 
@@ -184,7 +242,6 @@ class FociDetectionParams(ModuleBase):
                                                                img[offy:offy + binMaskOuter.shape[0],
                                                                offx:offx + binMaskOuter.shape[1]])
 
-        area = Polygon(cnt).area
         nmin, nmax = normFactor
         #If regions are very small, the binary mask won't have any pixels and regionprops will be empty.
         if (regionArr is None or len(regionArr) == 0):
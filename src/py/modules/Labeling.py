@@ -1,4 +1,7 @@
+from typing import Dict
+
 import src.py.exporters as exporters
+from src.py.modules.FociCandidatesUtil.CellContours import CellContours
 from src.py.modules.FociCandidatesUtil.FociCandidateData import FociCandidateData
 from src.py.modules.LabelingUtil.LabelingResult import LabelingResult
 from src.py.modules.LabelingUtil.TrainingData import TrainingData
@@ -23,11 +26,13 @@ class Labeling(ModuleBase):
     trainingData: TrainingData
     labelingResult: LabelingResult
     keys: LabelingKeys
+    labelingContours: Dict[int, CellContours] #contours sent to the UI by cell, to not rebuild them from the JS data once labeled
 
     def __init__(self,*args,**kwargs):
         super().__init__(*args,**kwargs)
         self.log = 'Labeling'
         self.fullDataset = None
+        self.labelingContours = {}
         self.trace('initialized')
 
     def unpackParams(self,border,intensityRange):
@@ -48,7 +53,10 @@ class Labeling(ModuleBase):
             numCellsInTrainingData = len(self.trainingData.imgs)
 
             #Add new cell to trainind data
-            self.trainingData.addCell(cellImg,labelingFoci,False)
+            if cell in self.labelingContours:
+                self.trainingData.addCellContours(cellImg,self.labelingContours.pop(cell),False)
+            else:
+                self.trainingData.addCell(cellImg,labelingFoci,False)
 
             #process splits and userFoci into final format
             userFoci = self.trainingData.transformUserSplits(numCellsInTrainingData, userFoci, userSplits)
@@ -71,7 +79,9 @@ class Labeling(ModuleBase):
             datasetParams = self.session.getParams(self.keys.inCandidateParameters)
 
             #Generate all the contours (and send progress)
-            labellingData = self.fullDataset.extractLabellingContour(params['cell'],datasetParams['fociSize'],datasetParams['granularity'][0],20)
+            cellContours = self.fullDataset.extractLabellingContourArrays(params['cell'],datasetParams['fociSize'],datasetParams['granularity'][0],20,
+                                                                          datasetParams.get('engine', 'levels'))
+            self.labelingContours[params['cell']] = cellContours
 
             #When restarting again, the training data needs to be reset as it grows as cells get labeled
             if params['reset']:
@@ -79,7 +89,7 @@ class Labeling(ModuleBase):
                 self.labelingResult = LabelingResult()
 
             #Extract the format needed for labeling
-            return labellingData
+            return {'foci': cellContours.toJS()}
 
     def exportData(self, key: str, path: str, **args):
         #Example for exporting, allexporters are inside exporters package
@@ -143,7 +143,7 @@ class LabelingResult:
             #randomly generated sequence of foci/non-foci
             for j,p in enumerate(cc):
                 if p != -1:
-                    cc[j] = getCutoffLevel(data.contourLevels[c][j], data.contours[c][j])[1]
+                    cc[j] = getCutoffLevel(data.contourLevels[c][j], data.contours[c][j], area=data.getContourAreas(c, j))[1]
 
             contourChoices += [cc]
 
@@ -1,9 +1,11 @@
 from math import sqrt
 
 import numpy as np
-from typing import List
+from typing import List, Dict
 
 import skimage
+from scipy import ndimage as ndi
+from skimage.morphology import convex_hull_image
 from matplotlib.axes import Axes
 from shapely.geometry import Polygon, Point
 import matplotlib.pyplot as plt
@@ -13,23 +15,41 @@ from src.sammie.py.util import imgutil
 
 #Class responsible for loading the TrainingData. = > Human labels and images of cells.
 #Can also pickle everything for easier/faster loading next time.
-from src.py.util.modelutil import getCutoffLevel
+from src.py.util.modelutil import getCutoffLevel, getPolygonAreas
 from src.sammie.py.util.shapeutil import getPolygonMaskPatch
+from src.py.modules.FociCandidatesUtil.CellContours import CellContours
 
 
 class TrainingData:
 
     #N = Num images, M = num available contours per focis,
     imgs: List[np.ndarray] #N - List of images of cells as 0-1 normed grayscale numpy array
-    contours: List[List[List[np.ndarray]]] # NxFxMxKx2 For each cell N and foci F, give a set of M contours as K x 2 numpy array coordinates
-    contourLevels: List[List[List[float]]] #NxFxM For each cell N and foci F and conotur M give its grayscale value
+    contours: List[CellContours] # NxFxMxKx2 For each cell N and foci F, give a set of M contours as K x 2 numpy array coordinates
+    contourLevels: List[List[np.ndarray]] #NxFxM For each cell N and foci F and conotur M give its grayscale value
     features: List[List[np.ndarray]] #NxFxM For each cell N and foci F and conotur M give its grayscale value
+    contourAreas: Dict[int,List[np.ndarray]] #N x F x M areas of the contours of cells, computed on first access, see getContourAreas
 
     def __init__(self):
         self.imgs = []
         self.features = []
         self.contours = []
         self.contourLevels = []
+        self.contourAreas = {}
+
+    def getContourAreas(self,cellNum:int, fociNum:int)->np.ndarray:
+        """Areas of all M contours of a focus. The areas of all contours of a cell are computed once, when first needed."""
+        #training data pickled with older versions has no area table
+        if not hasattr(self, 'contourAreas'): self.contourAreas = {}
+
+        if cellNum not in self.contourAreas:
+            cnts = self.contours[cellNum]
+            if isinstance(cnts, CellContours):
+                self.contourAreas[cellNum] = cnts.getAreas()
+            else: #nested lists of contours in training data pickled with older versions
+                areas = getPolygonAreas([cnt for f in cnts for cnt in f])
+                self.contourAreas[cellNum] = np.split(areas, np.cumsum([len(f) for f in cnts])[:-1]) if len(cnts) > 0 else []
+
+        return self.contourAreas[cellNum][fociNum]
 
     def mergeContours(self,cellNum:int, levelIDs:List[int])->List[int]:
         """For a given cell and a set of chosen contours at level given by levelIDs will look if
@@ -37,32 +57,44 @@ class TrainingData:
         Returns the new levelIDs array, with -1 placed where a contour has been merge"""
 
         #No overlap if only one focus
-        if len(levelIDs) <= 1: return levelIDs
+        fociNums = [fociNum for fociNum,fociLevel in enumerate(levelIDs) if fociLevel != -1]
+        if len(fociNums) <= 1: return levelIDs
 
         #Extract the contours in question
-        cnts = [self.contours[cellNum][fociNum][fociLevel] for fociNum,fociLevel in enumerate(levelIDs) if fociLevel != -1]
-        #Transform to shapely polygons
         #Since first and last points are identical, this leads to a very rare mistake in shapely polygons
         #where the resulting polygon is not "is_valid" and this crashes everything, we therefore exclude
-        #a last point. 
-        poly:List[Polygon] = [Polygon(focus[:-2,:]) for focus in cnts]
+        #a last point.
+        cnts = [self.contours[cellNum][fociNum][levelIDs[fociNum]][:-2,:] for fociNum in fociNums]
 
-        newLevelIDs = levelIDs.copy()
-        #Check for overlaps in these contours
-        for i,p1 in enumerate(poly):
-            if not p1.is_valid: continue
-            for j,p2 in enumerate(poly):
+        #Only contours with overlapping bounding boxes can intersect with an area > 0, pairs are in the order i < j
+        mins = np.array([c.min(axis=0) for c in cnts])
+        maxs = np.array([c.max(axis=0) for c in cnts])
+        boxOverlap = np.logical_and(np.all(mins[:, None, :] < maxs[None, :, :], axis=2), np.all(mins[None, :, :] < maxs[:, None, :], axis=2))
+        pairs = np.argwhere(np.triu(boxOverlap, 1))
 
-                if j <= i: continue
-                if not p2.is_valid: continue
-                if newLevelIDs[i] == -1 or newLevelIDs[j] == -1: continue #one partner already elimenated
+        #Transform to shapely polygons, only if needed
+        poly:Dict[int,Polygon] = {}
+        def getPoly(i):
+            if i not in poly: poly[i] = Polygon(cnts[i])
+            return poly[i]
 
-                #intersection is enough, since for closed contour loops it implies bigger contains smaller
-                if p1.intersection(p2).area > 0:
-                    if p1.area >= p2.area: #elimate p2
-                        newLevelIDs[j] = -1
-                    else: #elimate p1
-                        newLevelIDs[i] = -1
+        newLevelIDs = levelIDs.copy()
+        #Check for overlaps in these contours
+        for i,j in pairs:
+            fi, fj = fociNums[i], fociNums[j]
+            if newLevelIDs[fi] == -1 or newLevelIDs[fj] == -1: continue #one partner already elimenated
+
+            p1, p2 = getPoly(i), getPoly(j)
+            if not p1.is_valid or not p2.is_valid: continue
+
+            #intersection is enough, since for closed contour loops it implies bigger contains smaller
+            #containment is cheaper to test, the intersection is only computed if it is not given
+            contained = p1.area > 0 and p2.area > 0 and (p1.contains(p2) or p2.contains(p1))
+            if contained or p1.intersection(p2).area > 0:
+                if p1.area >= p2.area: #elimate p2
+                    newLevelIDs[fj] = -1
+                else: #elimate p1
+                    newLevelIDs[fi] = -1
 
         return newLevelIDs
 
@@ -103,15 +135,14 @@ class TrainingData:
             imgutil.plotContour(ax, contours[i][0], c + '-')
             imgutil.plotContour(ax, contours[i][-1], c + ':')
 
-    def extractCellFeatures(self,img, allLevels: List[List[float]], allContourSet: List[List[np.ndarray]]):
+    def extractCellFeatures(self,img, allLevels: List[List[float]], allContourSet: List[List[np.ndarray]], allAreas: List[np.ndarray] = None):
 
         """Extracts the features from the foci of a single cell"""
 
         imCenterRows, imCenterCols = img.shape[0] / 2, img.shape[1] / 2
-        res = []
+        res = self.__extractFociFeatures(img, allLevels, allContourSet, allAreas)
         for i, levels in enumerate(allLevels):
             contourSet = allContourSet[i]
-            ff = self.__extractFociFeatures(img, levels, contourSet)
 
             # normalized distance to center
             r, c = np.mean(contourSet[0], axis=0)
@@ -119,54 +150,92 @@ class TrainingData:
             dc = abs(imCenterCols - c) / imCenterCols
 
             # add Cell-dependant features
-            ff += [
+            res[i] += [
                 i / len(allLevels),  # brightness ranking inside the cell
                 sqrt(dr ** 2 + dc ** 2)  # normalized distance to the center
             ]
-            res += [ff]
 
         return res
 
-    def __extractFociFeatures(self,img, levels: List[float], contourSet: List[np.ndarray]):
-        b, cl = getCutoffLevel(np.array(levels), contourSet)
-
-        # get foci mask
-        binMaskOuter, offx, offy = getPolygonMaskPatch(contourSet[cl][:, 1], contourSet[cl][:, 0], 0)
-
-        # get image region and analyze it, sometimes contour will be very slim and not capture any pixels.
-        regCenter = None
-        if min(binMaskOuter.shape) > 0:
-            regCenter = skimage.measure.regionprops(binMaskOuter.astype('int'),
-                                                                  img[offy:offy + binMaskOuter.shape[0],
-                                                                  offx:offx + binMaskOuter.shape[1]])
-
-        #A case that may happen with very very small narrow contour lopps (due to user settings) that contain
-        #less than one pixel across, meaning that close to no pixels constitute the focus
-        #Because of rounding errors the mask becomes all 0 and there is no area to analyze
-        #in that case we simply return a 0 vector.
-        if(regCenter is None or len(regCenter) == 0):
-            return [0]*10
+    def __extractFociFeatures(self,img, allLevels: List[List[float]], allContourSet: List[List[np.ndarray]], allAreas: List[np.ndarray] = None):
+        """
+        Extracts the features of the regions of all foci of a cell at their cutoff level. The same as reading them from
+        skimage.measure.regionprops for each focus, but intensity statistics and moments are computed for all foci at once.
+        """
+        numFoci = len(allLevels)
+        cutoffs = []
+        regions, rows, cols = [], [], []
+        convexAreas, filledAreas = np.zeros(numFoci), np.zeros(numFoci)
+        for i, levels in enumerate(allLevels):
+            contourSet = allContourSet[i]
+            b, cl = getCutoffLevel(np.array(levels), contourSet, area=allAreas[i] if allAreas is not None else None)
+            cutoffs += [b]
+
+            # get foci mask, cut to the image
+            binMaskOuter, offx, offy = getPolygonMaskPatch(contourSet[cl][:, 1], contourSet[cl][:, 0], 0)
+            binMaskOuter = binMaskOuter[0:img.shape[0] - offy, 0:img.shape[1] - offx]
+
+            # sometimes contour will be very slim and not capture any pixels.
+            r, c = np.nonzero(binMaskOuter)
+            if len(r) == 0: continue
+
+            regions += [np.full(len(r), i)]
+            rows += [r + offy]
+            cols += [c + offx]
+
+            # convex hull and holes need the shape of the region, as regionprops sees it in its bounding box
+            regionImg = binMaskOuter[r.min():r.max() + 1, c.min():c.max() + 1]
+            convexAreas[i] = np.count_nonzero(convex_hull_image(regionImg))
+            filledAreas[i] = np.count_nonzero(ndi.binary_fill_holes(regionImg))
+
+        if len(regions) > 0:
+            regions, rows, cols = np.concatenate(regions), np.concatenate(rows), np.concatenate(cols)
         else:
-            regCenter = regCenter[0]
-        # Feature vector
-        return [
-            regCenter.max_intensity / img.max(),
-            regCenter.mean_intensity / img.max(),
-            regCenter.min_intensity / img.max(),
-            regCenter.area,
-            regCenter.eccentricity,
-            regCenter.solidity,
-            regCenter.filled_area / (img.shape[0] * img.shape[1]),  # size in relation to whole cell
-            levels[-1] / levels[0],
-            b / levels[0],
-            levels[0] - levels[-1],  # levels range
-        ]
+            regions, rows, cols = np.zeros(0, dtype='int'), np.zeros(0, dtype='int'), np.zeros(0, dtype='int')
+
+        vals = img[rows, cols]
+        area = np.bincount(regions, minlength=numFoci)
+        meanIntensity = np.bincount(regions, vals, minlength=numFoci) / np.maximum(area, 1)
+        maxIntensity = np.full(numFoci, -np.inf)
+        np.maximum.at(maxIntensity, regions, vals)
+        minIntensity = np.full(numFoci, np.inf)
+        np.minimum.at(minIntensity, regions, vals)
+        eccentricity = imgutil.getRegionEccentricities(regions, rows, cols, numFoci)
+
+        res = []
+        for i, levels in enumerate(allLevels):
+            #A case that may happen with very very small narrow contour lopps (due to user settings) that contain
+            #less than one pixel across, meaning that close to no pixels constitute the focus
+            #Because of rounding errors the mask becomes all 0 and there is no area to analyze
+            #in that case we simply return a 0 vector.
+            if area[i] == 0:
+                res += [[0]*10]
+                continue
+
+            # Feature vector
+            res += [[
+                maxIntensity[i] / img.max(),
+                meanIntensity[i] / img.max(),
+                minIntensity[i] / img.max(),
+                area[i],
+                eccentricity[i],
+                area[i] / convexAreas[i], #solidity
+                filledAreas[i] / (img.shape[0] * img.shape[1]),  # size in relation to whole cell
+                levels[-1] / levels[0],
+                cutoffs[i] / levels[0],
+                levels[0] - levels[-1],  # levels range
+            ]]
+
+        return res
 
     def addCell(self,img:np.ndarray, foci, debug:bool = False, extractFeatures:bool = True ):
+        #foci are in the JS format of ContourLoopsInCell.getJSLabelingContours
+        self.addCellContours(img, CellContours.fromJS(foci), debug, extractFeatures)
+
+    def addCellContours(self,img:np.ndarray, cnts:CellContours, debug:bool = False, extractFeatures:bool = True ):
         self.imgs += [img]
-        cnts = [[np.column_stack((cnt['y'], cnt['x'])) for cnt in f] for f in foci]
-        lvls = [[cnt['lvl'] for cnt in f] for f in foci]
         self.contours += [cnts]
+        lvls = cnts.getLevels()
         self.contourLevels += [lvls]
         if debug:
             plt.imshow(img,'gray')
@@ -177,7 +246,9 @@ class TrainingData:
 
         #extract the features for new cell and add to dataset
         if(extractFeatures):
-            self.features += [self.extractCellFeatures(img, lvls, cnts)]
+            cellNum = len(self.contours) - 1
+            areas = [self.getContourAreas(cellNum, f) for f in range(len(cnts))]
+            self.features += [self.extractCellFeatures(img, lvls, cnts, areas)]
 
     def getFociPerCell(self):
         cells = range(0,len(self.features))
@@ -5,6 +5,8 @@ import cv2
 import numpy as np
 import skimage.draw
 import skimage.measure
+from scipy import ndimage
+from scipy.spatial import cKDTree
 
 from src.sammie.py.modules.ModuleBase import ModuleBase
 from src.sammie.py.util import imgutil
@@ -24,85 +26,68 @@ class Thinning(ModuleBase):
         self.trace('initialized')
         self.runNumber = 0
 
-    def checkPointConnectivity(self,r1, c1, r2, c2, gr1, gc1, maxDistSquared, gr2=None, gc2=None, ):
-        dist = (r1 - r2) ** 2 + (c1 - c2) ** 2
-        if dist > maxDistSquared: return False, None
+    def checkPointConnectivity(self, p1: np.ndarray, p2: np.ndarray, g1: np.ndarray, maxDistSquared, g2: np.ndarray = None):
+        """
+        Tests all pairs of points p1[i] -> p2[i] (N x 2 pixel coordinates) at once.
+        Returns a boolean mask of the pairs that can be connected and their squared distances.
+        """
+        d = p2 - p1
+        dist = np.sum(d ** 2, axis=1)
+        canConnect = dist <= maxDistSquared
 
         # check if p2 is above the plane defined by g1 and vice versa. e.g. gradients are showing towards the respective other point
-        l1 = gr1 * (r2 - r1) + gc1 * (c2 - c1)
-        if l1 < 0: return False, None
-
-        if gr2 != None and gc2 != None:
-            l2 = gr2 * (r1 - r2) + gc2 * (c1 - c2)
-            if l2 < 0: return False, None
+        # written as negated comparison, undefined gradients (isolated pixels) do not reject a pair
+        canConnect &= ~(np.sum(g1 * d, axis=1) < 0)
+        if g2 is not None:
+            canConnect &= ~(np.sum(g2 * -d, axis=1) < 0)
 
         # check if gradients' angle is close enough to 180deg
         # grDist = (gr1+gr2)**2 + (gc1+gc2)**2
         # if grDist > maxGradAdditionLenSq: continue #gradients not opposing enough within boundaries
 
-        return True, dist
+        return canConnect, dist
 
     # Will join a singlePixel point with the closes non-single-pixel line creating a T shaped junction
     def joinOpenTs(self,singlePixels, gradients, ignorePoints, thinnedImage, maxGap=30):
-        maxGapSqr = maxGap ** 2
-
-        joinCoordinates = []  # 4 x num connections [r1,c1,r2,c2]
-        usedPoints = []  # num connections [p1,p2,p3...]
-        p1 = -1
-
-        for r1, c1 in singlePixels:
-            p1 += 1
-            if p1 in ignorePoints: continue
-
-            gr1, gc1 = gradients[p1]
-            # look at all pixels within a given distance
-            searchArea = thinnedImage[r1 - maxGap:r1 + maxGap + 1, c1 - maxGap:c1 + maxGap + 1]
-            searchPixels = list(zip(*np.nonzero(searchArea)))
-            shortestDist = None
-            bestConnection = None
-            for r2, c2 in searchPixels:
-                if r2 == maxGap and c2 == maxGap: continue
-                canConnect, distSqr = self.checkPointConnectivity(maxGap, maxGap, r2, c2, gr1, gc1, maxGapSqr)
-                if canConnect:
-                    if shortestDist is None or shortestDist > distSqr:
-                        bestConnection = (r2 - maxGap + r1, c2 - maxGap + c1)
-                        shortestDist = distSqr
-
-            # connect with the point that is closest under the connectivity condition
-            if bestConnection is not None:
-                joinCoordinates += [[r1, c1, bestConnection[0], bestConnection[1]]]
-                usedPoints += [p1]
-
-        return usedPoints, joinCoordinates
-
-    # will analyze a point wether or not it can be joined with another or with the image
-    def joinOpenEnds(self,singlePixels, gradients, thinnedImage: np.ndarray, maxGap=30):
+        candidates = np.setdiff1d(np.arange(len(singlePixels)), ignorePoints)
+        skeletonPixels = np.argwhere(thinnedImage) #row-major order, ties in distance go to the first pixel
+        if len(candidates) == 0: return candidates, np.zeros((0, 4), dtype='int')
+        # the search window around an endpoint closer than maxGap to the top or left edge of the image starts outside of it and is empty
+        candidates = candidates[np.all(singlePixels[candidates] >= maxGap, axis=1)]
+        if len(candidates) == 0: return candidates, np.zeros((0, 4), dtype='int')
+
+        # all skeleton pixels within maxGap of an endpoint, the radius is padded and checked exactly below
+        pairs = cKDTree(singlePixels[candidates]).sparse_distance_matrix(cKDTree(skeletonPixels), maxGap + 0.5, output_type='ndarray')
+        ep = candidates[pairs['i']]
+        px = pairs['j']
+
+        canConnect, distSqr = self.checkPointConnectivity(singlePixels[ep], skeletonPixels[px], gradients[ep], maxGap ** 2)
+        canConnect &= distSqr > 0 #the endpoint itself
+        ep, px, distSqr = ep[canConnect], px[canConnect], distSqr[canConnect]
+
+        # connect with the point that is closest under the connectivity condition
+        order = np.lexsort((px, distSqr, ep))
+        ep, px = ep[order], px[order]
+        best = np.ones(len(ep), dtype='bool')
+        best[1:] = ep[1:] != ep[:-1]
+        ep, px = ep[best], px[best]
+
+        return ep, np.hstack([singlePixels[ep], skeletonPixels[px]])
+
+    # will analyze all points wether or not they can be joined with one another
+    def joinOpenEnds(self,singlePixels, gradients, maxGap=30):
 
         # if needed checking for angle difference
         # maxGradAdditionLenSq = 2 * math.cos(math.radians(180 - maxAngleDev)) + 2
-        mgs = maxGap ** 2
-        joinPoints = []
-        joinPointsCoods = []
-        p1 = 0
-        for r1, c1 in singlePixels:
-            if p1 == len(singlePixels) - 1: continue
-
-            for p2 in range(p1 + 1, len(singlePixels)):
-                if p1 == 21 and p2 == 25:
-                    k = 0
-                r2, c2 = singlePixels[p2, :]
-
-                gr1, gc1 = gradients[p1]
-                gr2, gc2 = gradients[p2]
+        # candidate pairs p1 < p2 within maxGap, the radius is padded and checked exactly below
+        joinPoints = cKDTree(singlePixels).query_pairs(maxGap + 0.5, output_type='ndarray')
+        joinPoints = joinPoints[np.lexsort((joinPoints[:, 1], joinPoints[:, 0]))]
+        p1, p2 = joinPoints[:, 0], joinPoints[:, 1]
 
-                canConnect = self.checkPointConnectivity(r1, c1, r2, c2, gr1, gc1, mgs, gr2, gc2)[0]
-                if canConnect:
-                    joinPoints += [[p1, p2]]
-                    joinPointsCoods += [[r1, c1, r2, c2]]
+        canConnect = self.checkPointConnectivity(singlePixels[p1], singlePixels[p2], gradients[p1], maxGap ** 2, gradients[p2])[0]
+        joinPoints = joinPoints[canConnect]
 
-            p1 += 1
-
-        return np.array(joinPoints, dtype='uint8'), joinPointsCoods
+        return joinPoints, np.hstack([singlePixels[joinPoints[:, 0]], singlePixels[joinPoints[:, 1]]])
 
     def getSinglePixelDirections(self, singlePixels: np.ndarray, thinnedImage: np.ndarray, backtrackingLength=5) -> np.ndarray:
         gradients = np.zeros_like(singlePixels, dtype='float')
@@ -156,29 +141,31 @@ class Thinning(ModuleBase):
         thinnedImage = cv2.copyMakeBorder(thinnedImage, maxGap, maxGap, maxGap, maxGap, cv2.BORDER_CONSTANT).astype(
             'int')
 
-        singlePixels = []
-        # only search pixels that are not directly on the border of the image , those are usually cut-off cells and useless
-        for r in range(int(maxGap) + 1, thinnedImage.shape[0] - maxGap - 1):
-            for c in range(int(maxGap) + 1, thinnedImage.shape[1] - maxGap - 1):
-                if thinnedImage[r, c] == 0: continue
+        # count the neighbours of every pixel at once, endpoints have at most one
+        numNeighbors = ndimage.convolve(thinnedImage, np.ones((3, 3), dtype='int'), mode='constant') - 1
+        isEndpoint = np.logical_and(thinnedImage > 0, numNeighbors <= 1)
 
-                numNeighbors = np.sum(thinnedImage[r - 1:r + 2, c - 1:c + 2]) - 1
-                if numNeighbors <= 1:
-                    singlePixels += [[r, c]]
+        # only search pixels that are not directly on the border of the image , those are usually cut-off cells and useless
+        isEndpoint[:maxGap + 1, :] = False
+        isEndpoint[-maxGap - 1:, :] = False
+        isEndpoint[:, :maxGap + 1] = False
+        isEndpoint[:, -maxGap - 1:] = False
 
-        singlePixels = np.array(singlePixels)
+        singlePixels = np.argwhere(isEndpoint)
+        if len(singlePixels) == 0: return thinnedImage[maxGap:-maxGap, maxGap:-maxGap]
 
         # after identifying single pixels we go on to estimate their direction
         # by backtracking a number of pixels or until the first fork
 
         gradients = self.getSinglePixelDirections(singlePixels, thinnedImage)
 
-        joinedOpenPoints, joinedOpenPointsCoords = self.joinOpenEnds(singlePixels, gradients, thinnedImage)
-        processedSinglePoints = list(filter(lambda pnum: pnum in joinedOpenPoints, range(0, len(singlePixels))))
+        # maxGap only defines the border, points are joined within the default distance
+        joinedOpenPoints, joinedOpenPointsCoords = self.joinOpenEnds(singlePixels, gradients)
+        processedSinglePoints = np.unique(joinedOpenPoints)
 
         joinedTPoints, joinedTPointsCoords = self.joinOpenTs(singlePixels, gradients, processedSinglePoints, thinnedImage)
 
-        allJoinedPoints = joinedTPointsCoords + joinedOpenPointsCoords
+        allJoinedPoints = np.vstack([joinedTPointsCoords, joinedOpenPointsCoords])
 
         for r1, c1, r2, c2 in allJoinedPoints:
             self.drawPixels(r1, c1, r2, c2, thinnedImage)
@@ -25,6 +25,7 @@ class Training(ModuleBase):
     keys: TrainingKeys
     model:SVMClassifier
     lastCVScore: float
+    backgroundActions = {'hypertrain'} #the hyperparameter search can take minutes, do not block other steps
 
     def __init__(self,*args,**kwargs):
         super().__init__(*args,**kwargs)
@@ -38,19 +39,20 @@ class Training(ModuleBase):
     def run(self, action, params, inputkeys,outputkeys):
         self.keys = TrainingKeys(inputkeys, outputkeys)
 
-        if action == 'hypertrain':
-            #trains the model on the trainingset
-            pass
-        elif action == 'train':
+        if action == 'train' or action == 'hypertrain':
 
             #Load data and labels
             trainingData:TrainingData = self.session.getData(self.keys.inTrainingData)
             labels:LabelingResult = self.session.getData(self.keys.inLabels)
 
-            #train the basic model
             svmParams = SVMClassifierParams(DataWhitenerNorm(),mcc)
             self.model = SVMClassifier(trainingData,labels,svmParams)
-            self.lastCVScore, testCorrelation = self.model.trainModel()
+            if action == 'hypertrain':
+                #search for the best hyperparameters on the trainingset
+                self.lastCVScore, testCorrelation = self.model.hyperTrainModel()
+            else:
+                #train the basic model
+                self.lastCVScore, testCorrelation = self.model.trainModel()
 
             self.onGeneratedData(self.keys.outModel,self.model,params)
 
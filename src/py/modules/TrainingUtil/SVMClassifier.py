@@ -1,9 +1,12 @@
+import math
+import os
 import random
-from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
 
 import numpy as np
 from sklearn import svm
-from sklearn.model_selection import GridSearchCV
+from sklearn.model_selection import GridSearchCV, StratifiedKFold
 
 from src.py.modules.LabelingUtil.LabelingResult import LabelingResult
 from src.py.modules.LabelingUtil.TrainingData import TrainingData
@@ -20,8 +23,34 @@ class SVMClassifierParams:
         self.normalizer = norm;
         self.scoreFunction = score
 
+def scoreRBFCandidates(sqDist:np.ndarray, y:np.ndarray, folds:List[Tuple[np.ndarray,np.ndarray]], gamma:float, Cs:List[float], scoreFunction:Callable)->np.ndarray:
+    """
+    Mean CV score of an RBF SVM for all values of C at a single gamma. The kernel matrix is computed once from the squared distances
+    and the kernel of each fold is reused for all C.
+    Returns: Array with one score per C, nan if a fold could not be trained.
+    """
+    K = np.exp(-gamma * sqDist)
+    scores = np.zeros((len(Cs), len(folds)))
+    for i,(train,test) in enumerate(folds):
+        if len(np.unique(y[train])) < 2:
+            scores[:, i] = np.nan
+            continue
+
+        Ktrain = K[np.ix_(train, train)]
+        Ktest = K[np.ix_(test, train)]
+        for j,C in enumerate(Cs):
+            clf = svm.SVC(kernel='precomputed', C=C)
+            clf.fit(Ktrain, y[train])
+            scores[j, i] = scoreFunction(clf, Ktest, y[test])
+
+    return np.mean(scores, axis=1)
+
 class SVMClassifier:
 
+    #grid searched by hyperTrainModel
+    gridC = np.logspace(-1,4,15)
+    gridGamma = np.logspace(-8,1,40)
+
     def __init__(self,data:TrainingData, qr:LabelingResult,params:SVMClassifierParams):
         self.params = params
 
@@ -51,7 +80,7 @@ class SVMClassifier:
             for i,pred in enumerate(p):
                 if not pred: cutoffs += [-1]
                 else:
-                    cutoffs += [getCutoffLevel(data.contourLevels[cell][i], data.contours[cell][i])[1]]
+                    cutoffs += [getCutoffLevel(data.contourLevels[cell][i], data.contours[cell][i], area=data.getContourAreas(cell, i))[1]]
 
             #Check if any of the predicted contours include another one and elimenate the smaller of the two.
             #i.e. merge smaller into bigger.
@@ -107,38 +136,106 @@ class SVMClassifier:
 
         return cvError, testError
 
-    def hyperTrainModel(self):
+    def hyperTrainModel(self, halving:bool = True, numWorkers:int = None, factor:int = 3):
+        """
+        Searches C and gamma of the RBF SVM on the grid gridC x gridGamma and trains the model with the best parameters.
+        If halving is set, a successive halving search with precomputed kernels is used (see __halvingSearch), otherwise an exhaustive GridSearchCV.
+        numWorkers defaults to the number of CPUs.
+        Returns: CV and test score of the trained model, same as trainModel
+        """
         util.tic()
         print('Starting Hyper Training for Model')
-        param_grid = {'C': np.logspace(-1,4,15),
-                      'gamma':np.logspace(-8,1,40)}
-
-        gcv = GridSearchCV(svm.SVC(),
-                           param_grid,
-                           # n_iter=50,
-                           scoring=self.params.scoreFunction,
-                           verbose=True,
-                           cv=self.params.crossFolds,
-                           refit=False,
-                           n_jobs=8)
+        if numWorkers is None:
+            numWorkers = os.cpu_count() or 1
+
+        if halving:
+            bestParams = self.__halvingSearch(numWorkers, factor)
+        else:
+            gcv = GridSearchCV(svm.SVC(),
+                               {'C': self.gridC, 'gamma': self.gridGamma},
+                               scoring=self.params.scoreFunction,
+                               verbose=True,
+                               cv=self.params.crossFolds,
+                               refit=False,
+                               n_jobs=numWorkers)
+
+            #Find a better hyperparameter set
+            gcv.fit(self.features, self.classes)
+            bestParams = gcv.best_params_
 
-        #Find a better hyperparameter set
-        gcv.fit(self.features, self.classes)
+        cvMCCUnoptimized = self.getModelError({})
+        cvMCC = self.getModelError(bestParams)
+        if cvMCC < cvMCCUnoptimized:
+            #do not use parameters, since things got worse after search
+            bestParams = {}
+            cvMCC = cvMCCUnoptimized
 
         #train the model
-        self.model = svm.SVC(**gcv.best_params_)
+        self.model = svm.SVC(**bestParams)
         self.model.fit(self.features, self.classes)
 
-        cvMCCUnoptimized = self.getModelError({})
-        cvMCC = self.getModelError(gcv.best_params_)
         testError = self.params.scoreFunction(self.model,self.features,self.classes)
         util.toc('[SVM] Trained model CV: %.2f->%.2f Test: %.2f'%(cvMCCUnoptimized,cvMCC,testError))
-        if cvMCC < cvMCCUnoptimized:
-            #do not use parameters, since things got worse after search
-            self.model = svm.SVC(**gcv.best_params_)
-            self.model.fit(self.features, self.classes)
 
-        return cvMCC
+        return cvMCC, testError
+
+    def __halvingSearch(self, numWorkers:int, factor:int):
+        """
+        Successive halving over the grid: All candidates are evaluated on a small stratified subset of the foci, only the best 1/factor
+        of them are evaluated in the next round on a factor times larger subset, until the last round uses all foci.
+        Within a round the kernel matrix of a gamma is shared by all C values and folds. Gammas are scored in parallel threads,
+        libsvm and numpy release the GIL.
+        Returns: the best parameters as dict for svm.SVC
+        """
+        X, y = self.features, self.classes
+        n = len(y)
+        candidates = [(C, g) for C in self.gridC for g in self.gridGamma]
+
+        #order foci such that every prefix has roughly the class ratio of the whole set
+        rng = np.random.default_rng(0)
+        rank = np.zeros(n)
+        classes, counts = np.unique(y, return_counts=True)
+        for cl, cnt in zip(classes, counts):
+            rank[y == cl] = (rng.permutation(cnt) + rng.random()) / cnt
+        order = np.argsort(rank, kind='stable')
+
+        #smallest subset should have enough foci of the rarer class for each fold
+        folds = self.params.crossFolds
+        minSamples = min(n, max(10 * folds, math.ceil(2 * folds * n / np.min(counts))))
+        numRounds = 1 + min(math.ceil(math.log(len(candidates), factor)), int(math.log(n / minSamples, factor)))
+
+        sq = np.sum(X ** 2, axis=1)
+        sqDist = np.maximum(sq[:, None] + sq[None, :] - 2 * X @ X.T, 0)
+
+        with ThreadPoolExecutor(max_workers=numWorkers) as executor:
+            for r in range(numRounds):
+                numSamples = n if r == numRounds - 1 else max(minSamples, int(n / factor ** (numRounds - 1 - r)))
+                sub = order[:numSamples]
+                ySub = y[sub]
+                cvFolds = list(StratifiedKFold(folds).split(np.zeros(numSamples), ySub))
+                distSub = sqDist[np.ix_(sub, sub)]
+
+                #group candidates by gamma to compute each kernel only once
+                byGamma = {}
+                for i, (C, g) in enumerate(candidates):
+                    byGamma.setdefault(g, []).append(i)
+
+                futures = {g: executor.submit(scoreRBFCandidates, distSub, ySub, cvFolds, g, [candidates[i][0] for i in idx], self.params.scoreFunction)
+                           for g, idx in byGamma.items()}
+                scores = np.full(len(candidates), -np.inf)
+                for g, f in futures.items():
+                    scores[byGamma[g]] = np.nan_to_num(f.result(), nan=-np.inf)
+
+                print('[SVM] Halving round %d/%d: %d candidates on %d foci, best score %.3f' % (r + 1, numRounds, len(candidates), numSamples, np.max(scores)))
+                if r == numRounds - 1:
+                    break
+
+                #keep the best candidates, stable so that ties are resolved in grid order
+                keep = np.sort(np.argsort(-scores, kind='stable')[:math.ceil(len(candidates) / factor)])
+                candidates = [candidates[i] for i in keep]
+
+        C, g = candidates[int(np.argmax(scores))]
+        return {'C': C, 'gamma': g}
 
     def getCVModelErrorForCurModel(self):
         return self.getModelError({'C':self.model.C,'gamma':self.model.gamma})
@@ -1,8 +1,23 @@
-from sklearn.metrics import matthews_corrcoef
+import numpy as np
 
 #All accept an sklearn model a freature set and the training labels.
 
 #Matthews correlation coefficient.
 def mcc(model,X,ytrue):
     ypred = model.predict(X)
-    return matthews_corrcoef(ytrue, ypred)
+    return matthewsCorrcoef(ytrue, ypred)
+
+def matthewsCorrcoef(ytrue, ypred)->float:
+    """Same as sklearn's matthews_corrcoef, without its input validation, which dominates the runtime for the small sets of a CV search."""
+    labels, inv = np.unique(np.concatenate((ytrue, ypred)), return_inverse=True)
+    n = len(ytrue)
+    conf = np.bincount(inv[:n] * len(labels) + inv[n:], minlength=len(labels) ** 2).reshape((len(labels), len(labels))).astype('float')
+
+    tSum, pSum = conf.sum(axis=1), conf.sum(axis=0)
+    covYtYp = np.trace(conf) * n - np.dot(tSum, pSum)
+    covYpYp = n ** 2 - np.dot(pSum, pSum)
+    covYtYt = n ** 2 - np.dot(tSum, tSum)
+    if covYpYp * covYtYt == 0:
+        return 0.0
+
+    return covYtYp / np.sqrt(covYtYt * covYpYp)
@@ -1,14 +1,37 @@
 from typing import List
 
 import numpy as np
-from shapely.geometry import Polygon
 
 from src.sammie.py.util import imgutil
 
 
-def getCutoffLevel(levels:np.ndarray, contours:List[np.ndarray], debug:bool = False):
-    # compute area of the polygons
-    area = np.array([Polygon(c).area for c in contours])
+def getPolygonAreas(contours:List[np.ndarray])->np.ndarray:
+    """
+    Areas of a list of K x 2 polygons, the first point may be repeated at the end. Computed in one go with the shoelace formula,
+    giving the same as shapely's Polygon(c).area.
+    """
+    if len(contours) == 0: return np.zeros(0)
+
+    offsets = np.concatenate([[0], np.cumsum([len(c) for c in contours])])
+    return getFlatPolygonAreas(np.concatenate(contours), offsets)
+
+def getFlatPolygonAreas(coords:np.ndarray, offsets:np.ndarray)->np.ndarray:
+    """Same as getPolygonAreas, for polygons stored in one P x 2 array, polygon i being coords[offsets[i]:offsets[i+1]]"""
+    if len(offsets) <= 1: return np.zeros(0)
+
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    #shift each polygon to its first point, to keep the precision for polygons far from the origin
+    pts = coords - np.repeat(coords[starts], lengths, axis=0)
+    nxt = np.arange(1, len(pts) + 1)
+    nxt[starts + lengths - 1] = starts
+    cross = pts[:, 0] * pts[nxt, 1] - pts[nxt, 0] * pts[:, 1]
+    return np.abs(np.add.reduceat(cross, starts)) / 2
+
+def getCutoffLevel(levels:np.ndarray, contours:List[np.ndarray], debug:bool = False, area:np.ndarray = None):
+    # compute area of the polygons, if they have not been precomputed
+    if area is None:
+        area = getPolygonAreas(contours)
     areasq = np.sqrt(area)
 
     #resample for numerical differentiation
@@ -10,7 +10,7 @@ import {
     PipelineDataAggregatorID,
     PipelineDataKey
 } from "../types/datatypes";
-import {addExecutionCallback} from "./eelJsFunctions";
+import {addExecutionCallback, addPartialListener, removePartialListener, supersedeExecutionCallback} from "./eelJsFunctions";
 import {Pipeline, PipelineDataLoader, PipelineStep} from "../types/pipelinetypes";
 import {ModuleID} from "../types/uitypes";
 import {ParameterKey} from "../modules/paramtypes";
@@ -81,15 +81,17 @@ export async function abortStep(threadID: EelThreadKey): Promise<any> {
  * @param params
  * @param step
  * @param customThreadID
+ * @param onPartial Called with partial results the step sends before it is finished, see ModuleBase.emitPartial
  */
-export async function runStepAsync<T>(moduleName: string, action: string, params: any, step: PipelineStep<any, any>, customThreadID: EelThreadKey = null): Promise<EelResponse<T>> {
+export async function runStepAsync<T>(moduleName: string, action: string, params: any, step: PipelineStep<any, any>, customThreadID: EelThreadKey = null,
+                                      onPartial: (key: string, chunk: any) => void = null): Promise<EelResponse<T>> {
     const args = [moduleName,
         step.moduleID,
         action,
         params,
         Object.values(step.inputKeys || {}),
         Object.values(step.outputKeys || {})];
-    return runEelEndpointAsync<T>(customThreadID || step.moduleID, EelPythonFunctions.runStepAsync, args);
+    return runEelEndpointAsync<T>(customThreadID || step.moduleID, EelPythonFunctions.runStepAsync, args, onPartial);
 }
 
 /**
@@ -208,14 +210,18 @@ function parseEelError<T>(err: { errorText: string, errorTraceback: string }): E
 const debug = true;
 var num = 0;
 
-async function runEelEndpointAsync<T>(threadID: EelThreadKey, endpoint: EelPythonFunctions, params: any = {}): Promise<EelResponse<T>> {
+async function runEelEndpointAsync<T>(threadID: EelThreadKey, endpoint: EelPythonFunctions, params: any = {},
+                                       onPartial: (key: string, chunk: any) => void = null): Promise<EelResponse<T>> {
     if (!eel) return {error: 'Eel Not initialized', errorTrace: []};
     var curExec = num++;
     debug && console.log(`[runEelEndpointAsync ${curExec}]: Contacting ${endpoint} in thread ${endpoint} with params:`, params);
+    //partial results can arrive before the call below returns
+    if (onPartial) addPartialListener(threadID, onPartial);
     try {
         
         //Start execution
-        await eel[endpoint](threadID, ...params)();
+        const started = await eel[endpoint](threadID, ...params)();
+        if (started?.superseded > 0) supersedeExecutionCallback(threadID);
         
         //wait for the eel process to send a callback
         var data = await new Promise<T>((resolve, reject) => {
@@ -227,6 +233,8 @@ async function runEelEndpointAsync<T>(threadID: EelThreadKey, endpoint: EelPytho
     } catch (e) {
         debug && console.log(`[runEelEndpointAsync ${curExec}]: ERROR ${e.errorText}`);
         return parseEelError<T>(e)
+    } finally {
+        if (onPartial) removePartialListener(threadID, onPartial);
     }
     return {data: data};
 }
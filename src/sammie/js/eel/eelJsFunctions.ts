@@ -4,6 +4,7 @@ import * as ui from '../state/uistates'
 //***************************************************************/
 import {getConnectedValue, updateConnectedValue} from "../state/ConnectedStore";
 import {EelThreadKey} from "./eel";
+import {fetchPackedResult, unpackResult} from "./resulttransport";
 
 const callbacks:Record<EelThreadKey, { resolve:(data: any)=>void, reject:(data: any)=>void }> = {}
 export function removeExecutionCallback(callbackID:EelThreadKey, callbackFun){
@@ -14,6 +15,31 @@ export function removeExecutionCallback(callbackID:EelThreadKey, callbackFun){
 export function addExecutionCallback(callbackID:EelThreadKey, callbackFun, abortFun){
     callbacks[callbackID] = {resolve:callbackFun, reject:abortFun}
 }
+/**Python dropped the older run with this ID in favour of a newer one (see jobscheduler.py), it will not answer anymore.*/
+export function supersedeExecutionCallback(callbackID:EelThreadKey){
+    if(callbacks[callbackID] === undefined) return;
+    callbacks[callbackID].reject({errorText:'Superseded by a newer run.'})
+    delete callbacks[callbackID];
+}
+
+const partialListeners:Record<EelThreadKey, (key:string, chunk:any)=>void> = {}
+/**Receives partial results python sends while the step is running, see ModuleBase.emitPartial. Needs to be added before the step is started.*/
+export function addPartialListener(callbackID:EelThreadKey, listener:(key:string, chunk:any)=>void){
+    partialListeners[callbackID] = listener
+}
+export function removePartialListener(callbackID:EelThreadKey, listener:(key:string, chunk:any)=>void){
+    //a newer run with the same ID might have replaced the listener already
+    if(partialListeners[callbackID] === listener) delete partialListeners[callbackID];
+}
+window['__eel_js_partialResult'] = function(callbackID:EelThreadKey, key:string, chunk:any) {
+    if(partialListeners[callbackID] === undefined) return;
+    partialListeners[callbackID](key, chunk);
+    
+    //make the partial results visible under the overlay
+    var curOverlay = getConnectedValue(ui.overlay)
+    if(curOverlay && !curOverlay.partial)
+        updateConnectedValue(ui.overlay,{...curOverlay, partial:true})
+}
 window['__eel_js_progress'] = function(x:number,msg:string) {
     var curOverlay = getConnectedValue(ui.overlay)
     if(curOverlay){
@@ -25,12 +51,26 @@ window['__eel_js_progress'] = function(x:number,msg:string) {
     }
 }
 
-window['__eel_js_asyncFinished'] = function(callbackID:EelThreadKey,data) {
-    if(callbacks[callbackID] === undefined) return;
+window['__eel_js_asyncFinished'] = async function(callbackID:EelThreadKey,data) {
+    const cb = callbacks[callbackID];
+    if(cb === undefined) return;
     if( data['json'] === true )
         data = JSON.parse(data['res'])
+    else if( data['binary'] === true ){
+        //large results are fetched separately, see resulttransport.py
+        try{
+            data = unpackResult(await fetchPackedResult(data['url']))
+        }catch (e){
+            if(callbacks[callbackID] !== cb) return;
+            cb.reject({errorText: e.errorText || 'Could not load result: ' + e});
+            delete callbacks[callbackID];
+            return;
+        }
+        //the step might have been aborted or restarted while loading
+        if(callbacks[callbackID] !== cb) return;
+    }
     
-    callbacks[callbackID].resolve(data);
+    cb.resolve(data);
     delete callbacks[callbackID];
 }
 window['__eel_js_asyncError'] = function(callbackID:EelThreadKey,data) {
@@ -0,0 +1,42 @@
+//***************************************************************/
+//* Binary results of asynchronous steps, see resulttransport.py */
+//***************************************************************/
+
+/**Loads a packed result from python. gzip compression is undone by the browser.*/
+export async function fetchPackedResult(url:string):Promise<ArrayBuffer>{
+    const resp = await fetch(url);
+    if(!resp.ok) throw {errorText: 'Could not load result: ' + resp.status + ' ' + resp.statusText};
+    return await resp.arrayBuffer();
+}
+
+/**
+ * Restores the result from its packed form. Polygons replaced by {__poly:index} get their x and y coordinates back.
+ * Layout: uint32 header length | JSON header | float32 x | float32 y | uint32 offsets
+ */
+export function unpackResult(buffer:ArrayBuffer):any{
+    const headerLength = new DataView(buffer).getUint32(0,true);
+    const header = JSON.parse(new TextDecoder('utf-8').decode(new Uint8Array(buffer,4,headerLength)));
+    const n = header.numPoints;
+    const start = 4 + headerLength;
+    const xs = new Float32Array(buffer, start, n);
+    const ys = new Float32Array(buffer, start + n * 4, n);
+    const offsets = new Uint32Array(buffer, start + n * 8, header.numPolygons + 1);
+
+    const restore = (obj:any):any => {
+        if(Array.isArray(obj)) return obj.map(restore);
+        if(obj === null || typeof obj !== 'object') return obj;
+
+        const res = {};
+        for (const k in obj) {
+            if(k !== '__poly') res[k] = restore(obj[k]);
+        }
+        if(obj.__poly !== undefined){
+            const p = obj.__poly;
+            res['x'] = Array.from(xs.subarray(offsets[p], offsets[p + 1]));
+            res['y'] = Array.from(ys.subarray(offsets[p], offsets[p + 1]));
+        }
+        return res;
+    };
+
+    return restore(header.res);
+}
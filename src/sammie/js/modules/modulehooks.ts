@@ -6,7 +6,7 @@ import * as eventbus from "../state/eventbus";
 import {ParametersChangedPayload} from "../state/eventbus";
 import {useEffect, useState} from "react";
 import {OverlayState} from "../types/uitypes";
-import {abortStep} from "../eel/eel";
+import {abortStep, EelResponse} from "../eel/eel";
 import {PipelineStep} from "../types/pipelinetypes";
 import {DisplayOptionSetting} from "../ui/modules/DisplayOptions";
 import {ParameterKey} from "./paramtypes";
@@ -220,4 +220,37 @@ export function useToggleKeys(keys:string[]|string){
     if(keys.length == 1) return isDown[keys[0]]
     //for multiple keys return an array
     return isDown
-}
\ No newline at end of file
+}
+
+/**
+ * Steps with many cells return placeholders for their preview images (url is null), this hook requests the
+ * previews of the visible cells from the server whenever they change.
+ * Only the previews of visible cells are kept, since the server might drop images that have not been requested for a while.
+ * @param visible Indices of the currently visible cells
+ * @param loadPreviews Server call, returning the previews for a list of cell indices
+ * @param source Result the previews belong to, loaded previews are discarded when it changes.
+ * @return The loaded previews by cell index
+ */
+export function useLazyPreviews<T>(visible:number[], loadPreviews:(cells:number[])=>Promise<EelResponse<{cells:number[],imgs:T[]}>>, source:any):Record<number, T>{
+    const [loaded,setLoaded] = useState<{source:any, imgs:Record<number, T>}>({source:null, imgs:{}})
+    const previews = loaded.source === source ? loaded.imgs : {}
+    
+    const visibleKey = visible?.join(',')
+    useEffect(()=>{
+        if(!visible || !source) return;
+        const missing = visible.filter((c)=>!(c in previews))
+        if(missing.length == 0) return;
+        
+        var outdated = false
+        loadPreviews(missing).then((res)=>{
+            if(outdated || res.error) return;
+            const imgs:Record<number, T> = {}
+            visible.forEach((c)=>{ if(c in previews) imgs[c] = previews[c] })
+            res.data.cells.forEach((c,k)=>imgs[c] = res.data.imgs[k])
+            setLoaded({source:source, imgs:imgs})
+        })
+        return ()=>{outdated = true}
+    },[visibleKey, source])
+    
+    return previews
+}
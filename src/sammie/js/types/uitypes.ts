@@ -20,6 +20,9 @@ export type OverlayState = {
     /**Default is blocking, but some algorihtms might be non-blocking
      * Blocking will overlay the parameter side bar and make it inaccessible.*/
     nonBlocking?:boolean
+    
+    /**Set once the running step sent partial results, the overlay then lets them shine through.*/
+    partial?:boolean
 }
 
 
@@ -49,7 +49,7 @@ const ProgressOverlay: React.FC<IProgressOverlayProps> = ({sidebarActive, classN
     },[overlay])
     
     return (
-        <div className={(className||'') +" progress-overlay fl-row pad-200-top" + cl(state.open,'open') + cl(sidebarActive,'with-sidebar')}>
+        <div className={(className||'') +" progress-overlay fl-row pad-200-top" + cl(state.open,'open') + cl(sidebarActive,'with-sidebar') + cl(state.open && overlay?.partial,'partial')}>
             <div className={'progress-overlay__content site-block narrow pad-200-hor'}>
                 <div className={'margin-50-bottom'}>
                     {msg}
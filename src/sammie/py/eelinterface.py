@@ -1,12 +1,15 @@
 import json
 import math
 import os
-import threading
+import time
 import traceback
 from typing import Dict, List
 
+import bottle
 import eel
 
+from src.sammie.py import previewstore, resulttransport, settings
+from src.sammie.py.jobscheduler import Job, JobScheduler, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
 from src.sammie.py.ModuleConnector import ModuleConnector
 from src.sammie.py.SessionData import SessionData
 
@@ -42,18 +45,72 @@ def getModule(moduleID: str, moduleName: str):
 
     return modulesById[moduleID]
 
-def startThreadInModule(m:ModuleBase, asyncKey:int, params):
-    print("[Eel]: Started Run in separate thread with execKey %s"%(asyncKey))
-    m.startingRun()  # indicate that we started, important to be able to abort
+@bottle.route('/preview')
+def servePreview():
+    """Serves images of the in memory preview store, which are encoded when they are requested for the first time."""
+    res = previewstore.previews.get(bottle.request.query.key)
+    if res is None:
+        return bottle.HTTPError(404, 'Preview not available')
+
+    data, mimeType, etag = res
+    headers = {'ETag': '"%s"' % etag, 'Cache-Control': 'no-cache', 'Access-Control-Allow-Origin': '*'} #react dev server runs on a different port
+    if bottle.request.get_header('If-None-Match') == headers['ETag']:
+        return bottle.HTTPResponse(status=304, headers=headers)
+
+    return bottle.HTTPResponse(data, headers=dict(headers, **{'Content-Type': mimeType}))
+
+@bottle.route('/result')
+def serveResult():
+    """Streams a packed result of an asynchronous step, see getResultMessage."""
+    res = resulttransport.results.pop(bottle.request.query.key)
+    if res is None:
+        return bottle.HTTPError(404, 'Result not available')
+
+    compress = settings.COMPRESS_RESULTS and 'gzip' in bottle.request.get_header('Accept-Encoding', '')
+    bottle.response.content_type = 'application/octet-stream'
+    bottle.response.set_header('Cache-Control', 'no-store')
+    bottle.response.set_header('Access-Control-Allow-Origin', '*') #react dev server runs on a different port
+    if compress:
+        bottle.response.set_header('Content-Encoding', 'gzip')
+
+    return resulttransport.streamResult(res, compress)
+
+def getResultMessage(asyncKey, res) -> Dict:
+    """Results with many coordinates are packed and fetched by JS from the result route, others are sent as JSON through the websocket."""
+    if settings.BINARY_RESULTS and resulttransport.PackedResult.estimateBytes(res) >= settings.BINARY_RESULT_MIN_BYTES:
+        try:
+            packed = resulttransport.PackedResult(res)
+        except (TypeError, ValueError, OverflowError):
+            #fall back to JSON for anything the binary format can not take
+            traceback.print_exc()
+        else:
+            return {'binary': True, 'url': resulttransport.results.put(str(asyncKey), packed)}
+
+    return {'json': True, 'res': json.dumps(res)}
+
+def startThreadInModule(job:Job):
+    """Runs a job of the scheduler, the module has been told that it is starting."""
+    m, asyncKey = job.module, job.execKey
+    print("[Eel]: Started Run in separate thread with execKey %s after waiting %.2fs"%(asyncKey, job.started - job.submitted))
     try:
-        res = m.run(*params)
+        res = m.run(*job.args)
     except Exception as e:
+        #JS is waiting for the newer run with this key, which would otherwise receive this error
+        if job.superseded:
+            print("[Eel]: Superseded Thread %s ended"%(asyncKey))
+            return
         traceback.print_exc()
         print("[Eel]: Error or Abort in Thread %s"%(asyncKey))
         eel.asyncError(asyncKey, {'errorText':str(e)})
     else:
-        print("[Eel]: Ending Thread %s"%(asyncKey))
-        eel.asyncFinished(asyncKey, {'json':True,'res': json.dumps(res)})
+        if job.superseded:
+            print("[Eel]: Dropping result of superseded Thread %s"%(asyncKey))
+            return
+        print("[Eel]: Ending Thread %s after %.2fs"%(asyncKey, time.time() - job.started))
+        eel.asyncFinished(asyncKey, getResultMessage(asyncKey, res))
+
+#Runs all asynchronous steps
+scheduler: JobScheduler = JobScheduler(settings.STEP_WORKERS, startThreadInModule)
 
 @eel.expose
 def loadInputFile(pipelinekey:str, path:str, loaderName:str, loaderArgs:Dict, batchPreviewIdx:int = -1):
@@ -120,6 +177,10 @@ def onNewPipelineLoaded(pipelineID:str, pipelineParamsByModuleID:Dict = None):
     session = SessionData()
     moduleConnector = getModuleConnector()
     fileLoader = FileLoader(session, moduleConnector)
+    previewstore.previews.clear()
+    #runs of the old pipeline will not answer, JS stops waiting for them
+    for job in scheduler.clear():
+        eel.asyncError(job.execKey, {'errorText':'Aborted execution.'})
     print('[EEL] New Pipeline loaded %s'%pipelineID)
     return True
 
@@ -154,11 +215,21 @@ def runStepAsync(threadID, moduleName: str, moduleID: str, action:str, params: D
         outputsStr = ', '.join(outputs) if inputs is not None else '-'
         print('[Eel]: Async Running %s(%s) with inputs: [%s] -> [%s]' % ( moduleID, moduleName, inputsStr,outputsStr))
 
-    #start execution in a separate thread
+    #queue execution, it runs in one of the scheduler's threads
     modulesByExecutionKey[threadID] = m
-    tmp = threading.Thread(target=startThreadInModule, args = (m,threadID,[action, params, inputs,outputs]) )
-    tmp.start()
-    # eel.spawn(startThreadInModule, m, threadID, [action, params, inputs,outputs])
+    priority = PRIORITY_BACKGROUND if action in m.backgroundActions else PRIORITY_INTERACTIVE
+    superseded = scheduler.submit(Job(threadID, m, action, [action, params, inputs,outputs], priority))
+    if log:
+        metrics = scheduler.getMetrics()
+        print('[Eel]: Queued %s, superseding %d older runs (%d queued, %d running)' % (threadID, len(superseded), metrics['queued'], metrics['running']))
+
+    #JS stops waiting for the superseded runs, they will not answer
+    return {'superseded': len(superseded)}
+
+@eel.expose
+def getSchedulerMetrics():
+    """Queue depth and run times of asynchronous steps, see JobScheduler.getMetrics"""
+    return scheduler.getMetrics()
 
 
 
@@ -170,6 +241,12 @@ def runStepAsync(threadID, moduleName: str, moduleID: str, action:str, params: D
 
 @eel.expose
 def abortStep(execKey:str):
+    #runs that have not started yet are simply dropped
+    if scheduler.cancel(execKey) is not None:
+        print("[Eel]: Removed thread %s from the queue"%(execKey))
+        eel.asyncError(execKey, {'errorText':'Aborted execution.'})
+        return
+
     if execKey in modulesByExecutionKey:
         m = modulesByExecutionKey[execKey]
         m.abort()
@@ -2,6 +2,21 @@ import eel
 
 #This file contains functions that can be called from PY to JS.
 
+#When running without a browser (see headless.py) progress is passed to this function instead of JS
+progressHandler = None
+#Same for partial results, see ModuleBase.emitPartial
+partialHandler = None
+
 #Sends progress of current step to JS interface
 def eeljs_sendProgress(progress:float, msg:str = None):
-    eel.progress(progress,msg)
\ No newline at end of file
+    if progressHandler is not None:
+        progressHandler(progress,msg)
+        return
+    eel.progress(progress,msg)
+
+#Sends a part of the result of a step running asynchronously under execKey to JS, before the step has finished
+def eeljs_sendPartial(execKey:str, key:str, chunk):
+    if partialHandler is not None:
+        partialHandler(execKey,key,chunk)
+        return
+    eel.partialResult(execKey,key,chunk)
@@ -0,0 +1,143 @@
+import argparse
+import json
+import sys
+import traceback
+from typing import Dict, List
+
+from src.py.__config import getModuleConnector
+from src.sammie.py import eeljsinterface
+from src.sammie.py import eelutil
+from src.sammie.py import settings
+from src.sammie.py.ModuleConnector import ModuleConnector
+from src.sammie.py.SessionData import SessionData
+from src.sammie.py.modules.FileLoader import FileLoader
+from src.sammie.py.modules.ModuleBase import ModuleBase
+
+
+class HeadlessPipeline:
+    """
+    Runs a pipeline without the browser UI, e.g. for processing a large number of files overnight.
+    Modules, loaders and aggregators are driven the same way eelinterface does it when called from JS.
+
+    A pipeline description is a dictionary (usually read from a JSON file) of the form:
+    {
+        "inputs": [{"key": "Source Image", "loader": "loadIntensityImage", "loaderArgs": {}}, ...],
+        "batches": [["/data/cell1.tif", ...], ...], #One file per input, alternatively "patterns": ["/data/*.tif", ...]
+        "steps": [{"moduleName": "Threshhold", "moduleID": "Threshhold", "action": "apply", "params": {...},
+                   "inputs": ["Source Image"], "outputs": ["Mask"], "serverParams": {}}, ...],
+        "aggregators": [{"aggregatorID": "appendToCellSet", "path": "/data/result.cells", "params": {}, "reset": false}, ...]
+    }
+    """
+
+    pipeline: Dict
+    session: SessionData
+    moduleConnector: ModuleConnector
+    fileLoader: FileLoader
+    modulesById: Dict[str, ModuleBase]
+    log: bool = True
+
+    def __init__(self, pipeline: Dict, skipPreviews: bool = True):
+        self.pipeline = pipeline
+        self.session = SessionData()
+        self.moduleConnector = getModuleConnector()
+        self.fileLoader = FileLoader(self.session, self.moduleConnector)
+        self.modulesById = {}
+
+        settings.SKIP_PREVIEWS = skipPreviews
+        settings.IN_MEMORY_PREVIEWS = False #no server to serve them from, previews go into the tmp folder
+        if not skipPreviews:
+            eelutil.createTmpFolder(settings.TMP_FOLDER)
+
+        #there is no JS to send progress to
+        eeljsinterface.progressHandler = self.onProgress
+
+    def trace(self, msg: str):
+        if self.log: print('[Headless]: %s' % msg)
+
+    def onProgress(self, progress: float, msg: str = None):
+        if progress < 0:
+            self.trace(msg if msg is not None else '...')
+        else:
+            self.trace('%d%% %s' % (progress * 100, msg if msg is not None else ''))
+
+    def getModule(self, moduleID: str, moduleName: str, serverParams: Dict = None) -> ModuleBase:
+        if moduleID not in self.modulesById:
+            params = serverParams if serverParams is not None else {}
+            m = self.moduleConnector.initializeModule(moduleID, moduleName, params, self.session)
+            if m is None:
+                raise RuntimeError('Module "%s" does not exist' % moduleName)
+            self.modulesById[moduleID] = m
+
+        return self.modulesById[moduleID]
+
+    def getBatches(self) -> List[List[str]]:
+        """List of batches, each batch being a list of file paths, one per input."""
+        if 'batches' in self.pipeline:
+            return self.pipeline['batches']
+
+        extensions = [None] * len(self.pipeline['patterns'])
+        globs = self.fileLoader.getFileGlob(self.pipeline['patterns'], extensions)
+        return [[f['path'] if f is not None else None for f in batch] for batch in globs]
+
+    def runStep(self, step: Dict):
+        m = self.getModule(step['moduleID'], step['moduleName'], step.get('serverParams'))
+        self.trace('Running action: %s on %s(%s)' % (step['action'], step['moduleID'], step['moduleName']))
+        m.startingRun()
+        return m.run(step['action'], step['params'], step['inputs'], step['outputs'])
+
+    def runBatch(self, batchKey: List[str]):
+        for i, inp in enumerate(self.pipeline['inputs']):
+            if batchKey[i] is None:
+                raise RuntimeError('No file for input "%s" in batch %s' % (inp['key'], batchKey))
+            self.fileLoader.loadFile(inp['key'], batchKey[i], inp['loader'], inp.get('loaderArgs', {}))
+
+        for step in self.pipeline['steps']:
+            self.runStep(step)
+
+        for agg in self.pipeline.get('aggregators', []):
+            res = self.moduleConnector.runAggregator(agg['aggregatorID'], agg['path'], self.session, self.modulesById,
+                                                     batchKey, agg.get('params', {}))
+            self.trace('%s: %s' % (agg['aggregatorID'], res.msg))
+
+    def run(self) -> List[Dict]:
+        """
+        Runs all batches of the pipeline. A failing batch is logged and skipped, so that the remaining ones are still processed.
+        Returns: A list with one entry per batch with its batchKey and an error message or None if it succeeded.
+        """
+        for agg in self.pipeline.get('aggregators', []):
+            if agg.get('reset', False):
+                self.moduleConnector.resetAggregatorFile(agg['aggregatorID'], agg['path'])
+
+        batches = self.getBatches()
+        results = []
+        for b, batchKey in enumerate(batches):
+            self.trace('Batch %d/%d: %s' % (b + 1, len(batches), ', '.join([str(f) for f in batchKey])))
+            try:
+                self.runBatch(batchKey)
+            except Exception as e:
+                traceback.print_exc()
+                self.trace('Error in batch %d: %s' % (b + 1, str(e)))
+                results += [{'batchKey': batchKey, 'error': str(e)}]
+            else:
+                results += [{'batchKey': batchKey, 'error': None}]
+
+        numFailed = len([r for r in results if r['error'] is not None])
+        self.trace('Finished %d batches, %d failed' % (len(results), numFailed))
+        return results
+
+
+def runPipelineFile(path: str, skipPreviews: bool = True) -> List[Dict]:
+    with open(path, 'r') as handle:
+        pipeline = json.load(handle)
+
+    return HeadlessPipeline(pipeline, skipPreviews).run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a pipeline described in a JSON file without the browser UI.')
+    parser.add_argument('pipeline', help='Path to the JSON pipeline description')
+    parser.add_argument('--previews', action='store_true', help='Write preview images into the tmp folder as the UI would')
+    args = parser.parse_args()
+
+    res = runPipelineFile(args.pipeline, not args.previews)
+    sys.exit(1 if any(r['error'] is not None for r in res) else 0)
@@ -0,0 +1,169 @@
+import threading
+import time
+import traceback
+from typing import Callable, Dict, List, Optional
+
+from src.sammie.py.modules.ModuleBase import ModuleBase
+
+#Priorities of jobs, lower ones run first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class Job:
+    """A single asynchronous run of a module action, see JobScheduler."""
+    execKey: str #key JS identifies the run by, used for callbacks and aborting
+    module: ModuleBase
+    action: str
+    args: List #arguments passed to module.run
+    priority: int
+    seq: int #order of submission, jobs of equal priority run first come first serve
+    superseded: bool #a newer job with the same execKey has been submitted, JS is not waiting for this one anymore
+    submitted: float
+    started: Optional[float]
+
+    def __init__(self, execKey: str, module: ModuleBase, action: str, args: List, priority: int = PRIORITY_INTERACTIVE):
+        self.execKey = execKey
+        self.module = module
+        self.action = action
+        self.args = args
+        self.priority = priority
+        self.seq = 0
+        self.superseded = False
+        self.submitted = time.time()
+        self.started = None
+
+    def supersedes(self, other: 'Job') -> bool:
+        return other.execKey == self.execKey and other.action == self.action
+
+    @property
+    def statsKey(self) -> str:
+        return '%s.%s' % (self.module.id, self.action)
+
+
+class JobScheduler:
+    """
+    Runs asynchronous module actions in a bounded pool of worker threads.
+    - A newer job with the same execKey and action supersedes an older one: a queued one is dropped, a running one is aborted.
+      Other actions with the same key (e.g. small selection changes) are not dropped, but run one after the other.
+    - Jobs of the same module never run at the same time, since they would write the same session data.
+    - Interactive jobs run before background jobs (e.g. hyperparameter searches), otherwise jobs run in order of submission.
+    Keeps metrics on queue depth and run times, see getMetrics.
+    """
+
+    numWorkers: int
+    runJob: Callable[[Job], None]
+    queue: List[Job]
+    running: List[Job]
+    stats: Dict[str, Dict[str, float]] #run time statistics by module and action
+
+    def __init__(self, numWorkers: int, runJob: Callable[[Job], None]):
+        """runJob is called in a worker thread for each job, the module has already been told that it is starting."""
+        self.numWorkers = numWorkers
+        self.runJob = runJob
+        self.queue = []
+        self.running = []
+        self.stats = {}
+        self.numSubmitted = 0
+        self.numSuperseded = 0
+        self.maxQueued = 0
+        self.cond = threading.Condition()
+        self.workers = []
+
+    def submit(self, job: Job) -> List[Job]:
+        """Queues the job. Returns the older jobs it supersedes, queued ones have been dropped and running ones aborted."""
+        with self.cond:
+            superseded = [q for q in self.queue if job.supersedes(q)]
+            self.queue = [q for q in self.queue if not job.supersedes(q)]
+            for r in self.running:
+                if job.supersedes(r) and not r.superseded:
+                    r.module.abort()
+                    superseded += [r]
+            for s in superseded: s.superseded = True
+            self.numSuperseded += len(superseded)
+
+            self.numSubmitted += 1
+            job.seq = self.numSubmitted
+            self.queue += [job]
+            self.maxQueued = max(self.maxQueued, len(self.queue))
+
+            #workers are only started when needed
+            if len(self.workers) < self.numWorkers:
+                t = threading.Thread(target=self.__work, daemon=True)
+                self.workers += [t]
+                t.start()
+            self.cond.notify_all()
+
+        return superseded
+
+    def cancel(self, execKey: str) -> Optional[Job]:
+        """Drops the queued job with the given key and returns it. Running jobs are aborted through their module instead."""
+        with self.cond:
+            for job in self.queue:
+                if job.execKey == execKey:
+                    self.queue.remove(job)
+                    return job
+        return None
+
+    def clear(self) -> List[Job]:
+        """
+        Drops all queued jobs and aborts running ones, without any of them reporting back to JS.
+        Returns the jobs JS was still waiting for, the caller needs to reject them.
+        """
+        with self.cond:
+            cleared = [job for job in self.queue + self.running if not job.superseded]
+            self.queue = []
+            for job in self.running:
+                job.superseded = True
+                job.module.abort()
+        return cleared
+
+    def getMetrics(self) -> Dict:
+        with self.cond:
+            return {'workers': self.numWorkers,
+                    'queued': len(self.queue),
+                    'running': len(self.running),
+                    'maxQueued': self.maxQueued,
+                    'submitted': self.numSubmitted,
+                    'superseded': self.numSuperseded,
+                    'jobs': {k: dict(v) for k, v in self.stats.items()}}
+
+    def __nextJob(self) -> Optional[Job]:
+        busyModules = set(r.module for r in self.running)
+        candidates = [j for j in self.queue if j.module not in busyModules]
+        if len(candidates) == 0:
+            return None
+        return min(candidates, key=lambda j: (j.priority, j.seq))
+
+    def __work(self):
+        while True:
+            with self.cond:
+                job = self.__nextJob()
+                while job is None:
+                    self.cond.wait()
+                    job = self.__nextJob()
+
+                self.queue.remove(job)
+                self.running += [job]
+                job.started = time.time()
+                #inside of the lock, so an abort from a newer job can not be overwritten
+                job.module.startingRun(str(job.execKey))
+
+            try:
+                self.runJob(job)
+            except Exception:
+                #keep the worker alive
+                traceback.print_exc()
+            finally:
+                with self.cond:
+                    self.running.remove(job)
+                    self.__addStats(job, time.time())
+                    self.cond.notify_all()
+
+    def __addStats(self, job: Job, finished: float):
+        s = self.stats.setdefault(job.statsKey, {'count': 0, 'totalTime': 0.0, 'maxTime': 0.0, 'totalWait': 0.0})
+        runTime = finished - job.started
+        s['count'] += 1
+        s['totalTime'] += runTime
+        s['maxTime'] = max(s['maxTime'], runTime)
+        s['totalWait'] += job.started - job.submitted
@@ -1,22 +1,29 @@
 import abc
-from typing import List, Dict, Callable
+import time
+from typing import List, Dict, Callable, Set
 
-from src.sammie.py import SessionData
+from src.sammie.py import SessionData, settings
+from src.sammie.py.eeljsinterface import eeljs_sendPartial
 from src.sammie.py.util import util
 
 class ModuleBase(metaclass=abc.ABCMeta):
 
     id:str
     log:str = None #if log is empty, no logs will happen
+    backgroundActions:Set[str] = set() #long running actions, that are queued after interactive ones when run asynchronously
     session:SessionData
     __abortRequest:bool
     __abortRequested:Callable[[],bool]
+    __execKey:str #key of the asynchronous execution partial results are sent to, None if they can not be received
+    __lastPartial:Dict[str,float] #time of the last partial result per key
 
     #id of a module is its unique identifier
     def __init__(self, id:str, session:SessionData):
         self.id = id
         self.session = session
         self.__abortRequest = False
+        self.__execKey = None
+        self.__lastPartial = {}
 
     def abortSignal(self):
         return self.__abortRequest
@@ -52,8 +59,28 @@ class ModuleBase(metaclass=abc.ABCMeta):
     def onGeneratedData(self,key,data,params):
         self.session.onDataAdded(key,self,data,params)
 
-    def startingRun(self):
+    def startingRun(self, execKey:str = None):
+        """
+        Called before each run. execKey is the key of the asynchronous execution in eelinterface,
+        partial results are only sent if it is given, synchronous runs can not receive them.
+        """
         self.__abortRequest = False
+        self.__execKey = execKey
+        self.__lastPartial = {}
+
+    def partialDue(self, key:str)->bool:
+        """True if enough time has passed since the last partial result with this key, to avoid flooding JS with small chunks."""
+        return self.__execKey is not None and time.time() - self.__lastPartial.get(key, 0) >= settings.PARTIAL_RESULT_INTERVAL
+
+    def emitPartial(self, key:str, chunk):
+        """
+        Sends a part of the result to JS while the run is still going, e.g. results for some cells, so the UI can display them
+        before the step has finished. Key identifies the kind of result, chunk needs to be JSON serializable.
+        Does nothing for synchronous runs or if the run has been aborted.
+        """
+        if self.__execKey is None or self.__abortRequest: return
+        self.__lastPartial[key] = time.time()
+        eeljs_sendPartial(self.__execKey, key, chunk)
 
     def abort(self):
         self.trace('Abort execution requested')
@@ -0,0 +1,148 @@
+import hashlib
+import io
+import threading
+import urllib.parse
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import imageio
+import numpy as np
+from numpngw import write_png
+
+from src.sammie.py import settings
+
+mimeTypes = {'jpg': 'image/jpeg', 'png': 'image/png'}
+
+
+class PreviewEntry:
+    """A single preview image, the raw array is kept until the browser requests it and is then replaced by the encoded file.
+    The raw array is only dropped by the store while holding its lock."""
+    img: Optional[np.ndarray]
+    fmt: str #jpg or png
+    encodeArgs: Dict #passed to the encoder, e.g. transparent for png
+    etag: str #content hash
+    encoded: Optional[bytes]
+    storedBytes: int #size the store accounted this entry with
+
+    def __init__(self, img: np.ndarray, fmt: str, encodeArgs: Dict, etag: str):
+        self.img = img
+        self.fmt = fmt
+        self.encodeArgs = encodeArgs
+        self.etag = etag
+        self.encoded = None
+        self.storedBytes = 0
+        self.lock = threading.Lock()
+
+    @property
+    def numBytes(self) -> int:
+        return len(self.encoded) if self.encoded is not None else self.img.nbytes
+
+    def encode(self) -> bytes:
+        with self.lock:
+            if self.encoded is None:
+                buf = io.BytesIO()
+                if self.fmt == 'png':
+                    write_png(buf, self.img, **self.encodeArgs)
+                else:
+                    imageio.imwrite(buf, self.img, format=self.fmt, **self.encodeArgs)
+                self.encoded = buf.getvalue()
+
+        return self.encoded
+
+
+class PreviewStore:
+    """
+    Keeps preview images in memory instead of writing them into the tmp folder. Images are stored by their key,
+    encoding happens only when the browser requests an image (see the preview route in eelinterface). The least recently used
+    images are dropped once the store exceeds its byte budget.
+    URLs carry the content hash, so unchanged images are not reloaded by the browser, the hash doubles as ETag.
+    """
+
+    maxBytes: int
+    numBytes: int
+    entries: 'OrderedDict[str, PreviewEntry]'
+
+    def __init__(self, maxBytes: int):
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def getContentHash(img: np.ndarray, fmt: str, encodeArgs: Dict) -> str:
+        h = hashlib.blake2b(digest_size=12)
+        h.update(('%s|%s|%s|%s' % (img.shape, img.dtype, fmt, sorted(encodeArgs.items()))).encode())
+        h.update(img.data)
+        return h.hexdigest()
+
+    @staticmethod
+    def getURL(key: str, etag: str) -> str:
+        #the query string keeps the route static, eel's catch all route for files would otherwise shadow it
+        return settings.EEL_PATH + 'preview?key=%s&h=%s' % (urllib.parse.quote(key, safe=''), etag)
+
+    def put(self, key: str, img: np.ndarray, fmt: str, **encodeArgs) -> str:
+        """Stores the image under key, replacing an older image with the same key. Returns the URL the browser can load it from."""
+        img = np.array(img, order='C', copy=True) #caller might reuse the array
+        etag = self.getContentHash(img, fmt, encodeArgs)
+        with self.lock:
+            old = self.entries.get(key)
+            if old is not None and old.etag == etag:
+                self.entries.move_to_end(key)
+                return self.getURL(key, etag)
+
+            self.__remove(key)
+            entry = PreviewEntry(img, fmt, encodeArgs, etag)
+            self.entries[key] = entry
+            self.__account(entry)
+            self.__evict()
+
+        return self.getURL(key, etag)
+
+    def getExistingURL(self, key: str) -> Optional[str]:
+        """URL of the image stored under key or None if there is none."""
+        with self.lock:
+            entry = self.entries.get(key)
+            return self.getURL(key, entry.etag) if entry is not None else None
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str, str]]:
+        """Encoded image, its mime type and etag or None if the key is not (or no longer) in the store."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+
+        #encode outside of the store lock, so other images can be served in the meantime
+        data = entry.encode()
+        with self.lock:
+            if self.entries.get(key) is entry:
+                self.__account(entry)
+                self.__evict()
+
+        return data, mimeTypes[entry.fmt], entry.etag
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.numBytes = 0
+
+    def __account(self, entry: PreviewEntry):
+        if entry.encoded is not None:
+            entry.img = None #the raw image is not needed anymore
+        self.numBytes += entry.numBytes - entry.storedBytes
+        entry.storedBytes = entry.numBytes
+
+    def __remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.numBytes -= entry.storedBytes
+
+    def __evict(self):
+        #never evict the most recent image, even if it alone exceeds the budget
+        while self.numBytes > self.maxBytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.numBytes -= entry.storedBytes
+
+
+#Store used by imgutil and served by eelinterface
+previews: PreviewStore = PreviewStore(settings.PREVIEW_STORE_BYTES)
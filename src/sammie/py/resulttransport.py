@@ -0,0 +1,130 @@
+import json
+import struct
+import threading
+import urllib.parse
+import zlib
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+
+from src.sammie.py import settings
+
+
+class PackedResult:
+    """
+    A step result in a binary format, that is faster to build and parse than JSON for results with many polygons.
+    Every dictionary with x and y lists of numbers of equal length (the PolygonData format of JS) is replaced by {'__poly': index, ...other keys}
+    and its coordinates are moved into flat float32 buffers. The layout is:
+    uint32 header length | JSON header | padding to 4 bytes | float32 x of all points | float32 y of all points | uint32 offsets of the polygons (numPolygons + 1)
+    The header is {'res': result with replaced polygons, 'numPoints': int, 'numPolygons': int}. See resulttransport.ts for the JS side.
+    """
+
+    xs: array
+    ys: array
+    offsets: array
+
+    def __init__(self, res):
+        self.xs = array('f')
+        self.ys = array('f')
+        self.offsets = array('I', [0])
+
+        header = json.dumps({'res': self.__pack(res), 'numPoints': len(self.xs), 'numPolygons': len(self.offsets) - 1}).encode('utf-8')
+        header += b' ' * (-len(header) % 4) #typed arrays in JS need to be aligned
+        self.header = struct.pack('<I', len(header)) + header
+
+    @property
+    def numBytes(self) -> int:
+        return len(self.header) + (len(self.xs) + len(self.ys)) * 4 + len(self.offsets) * 4
+
+    @staticmethod
+    def estimateBytes(res) -> int:
+        """Bytes the coordinates of res take up when packed, found without packing. Decides if packing is worth it."""
+        return PackedResult.__countPoints(res) * 8
+
+    @staticmethod
+    def __countPoints(obj) -> int:
+        if isinstance(obj, dict):
+            x, y = obj.get('x'), obj.get('y')
+            if isinstance(x, (list, tuple, np.ndarray)) and isinstance(y, (list, tuple, np.ndarray)) and len(x) == len(y):
+                return len(x)
+            return sum([PackedResult.__countPoints(v) for v in obj.values()])
+        if isinstance(obj, (list, tuple)):
+            return sum([PackedResult.__countPoints(v) for v in obj])
+        return 0
+
+    @staticmethod
+    def __getCoordinates(d: Dict) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """x and y of a polygon as arrays. None for other data with x and y keys (e.g. values that are not numbers), which stays JSON."""
+        x, y = d.get('x'), d.get('y')
+        if not isinstance(x, (list, tuple, np.ndarray)) or not isinstance(y, (list, tuple, np.ndarray)) or len(x) != len(y):
+            return None
+        try:
+            x, y = np.asarray(x), np.asarray(y)
+        except ValueError: #ragged nested lists
+            return None
+        if x.ndim != 1 or y.ndim != 1 or x.dtype.kind not in 'fiu' or y.dtype.kind not in 'fiu':
+            return None
+        return x, y
+
+    def __pack(self, obj):
+        if isinstance(obj, dict):
+            coordinates = self.__getCoordinates(obj) if 'x' in obj and 'y' in obj else None
+            if coordinates is not None:
+                self.xs.frombytes(coordinates[0].astype('float32').tobytes())
+                self.ys.frombytes(coordinates[1].astype('float32').tobytes())
+                self.offsets.append(len(self.xs))
+                placeholder = {k: self.__pack(v) for k, v in obj.items() if k != 'x' and k != 'y'}
+                placeholder['__poly'] = len(self.offsets) - 2
+                return placeholder
+            return {k: self.__pack(v) for k, v in obj.items()}
+        if isinstance(obj, (list, tuple)):
+            return [self.__pack(v) for v in obj]
+        return obj
+
+    def getChunks(self, chunkSize: int) -> Iterator[bytes]:
+        yield self.header
+        for buffer in [self.xs, self.ys, self.offsets]:
+            data = memoryview(buffer).cast('B')
+            for i in range(0, len(data), chunkSize):
+                yield bytes(data[i:i + chunkSize])
+
+
+class ResultStore:
+    """Keeps packed results until JS fetches them from the result route (see eelinterface). A result can only be fetched once."""
+
+    results: Dict[str, PackedResult]
+
+    def __init__(self):
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def put(self, key: str, res: PackedResult) -> str:
+        """Stores the result, replacing an unfetched older one with the same key. Returns the URL JS can load it from."""
+        with self.lock:
+            self.results[key] = res
+        return settings.EEL_PATH + 'result?key=%s' % urllib.parse.quote(key, safe='')
+
+    def pop(self, key: str) -> Optional[PackedResult]:
+        with self.lock:
+            return self.results.pop(key, None)
+
+
+def streamResult(res: PackedResult, compress: bool) -> Iterator[bytes]:
+    """Chunks of the packed result, optionally gzip compressed."""
+    chunks = res.getChunks(settings.RESULT_CHUNK_BYTES)
+    if not compress:
+        yield from chunks
+        return
+
+    #fast compression level, coordinates compress well and the result should arrive quickly
+    gz = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for c in chunks:
+        data = gz.compress(c)
+        if len(data) > 0:
+            yield data
+    yield gz.flush()
+
+
+#Store used by eelinterface for results of asynchronous steps
+results: ResultStore = ResultStore()
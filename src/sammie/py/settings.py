@@ -9,3 +9,24 @@ REACT_DEV_PATH = 'http://localhost:3000/'
 
 #OTHER SETTINGS
 TMP_FOLDER = 'tmp'
+
+#When running without a browser (see headless.py) writing preview images into the tmp folder can be skipped
+SKIP_PREVIEWS = False
+
+#Preview images are kept in memory and served by the eel server (see previewstore.py), instead of being written into the tmp folder
+IN_MEMORY_PREVIEWS = True
+#Byte budget of the in memory previews, least recently used ones are dropped when it is exceeded
+PREVIEW_STORE_BYTES = 512 * 1024 * 1024
+
+#Results of asynchronous steps above this size are sent packed (see resulttransport.py) through an HTTP route instead of as JSON through the websocket
+BINARY_RESULTS = True
+BINARY_RESULT_MIN_BYTES = 256 * 1024
+RESULT_CHUNK_BYTES = 1024 * 1024
+#gzip packed results, if the browser accepts it
+COMPRESS_RESULTS = True
+
+#Minimum time in seconds between two partial results with the same key, see ModuleBase.partialDue
+PARTIAL_RESULT_INTERVAL = 0.5
+
+#Number of threads running asynchronous steps, further steps are queued (see jobscheduler.py)
+STEP_WORKERS = 4
@@ -1,6 +1,7 @@
 import math
 import os
-from typing import Tuple, List, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Union, Callable, Any, Dict
 
 import cv2
 import imageio
@@ -12,6 +13,7 @@ from numpy import ndarray
 
 from src.sammie.py import settings
 from src.sammie.py import eelutil
+from src.sammie.py import previewstore
 
 
 def meshgridForImage(img: ndarray, spacing=1):
@@ -48,6 +50,28 @@ def getPreviewHeatMap(img: np.ndarray, key: str, force: bool = True, cmap: str =
     return getPreviewImage(colored_image, key, force)
 
 
+def __publishPreview(img: np.ndarray, key: str, ext: str, force: bool, **encodeArgs) -> str:
+    """
+    Makes the image available to JS and returns its URL. Images are kept in the in memory preview store, or written into the tmp folder
+    if IN_MEMORY_PREVIEWS is off. If force is not set an already existing image with the same key is not replaced.
+    """
+    if settings.IN_MEMORY_PREVIEWS:
+        url = None if force else previewstore.previews.getExistingURL(key)
+        if url is None and not settings.SKIP_PREVIEWS:
+            url = previewstore.previews.put(key, img, ext, **encodeArgs)
+        return url if url is not None else previewstore.PreviewStore.getURL(key, '')
+
+    relPath = os.path.join(settings.TMP_FOLDER, key + '.' + ext)
+    absPath = eelutil.getFilePath(relPath)
+    if not settings.SKIP_PREVIEWS and (not os.path.exists(absPath) or force):
+        if ext == 'png':
+            write_png(absPath, img, **encodeArgs)
+        else:
+            imageio.imsave(absPath, img, **encodeArgs)
+
+    return eelutil.getFileURL(relPath, force)
+
+
 def getTmpFilePath(fileName:str):
     relPath = os.path.join(settings.TMP_FOLDER, fileName)
     return [eelutil.getFilePath(relPath),eelutil.getFileURL(relPath, True),]
@@ -57,9 +81,6 @@ def getTmpFilePath(fileName:str):
 # will not resave if force is set to false and the preview image is already available.
 def getPreviewImage(img: np.ndarray, key: str, force: bool = True, inColor:Tuple[int,int,int] = None, normalize:bool = False):
     # print('Key: %s'%key)
-    relPath = os.path.join(settings.TMP_FOLDER, key + '.jpg')
-    absPath = eelutil.getFilePath(relPath)
-
     if normalize:
         img = norm(img)
 
@@ -70,15 +91,32 @@ def getPreviewImage(img: np.ndarray, key: str, force: bool = True, inColor:Tuple
         nimg[:,:,2] = (inColor[2] * img).astype('uint8')
         img = nimg
 
-    if not os.path.exists(absPath) or force:
-        imageio.imsave(absPath, img)
-
     return {
-        'url': eelutil.getFileURL(relPath, force),
+        'url': __publishPreview(img, key, 'jpg', force),
         'w': img.shape[1],
         'h': img.shape[0]
     }
 
+def getPreviewPlaceholder(img: np.ndarray) -> Dict:
+    """Same format as getPreviewImage but without an url, for previews that JS requests later on, see renderPreviews."""
+    return {'url': None, 'w': img.shape[1], 'h': img.shape[0]}
+
+
+def renderPreviews(render: Callable[[int], Any], indices: List[int], numWorkers: int = None) -> List:
+    """
+    Calls render for each of the indices in a thread pool and returns the results in the same order.
+    Steps with many cells use this to only generate the previews of the cells that are visible in the UI.
+    """
+    if numWorkers is None:
+        numWorkers = os.cpu_count() or 1
+
+    if numWorkers <= 1 or len(indices) <= 1:
+        return [render(i) for i in indices]
+
+    with ThreadPoolExecutor(max_workers=min(numWorkers, len(indices))) as executor:
+        return list(executor.map(render, indices))
+
+
 def joinChannels(key:str, intensity1:np.ndarray, col1: Tuple[int,int,int], intensity2:np.ndarray, col2: Tuple[int,int,int], normalizeIntensityImage:bool = True):
 
     if normalizeIntensityImage:
@@ -107,33 +145,23 @@ def makeSemiTransparent(intensityImg:np.ndarray, fillColor: Tuple[int,int,int],
     colImg[:, :, 2] = fillColor[2]
     colImg[:, :, 3] = intensityImg
 
-    relPath = os.path.join(settings.TMP_FOLDER, key + '.png')
-    absPath = eelutil.getFilePath(relPath)
-
-    write_png(absPath, colImg)
-
     return {
-        'url': eelutil.getFileURL(relPath, True),
+        'url': __publishPreview(colImg, key, 'png', True),
         'w': colImg.shape[0],
         'h': colImg.shape[1]
     }
 
 def getTransparentMask(binaryMask: np.ndarray, fillColor: Tuple, key: str, force: bool = False):
-    relPath = os.path.join(settings.TMP_FOLDER, key + '.png')
-    absPath = eelutil.getFilePath(relPath)
-
     if binaryMask.dtype != np.dtype('bool'):
         binaryMask = binaryMask.astype('bool')
 
-    if not os.path.exists(absPath) or force:
-        mask = np.zeros((binaryMask.shape[0], binaryMask.shape[1], 3), dtype='uint8')
-        mask[:, :, 0] = (binaryMask * fillColor[0]).astype('uint8')
-        mask[:, :, 1] = (binaryMask * fillColor[1]).astype('uint8')
-        mask[:, :, 2] = (binaryMask * fillColor[2]).astype('uint8')
-        write_png(absPath, mask, transparent=(0, 0, 0))
+    mask = np.zeros((binaryMask.shape[0], binaryMask.shape[1], 3), dtype='uint8')
+    mask[:, :, 0] = (binaryMask * fillColor[0]).astype('uint8')
+    mask[:, :, 1] = (binaryMask * fillColor[1]).astype('uint8')
+    mask[:, :, 2] = (binaryMask * fillColor[2]).astype('uint8')
 
     return {
-        'url': eelutil.getFileURL(relPath, force),
+        'url': __publishPreview(mask, key, 'png', force, transparent=(0, 0, 0)),
         'w': binaryMask.shape[0],
         'h': binaryMask.shape[1]
     }
@@ -146,6 +174,47 @@ def getContourOfMask(binMask: ndarray, offset=(0, 0)):
     return contour
 
 
+def getLabelEccentricities(labelImg: ndarray, numLabels: int = None) -> ndarray:
+    """
+    Computes the eccentricity of all regions in a label image at once from their second order central moments,
+    same as skimage.measure.regionprops eccentricity. Returns an array where entry i belongs to label i+1.
+    """
+    if numLabels is None: numLabels = int(labelImg.max())
+
+    idx = np.flatnonzero(labelImg)
+    r, c = np.unravel_index(idx, labelImg.shape)
+    return getRegionEccentricities(labelImg.ravel()[idx] - 1, r, c, numLabels)
+
+
+def getRegionEccentricities(regions: ndarray, r: ndarray, c: ndarray, numRegions: int) -> ndarray:
+    """
+    Same as getLabelEccentricities, but for regions given as pixel coordinates r,c and the index of the region [0,numRegions) each pixel
+    belongs to. Regions may overlap, which a label image can't represent.
+    """
+    area = np.bincount(regions, minlength=numRegions).astype('float')
+    area[area == 0] = 1
+
+    #two pass central moments for numerical accuracy
+    meanR = np.bincount(regions, r, minlength=numRegions) / area
+    meanC = np.bincount(regions, c, minlength=numRegions) / area
+    dr = r - meanR[regions]
+    dc = c - meanC[regions]
+    mu20 = np.bincount(regions, dr * dr, minlength=numRegions) / area
+    mu02 = np.bincount(regions, dc * dc, minlength=numRegions) / area
+    mu11 = np.bincount(regions, dr * dc, minlength=numRegions) / area
+
+    #eigenvalues of the inertia tensor
+    halfTrace = (mu20 + mu02) / 2
+    d = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    l1 = np.clip(halfTrace + d, 0, None)
+    l2 = np.clip(halfTrace - d, 0, None)
+
+    ecc = np.zeros(numRegions)
+    nonzero = l1 > 0
+    ecc[nonzero] = np.sqrt(1 - l2[nonzero] / l1[nonzero])
+    return ecc
+
+
 def plotContour(ax: Axes, cnt, style='y:', offset=(0, 0)):
     ax.plot(cnt[:, 1] + offset[1], cnt[:, 0] + offset[0], style)
 